@@ -1,14 +1,24 @@
 import argparse
+import json
 import numpy as np
 import pandas as pd
 import torch
 import torch.nn.functional as F
 import os
-from sklearn.decomposition import PCA
-from transformers import AutoTokenizer, AutoModel, TrainingArguments, PreTrainedModel, Trainer
+import pickle
+import sys
+from functools import partial
+from sklearn.decomposition import PCA, IncrementalPCA
+from sklearn.random_projection import GaussianRandomProjection
+from transformers import AutoConfig, AutoTokenizer, AutoModel, TrainingArguments, PreTrainedModel, Trainer, DataCollatorWithPadding
 from transformers.modeling_outputs import TokenClassifierOutput
 from datasets import Dataset
 
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'LMs'))
+from utils.function.np_utils import open_npy_memmap, save_json_atomic
+from utils.function.inf_utils import TextBatchBuilder, cpu_parallel_inference, PRECISIONS, default_precision, \
+    apply_precision, check_precision_drift
+from utils.function.emb_cache import EmbCache, encode_with_cache
 
 
 
@@ -25,6 +35,303 @@ def reduce_dimension(features, n_components):
     return reduced_features
 
 
+def reduce_dimension_streaming(emb_file, n_components, method='ipca', chunk_size=10000, seed=0):
+    """Out-of-core counterpart of reduce_dimension for features that do not fit in memory.
+    The .npy is memory-mapped and consumed chunk by chunk, the fitted projection is pickled next to the output.
+    method: 'ipca' incremental PCA (two passes: fit, transform), 'rp' gaussian random projection (one pass).
+    """
+    out_file = emb_file.replace('.npy', f'_{method}{n_components}.npy')
+    if os.path.exists(out_file):
+        print(f'Existing reduced {out_file}')
+        return
+    features = np.load(emb_file, mmap_mode='r')
+    n_nodes = features.shape[0]
+    if n_nodes < n_components or features.shape[1] < n_components:
+        raise ValueError(f'Cannot reduce {features.shape} features to {n_components} dimensions')
+    if method == 'ipca':
+        # Every partial_fit needs at least n_components rows
+        chunk_size = max(chunk_size, n_components)
+        projection = IncrementalPCA(n_components=n_components)
+        for i in range(0, n_nodes, chunk_size):
+            chunk = np.asarray(features[i:i + chunk_size], dtype=np.float32)
+            if len(chunk) < n_components:
+                break  # A short tail chunk is only transformed
+            projection.partial_fit(chunk)
+    elif method == 'rp':
+        projection = GaussianRandomProjection(n_components=n_components, random_state=seed)
+        projection.fit(np.asarray(features[:1], dtype=np.float32))
+    else:
+        raise ValueError(f'Unknown reduce method {method}')
+    with open(out_file.replace('.npy', '.proj.pkl'), 'wb') as f:
+        pickle.dump(projection, f)
+
+    partial_file = out_file.replace('.npy', '.partial.npy')
+    reduced = open_npy_memmap(partial_file, (n_nodes, n_components), np.float32)
+    for i in range(0, n_nodes, chunk_size):
+        reduced[i:i + chunk_size] = projection.transform(np.asarray(features[i:i + chunk_size], dtype=np.float32))
+    reduced.flush()
+    del reduced
+    os.replace(partial_file, out_file)
+    print(f'Reduced {emb_file} to {n_components} dimensions by {method}, saved to {out_file}')
+
+
+def length_sorted_dataset(encoded_inputs):
+    # Sort the unpadded texts by length (longest first, so OOM shows up in the first batch),
+    # the collator then pads every batch only to its own longest member.
+    lengths = np.array([len(ids) for ids in encoded_inputs['input_ids']])
+    order = np.argsort(-lengths, kind='stable')
+    dataset = Dataset.from_dict({k: [v[i] for i in order] for k, v in encoded_inputs.items()})
+    return dataset, order
+
+
+def restore_node_order(predictions, order):
+    # predictions[j] belongs to node order[j]
+    restored = np.empty_like(predictions)
+    restored[order] = predictions
+    return restored
+
+
+class MultiPoolingEmbInfModel(PreTrainedModel):
+    """Compute every requested pooling from a single encoder pass.
+    poolings: subset of {'cls', 'mean', 'nomask_mean', 'last{k}_mean', 'max'}, the logits follow the same order.
+    """
+
+    def __init__(self, model, poolings, norm=False):
+        super().__init__(model.config)
+        self.encoder = model
+        self.poolings = list(poolings)
+        self.norm = norm
+        self.precision = 'fp32'
+        self.last_k = max([int(p[4:-5]) for p in self.poolings if p.startswith('last')], default=0)
+
+    @torch.no_grad()
+    def mean_pooling(self, token_embeddings, attention_mask):
+        # Mask out padding tokens
+        input_mask_expanded = attention_mask.unsqueeze(-1).to(token_embeddings.dtype)
+        masked_token_embeddings = token_embeddings * input_mask_expanded
+        # Calculate mean pooling
+        mean_embeddings = masked_token_embeddings.sum(dim=1) / torch.clamp(input_mask_expanded.sum(1), min=1e-9)
+        return mean_embeddings
+
+    @torch.no_grad()
+    def max_pooling(self, token_embeddings, attention_mask):
+        padding = (attention_mask == 0).unsqueeze(-1)
+        return token_embeddings.masked_fill(padding, torch.finfo(token_embeddings.dtype).min).max(dim=1).values
+
+    @torch.no_grad()
+    def forward(self, input_ids, attention_mask):
+        # Hidden states of all layers are only kept when a last-k pooling is asked for
+        with torch.autocast(device_type=input_ids.device.type, dtype=torch.bfloat16, enabled=self.precision == 'bf16'):
+            outputs = self.encoder(input_ids, attention_mask, output_hidden_states=True) if self.last_k > 0 else self.encoder(input_ids, attention_mask)
+        last_hidden = outputs.last_hidden_state.float()
+        embs = []
+        for pooling in self.poolings:
+            if pooling == 'cls':
+                # Use CLS Emb as sentence emb, dont use pooler_output
+                embs.append(last_hidden[:, 0, :])
+                continue
+            if pooling == 'mean':
+                emb = self.mean_pooling(last_hidden, attention_mask)
+            elif pooling == 'nomask_mean':
+                emb = last_hidden.mean(dim=1)
+            elif pooling == 'max':
+                emb = self.max_pooling(last_hidden, attention_mask)
+            elif pooling.startswith('last'):
+                k = int(pooling[4:-5])
+                emb = self.mean_pooling(torch.stack(outputs.hidden_states[-k:]).float().mean(dim=0), attention_mask)
+            else:
+                raise ValueError(f'Unknown pooling {pooling}')
+            embs.append(F.normalize(emb, p=2, dim=1) if self.norm is True else emb)
+        return TokenClassifierOutput(logits=tuple(embs))
+
+
+def requested_poolings(args):
+    poolings = []
+    if args.cls:
+        poolings.append('cls')
+    if args.mean:
+        poolings.append('mean')
+    if args.nomask:
+        poolings.append('nomask_mean')
+    if args.last_k > 0:
+        poolings.append(f'last{args.last_k}_mean')
+    if args.max:
+        poolings.append('max')
+    return poolings
+
+
+def pads_to_max_length(poolings):
+    # nomask_mean averages the padding tokens too, so a text only gets the same embedding whatever its batch when
+    # every input is padded to max_length
+    return 'nomask_mean' in poolings
+
+
+def load_encoder(model_name, pretrain_path=None):
+    if pretrain_path is not None:
+        model = AutoModel.from_pretrained(f'{pretrain_path}')
+        print('Loading model from the path: {}'.format(pretrain_path))
+    else:
+        model = AutoModel.from_pretrained(model_name, trust_remote_code=True) #, token=args.access_token
+    return model
+
+
+def build_extractor(model_name, pretrain_path, poolings, norm, precision='fp32'):
+    return apply_precision(MultiPoolingEmbInfModel(load_encoder(model_name, pretrain_path), poolings, norm=norm), precision)
+
+
+def cpu_parallel_features(tokenizer, text_data, output_file, poolings, hidden_dim, args):
+    # Longest texts first, dealt round-robin so that every worker gets the same mix of lengths
+    order = np.argsort([-len(str(t)) for t in text_data], kind='stable')
+    partial_files = [f'{output_file}_{pooling}.partial.npy' for pooling in poolings]
+    for f in partial_files:
+        if os.path.exists(f):
+            os.remove(f)
+        open_npy_memmap(f, (len(text_data), hidden_dim), np.float32).flush()
+    cpu_parallel_inference(partial(build_extractor, args.model_name, args.pretrain_path, poolings, args.norm, args.precision),
+                           TextBatchBuilder(tokenizer, text_data, args.max_length, pads_to_max_length(poolings)),
+                           order, partial_files,
+                           args.cpu_workers, args.batch_size, args.threads_per_worker)
+    for pooling, f in zip(poolings, partial_files):
+        os.replace(f, f'{output_file}_{pooling}.npy')
+        print('{} saved to the {}'.format(pooling.upper(), output_file))
+
+
+def encode_texts(trainer, tokenizer, text_data, max_length, sort_by_length=False, pad_to_max_length=False):
+    # Returns one embedding matrix per pooling, rows in the order of text_data
+    if pad_to_max_length:
+        encoded_inputs = tokenizer(text_data, padding='max_length', truncation=True, max_length=max_length,
+                                   return_tensors='pt')
+        dataset, order = Dataset.from_dict(encoded_inputs), None
+    elif sort_by_length:
+        encoded_inputs = tokenizer(text_data, padding=False, truncation=True, max_length=max_length)
+        dataset, order = length_sorted_dataset(encoded_inputs)
+    else:
+        encoded_inputs = tokenizer(text_data, padding=True, truncation=True, max_length=max_length, return_tensors='pt')
+        dataset, order = Dataset.from_dict(encoded_inputs), None
+    predictions = trainer.predict(dataset).predictions
+    predictions = predictions if isinstance(predictions, tuple) else (predictions,)
+    return tuple(emb if order is None else restore_node_order(emb, order) for emb in predictions)
+
+
+def stream_features(encode, csv_file, text_column, output_file, poolings, hidden_dim, args):
+    """Read the CSV shard by shard, encode(texts) each one and write the embeddings straight into memory-mapped .npy files.
+    Finished shards are recorded in {output_file}_shards.json, a restarted job skips them.
+    """
+    shard_size = args.shard_size
+    n_nodes = sum(len(chunk) for chunk in pd.read_csv(csv_file, usecols=[text_column], chunksize=shard_size))
+    progress_file = f'{output_file}_shards.json'
+    progress = {'shard_size': shard_size, 'n_nodes': n_nodes, 'poolings': poolings, 'done': []}
+    if os.path.exists(progress_file):
+        with open(progress_file) as f:
+            saved = json.load(f)
+        if all(saved[k] == progress[k] for k in ['shard_size', 'n_nodes', 'poolings']):
+            progress = saved
+            print(f'Resuming from {progress_file}, {len(progress["done"])} shards finished')
+        else:
+            print(f'{progress_file} does not match the current settings, restarting')
+    partial_files = [f'{output_file}_{pooling}.partial.npy' for pooling in poolings]
+    if len(progress['done']) == 0:
+        for f in partial_files:
+            if os.path.exists(f):
+                os.remove(f)
+    outputs = [open_npy_memmap(f, (n_nodes, hidden_dim), np.float32) for f in partial_files]
+
+    done = set(progress['done'])
+    n_shards = (n_nodes + shard_size - 1) // shard_size
+    for shard_id, chunk in enumerate(pd.read_csv(csv_file, usecols=[text_column], chunksize=shard_size)):
+        if shard_id in done:
+            continue
+        start = shard_id * shard_size
+        embs = encode(chunk[text_column].tolist())
+        for out, emb in zip(outputs, embs):
+            out[start:start + len(emb)] = emb
+            out.flush()
+        progress['done'].append(shard_id)
+        save_json_atomic(progress_file, progress)
+        print(f'Shard {shard_id + 1}/{n_shards} saved')
+
+    del outputs
+    for pooling, f in zip(poolings, partial_files):
+        os.replace(f, f'{output_file}_{pooling}.npy')
+        print('{} saved to the {}'.format(pooling.upper(), output_file))
+    os.remove(progress_file)
+
+
+def extract_features(args, base_dir, cache_path, output_file, text_column, poolings):
+    model_name, tokenizer_name, csv_file = args.model_name, args.tokenizer_name, args.csv_file
+    max_length, batch_size = args.max_length, args.batch_size
+
+    # 加载模型和分词器
+    if tokenizer_name:
+        tokenizer = AutoTokenizer.from_pretrained(tokenizer_name, use_fast=True, token=args.access_token,  trust_remote_code=True)
+    else:
+        tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=True, token=args.access_token,  trust_remote_code=True)
+
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+
+    args.precision = args.precision or default_precision()
+    pad_to_max_length = pads_to_max_length(poolings)
+    if pad_to_max_length and args.sort_by_length:
+        print('nomask_mean averages the padding tokens: every text is padded to max_length, --sort_by_length is ignored')
+    if args.precision in {'bf16', 'int8'} and args.fidelity_sample > 0:
+        sample = pd.read_csv(os.path.join(base_dir, csv_file), usecols=[text_column], nrows=args.fidelity_sample)
+        check_precision_drift(build_extractor(model_name, args.pretrain_path, poolings, args.norm), args.precision,
+                              TextBatchBuilder(tokenizer, sample[text_column].tolist(), max_length,
+                                               pads_to_max_length(poolings))(range(len(sample))),
+                              args.max_drift)
+
+    if args.cpu_workers > 0:
+        df = pd.read_csv(os.path.join(base_dir, csv_file))
+        text_data = df[text_column].tolist()
+        print('Dataset loaded')
+        config = AutoConfig.from_pretrained(args.pretrain_path or model_name, trust_remote_code=True)
+        cpu_parallel_features(tokenizer, text_data, output_file, poolings, config.hidden_size, args)
+        return
+
+    Features_Extractor = build_extractor(model_name, args.pretrain_path, poolings, args.norm, args.precision)
+    Features_Extractor.eval()
+    model = Features_Extractor.encoder
+
+    inference_args = TrainingArguments(
+        output_dir=cache_path,
+        do_train=False,
+        do_predict=True,
+        per_device_eval_batch_size=batch_size,
+        dataloader_drop_last=False,
+        dataloader_num_workers=1,
+        fp16=args.precision == 'fp16',
+        no_cuda=args.precision == 'int8',  # dynamic quantization only runs on CPU
+    )
+    # Pads each batch to its longest member, a no-op for the corpus-padded inputs
+    trainer = Trainer(model=Features_Extractor, args=inference_args, data_collator=DataCollatorWithPadding(tokenizer))
+
+    encode = partial(encode_texts, trainer, tokenizer, max_length=max_length, sort_by_length=args.sort_by_length,
+                     pad_to_max_length=pad_to_max_length)
+    if args.emb_cache is not None:
+        model_id = os.path.abspath(args.pretrain_path) if args.pretrain_path is not None else model_name
+        revision = getattr(model.config, '_commit_hash', None)
+        caches = [EmbCache(os.path.join(base_dir, args.emb_cache), model_id, f'{pooling}_norm' if args.norm else pooling,
+                           max_length, revision=revision, precision=args.precision,
+                           padding='max_length' if pad_to_max_length else 'longest') for pooling in poolings]
+        encode = partial(encode_with_cache, caches=caches, encode_fn=encode)
+
+    if args.stream:
+        stream_features(encode, os.path.join(base_dir, csv_file), text_column, output_file, poolings,
+                        model.config.hidden_size, args)
+        return
+
+    # read the csv file from the local
+    df = pd.read_csv(os.path.join(base_dir, csv_file))
+    text_data = df[text_column].tolist()
+    print('Dataset loaded')
+
+    embs = encode(text_data)
+    for pooling, emb in zip(poolings, embs):
+        np.save(f'{output_file}_{pooling}.npy', emb)
+        print('{} saved to the {}'.format(pooling.upper(), output_file))
+
+
 def main():
     # 定义命令行参数
     parser = argparse.ArgumentParser(
@@ -39,16 +346,33 @@ def main():
     parser.add_argument('--pretrain_path', type=str, default=None, help='Path to the NPY File')
     parser.add_argument('--max_length', type=int, default=128, help='Maximum length of the text for language models')
     parser.add_argument('--batch_size', type=int, default=2, help='Number of batch size for inference')
-    parser.add_argument('--fp16', type=bool, default=True, help='if fp16')
     parser.add_argument('--cls', action='store_true', help='whether use cls token  to represent the whole text')
     parser.add_argument('--mean', action='store_true', help='whether use mean pooling to represent the whole text')
-    parser.add_argument('--nomask', action='store_true', help='whether do not use mask to claculate the mean pooling')
+    parser.add_argument('--nomask', action='store_true', help='whether use mean pooling without mask (padding tokens included, every text padded to max_length), saved as _nomask_mean')
+    parser.add_argument('--last_k', type=int, default=0, help='if > 0, mean pooling over the average of the last k hidden layers, saved as _last{k}_mean')
+    parser.add_argument('--max', action='store_true', help='whether use max pooling to represent the whole text')
     parser.add_argument('--norm', type=bool, default=False, help='nomic use True')
+    parser.add_argument('--sort_by_length', action='store_true', help='whether sort the texts by length and pad each batch to its longest text instead of the whole corpus')
+    parser.add_argument('--stream', action='store_true', help='whether read the csv by shards and write the features into memory-mapped files, an interrupted run resumes from the last finished shard')
+    parser.add_argument('--shard_size', type=int, default=100000, help='Number of texts per shard in the stream mode')
+    parser.add_argument('--cpu_workers', type=int, default=0, help='if > 0, run the inference on CPU with this number of processes, each with its own model copy')
+    parser.add_argument('--threads_per_worker', type=int, default=None, help='Number of torch threads per CPU worker, default: cores / cpu_workers')
+    parser.add_argument('--emb_cache', type=str, default=None, help='Folder of the embedding cache, only the texts not cached for this model, pooling and max_length are encoded')
+    parser.add_argument('--precision', type=str, default=None, choices=PRECISIONS, help='Inference precision, int8 (dynamic quantization) and bf16 target CPUs, default: fp16 on GPU, fp32 on CPU')
+    parser.add_argument('--fidelity_sample', type=int, default=256, help='Number of texts to compare against fp32 when precision is bf16/int8, 0 to skip')
+    parser.add_argument('--max_drift', type=float, default=0.01, help='Largest mean cosine drift (1 - cos) against fp32 accepted by the fidelity check')
+    parser.add_argument('--reduce_dim', type=int, default=0, help='if > 0, reduce every saved pooling to this dimension out-of-core, saved as _{pooling}_{reduce_method}{reduce_dim}')
+    parser.add_argument('--reduce_method', type=str, default='ipca', choices=['ipca', 'rp'], help='ipca: incremental PCA, rp: gaussian random projection')
+    parser.add_argument('--reduce_chunk', type=int, default=10000, help='Number of rows per chunk of the dimension reduction')
     parser.add_argument('--access_token', type=str, default=None, help='If you want to use some LLM, please ensure your huggingface token can visit these models hub')
 
 
     # 解析命令行参数
     args = parser.parse_args()
+    if args.cpu_workers > 0 and args.stream:
+        raise ValueError('--cpu_workers writes the whole corpus in one pass, it can not be combined with --stream')
+    if args.cpu_workers > 0 and args.emb_cache is not None:
+        raise ValueError('--cpu_workers does not read the embedding cache, it can not be combined with --emb_cache')
     csv_file = args.csv_file
     
     text_column = args.text_column
@@ -84,107 +408,21 @@ def main():
     else:
         output_file = Feature_path + name + '_' + model_name.split('/')[-1].replace("-", "_") + '_' + str(max_length)
 
-    class CLSEmbInfModel(PreTrainedModel):
-        def __init__(self, model):
-            super().__init__(model.config)
-            self.encoder = model
-
-        @torch.no_grad()
-        def forward(self, input_ids, attention_mask):
-            # Extract outputs from the model3
-            outputs = self.encoder(input_ids, attention_mask, output_hidden_states=True)
-            # Use CLS Emb as sentence emb.
-            # Use  pooler_output ? Dont use pooler_output
-            #node_cls_emb = outputs.pooler_output
-            node_cls_emb = outputs.last_hidden_state[:, 0, :]  # Last layer
-            return TokenClassifierOutput(logits=node_cls_emb)
-
-
-    class AttentionMeanEmbInfModel(PreTrainedModel):
-        def __init__(self, model, norm=False):
-            super().__init__(model.config)
-            self.encoder = model
-            self.norm = norm
-
-        @torch.no_grad()
-        def mean_pooling(self, token_embeddings, attention_mask):
-            # Mask out padding tokens
-            input_mask_expanded = attention_mask.unsqueeze(-1).expand(token_embeddings.size())
-            masked_token_embeddings = token_embeddings * input_mask_expanded
-            # Calculate mean pooling
-            mean_embeddings = masked_token_embeddings.sum(dim=1) / torch.clamp(input_mask_expanded.sum(1), min=1e-9)
-            return mean_embeddings
-
-        @torch.no_grad()
-        def forward(self, input_ids, attention_mask):
-            # Extract outputs from the model
-            outputs = self.encoder(input_ids, attention_mask) if self.encoder.config._name_or_path in {'nomic-ai/nomic-embed-text-v1'} else self.encoder(input_ids, attention_mask, output_hidden_states=True)
-            node_mean_emb = self.mean_pooling(outputs.last_hidden_state, attention_mask)
-            node_mean_emb = F.normalize(node_mean_emb, p=2, dim=1) if self.norm is True else node_mean_emb
-            return TokenClassifierOutput(logits=node_mean_emb)
-
-    # read the csv file from the local
-    df = pd.read_csv(os.path.join(base_dir, csv_file))
-    
-    text_data = df[text_column].tolist()
-
-    # 加载模型和分词器
-    if tokenizer_name:
-        tokenizer = AutoTokenizer.from_pretrained(tokenizer_name, use_fast=True, token=args.access_token,  trust_remote_code=True)
-    else:
-        tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=True, token=args.access_token,  trust_remote_code=True)
-
-    if tokenizer.pad_token is None:
-        tokenizer.pad_token = tokenizer.eos_token
-    encoded_inputs = tokenizer(text_data, padding=True, truncation=True, max_length=max_length, return_tensors='pt')
-    dataset = Dataset.from_dict(encoded_inputs)
-    print('Dataset loaded')
-    if args.pretrain_path is not None:
-        model = AutoModel.from_pretrained(f'{args.pretrain_path}')
-        print('Loading model from the path: {}'.format(args.pretrain_path))
-    else:
-        model = AutoModel.from_pretrained(model_name, trust_remote_code=True) #, token=args.access_token
-
-
-    CLS_Feateres_Extractor = CLSEmbInfModel(model)
-    Mask_Mean_Features_Extractor = AttentionMeanEmbInfModel(model, norm=args.norm)
-    CLS_Feateres_Extractor.eval()
-    Mask_Mean_Features_Extractor.eval()
-
-    inference_args = TrainingArguments(
-        output_dir=cache_path,
-        do_train=False,
-        do_predict=True,
-        per_device_eval_batch_size=batch_size,
-        dataloader_drop_last=False,
-        dataloader_num_workers=1,
-        fp16=True, #torch.cuda.is_available(),  #args.fp16,
-        #fp16_full_eval=torch.cuda.is_available()  #args.fp16,
-    )
-
-    # CLS representatoin
-    if args.cls:
-        if not os.path.exists(output_file + "_cls.npy"):
-            trainer = Trainer(model=CLS_Feateres_Extractor, args=inference_args)
-            cls_emb = trainer.predict(dataset)
-            np.save(output_file + "_cls.npy", cls_emb.predictions)
-            print('Existing saved to the {}'.format(output_file))
-
+    # Every pooling shares one encoder pass, skip the ones already saved
+    poolings = []
+    for pooling in requested_poolings(args):
+        if os.path.exists(f'{output_file}_{pooling}.npy'):
+            print(f'Existing saved {pooling.upper()}')
         else:
-            print('Existing saved CLS')
-
-    if args.mean:
-        if not os.path.exists(output_file + "_mean.npy"):
-            trainer = Trainer(model=Mask_Mean_Features_Extractor, args=inference_args)
-            mean_emb = trainer.predict(dataset)
-
-            # 保存平均特征表示为NPY文件
-            np.save(output_file + "_mean.npy", mean_emb.predictions)
-            print('Existing saved to the {}'.format(output_file))
-
-        else:
-            print('Existing saved MEAN')
-
+            poolings.append(pooling)
+    if len(poolings) > 0:
+        extract_features(args, base_dir, cache_path, output_file, text_column, poolings)
+
+    # Optional out-of-core reduction, e.g. to shrink LLM features before GNN training
+    if args.reduce_dim > 0:
+        for pooling in requested_poolings(args):
+            reduce_dimension_streaming(f'{output_file}_{pooling}.npy', args.reduce_dim, args.reduce_method,
+                                       args.reduce_chunk)
 
 
 
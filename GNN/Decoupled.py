@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import wandb
+import numpy as np
+import torch as th
+import GNN
+from GNN import DECOUPLED_MODELS, run, seed_run, count_parameters
+from model.GNN_arg import args_init
+from model.Dataloader import load_preprocessed_data, GRAPH_CACHE_DIR
+from model.propagation import propagation_folder, load_propagation
+
+# SGC / SIGN on the precomputed hops of model/propagation.py. Models, training loop and metrics are those of GNN.py,
+# whose run() trains on mini-batches of the hops when given them as features.
+
+
+def main():
+    argparser = args_init()
+    args = argparser.parse_args()
+    if args.model_name not in DECOUPLED_MODELS:
+        raise ValueError(f'Decoupled.py trains {sorted(DECOUPLED_MODELS)}, not {args.model_name}')
+    if args.sampled or args.partition is not None:
+        raise ValueError('The precomputed hops are already trained in mini-batches, drop --sampled / --partition')
+    wandb.config = args
+    wandb.init(config=args, reinit=True)
+
+    if args.cpu:
+        GNN.device = th.device("cpu")
+    else:
+        GNN.device = th.device("cuda:%d" % args.gpu)
+
+    # ! load data
+    # bidirected, self-looped graph with its formats materialised, cached on disk across launches
+    data = load_preprocessed_data(name=args.data_name, train_ratio=args.train_ratio, val_ratio=args.val_ratio,
+                                  cache_dir=None if args.no_graph_cache else GRAPH_CACHE_DIR)
+    graph, labels, train_idx, val_idx, test_idx = data
+
+    # ! precompute the propagated features once, training only reads mini-batches of them
+    if args.use_PLM:
+        feat = np.load(args.use_PLM, mmap_mode='r')
+    else:
+        feat = graph.ndata["feat"].numpy()
+    folder = propagation_folder(None if args.no_graph_cache else GRAPH_CACHE_DIR, args.data_name, graph,
+                                args.propagation_norm, args.use_PLM)
+    hops = load_propagation(folder, graph, feat, args.n_hops, args.propagation_norm, args.propagation_chunk)
+    GNN.in_feats = hops.n_feats
+    GNN.n_classes = (labels.max() + 1).item()
+
+    # Labels and splits are small, they live on the device of the logits
+    train_idx = train_idx.to(GNN.device)
+    val_idx = val_idx.to(GNN.device)
+    test_idx = test_idx.to(GNN.device)
+    print(f'Train_idx: {len(train_idx)}')
+    print(f'Valid_idx: {len(val_idx)}')
+    print(f'Test_idx: {len(test_idx)}')
+    labels = labels.to(GNN.device)
+
+    # run
+    val_accs = []
+    test_accs = []
+
+    for i in range(args.n_runs):
+        seed_run(args, i)
+        val_acc, test_acc = run(
+            args, graph, hops, labels, train_idx, val_idx, test_idx, i
+        )
+        wandb.log({'Val_Acc': val_acc, 'Test_Acc': test_acc})
+        val_accs.append(val_acc)
+        test_accs.append(test_acc)
+
+    print(f"Runned {args.n_runs} times")
+    print("Val Accs:", val_accs)
+    print("Test Accs:", test_accs)
+    print(f"Average val accuracy: {np.mean(val_accs)} ± {np.std(val_accs)}")
+    print(f"Average test accuracy: {np.mean(test_accs)} ± {np.std(test_accs)}")
+    print(f"Number of params: {count_parameters(args)}")
+    wandb.log({f'Mean_Val_{args.metric}': np.mean(val_accs), f'Mean_Test_{args.metric}': np.mean(test_accs)})
+
+
+if __name__ == "__main__":
+    main()
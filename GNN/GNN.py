@@ -9,15 +9,22 @@ import numpy as np
 import torch as th
 import torch.nn.functional as F
 import torch.optim as optim
-from model.GNN_library import GIN, GCN, GAT, GIN, GraphSAGE, JKNet, MLP, APPNP
+from model.GNN_library import GIN, GCN, GAT, GIN, GraphSAGE, JKNet, MLP, APPNP, SGC, SIGN
 from RevGAT.model import RevGAT
 from model.GNN_arg import args_init
-from model.Dataloader import load_data
-from sklearn.metrics import f1_score
+from model.metrics import is_deterministic_in_train, split_metrics
+from model.Dataloader import load_preprocessed_data, GRAPH_CACHE_DIR
+from model.sampling import is_block_model, layer_fanouts, sampled_loader, train_sampled, sampled_inference
+from model.partition import partition_assignment, ClusterBatches, RandomWalkBatches, train_partitions, \
+    partition_inference, peak_memory
+from model.replicas import Replicas, supports_replicas
+from model.propagation import PropagatedFeatures, train_propagated, propagated_inference
 
 device = None
 in_feats, n_classes = None, None
 epsilon = 1 - math.log(2)
+# Models of precomputed propagated features, trained by Decoupled.py
+DECOUPLED_MODELS = {'SGC', 'SIGN'}
 
 def gen_model(args):
     if args.model_name == 'GIN':
@@ -110,6 +117,22 @@ def gen_model(args):
                       edge_drop=args.edge_drop,
                       use_attn_dst=False,
                       use_symmetric_norm=True)
+    elif args.model_name == 'SGC':
+        model = SGC(
+            in_feats,
+            n_classes,
+            args.input_drop,
+        )
+    elif args.model_name == 'SIGN':
+        model = SIGN(
+            in_feats,
+            args.n_hidden,
+            n_classes,
+            args.n_hops,
+            args.n_layers,
+            args.dropout,
+            args.input_drop,
+        )
     else:
         raise ValueError('Not implement!')
     return model
@@ -121,20 +144,6 @@ def cross_entropy(x, labels):
     return th.mean(y)
 
 
-def compute_acc(pred, labels):
-    """
-    Compute the accuracy of prediction given the labels.
-    """
-    return ((th.argmax(pred, dim=1) == labels).float().sum() / len(pred) ).item()
-
-
-def compute_f1(pred, labels, average='macro'):
-    """
-    Compute the F1 of prediction given the labels.
-    """
-    return f1_score(y_true=labels.cpu(), y_pred=th.argmax(pred, dim=1).cpu(), average=average)
-
-
 def adjust_learning_rate(optimizer, lr, epoch):
     if epoch <= 50:
         for param_group in optimizer.param_groups:
@@ -160,24 +169,7 @@ def evaluate(
     model.eval()
     with th.no_grad():
         pred = model(graph, feat)
-    val_loss = cross_entropy(pred[val_idx], labels[val_idx])
-    test_loss = cross_entropy(pred[test_idx], labels[test_idx])
-    if metric == 'acc':
-        return (
-        compute_acc(pred[train_idx], labels[train_idx]),
-        compute_acc(pred[val_idx], labels[val_idx]),
-        compute_acc(pred[test_idx], labels[test_idx]),
-        val_loss,
-        test_loss,
-    )
-    else:
-        return (
-        compute_f1(pred[train_idx], labels[train_idx]),
-        compute_f1(pred[val_idx], labels[val_idx]),
-        compute_f1(pred[test_idx], labels[test_idx]),
-        val_loss,
-        test_loss,
-    )
+    return split_metrics(pred, labels, train_idx, val_idx, test_idx, cross_entropy, metric)
 
 
 def run(
@@ -203,36 +195,77 @@ def run(
     )
 
     # training loop
-    total_time = 0
+    total_time, train_time = 0, 0
     best_val_acc, final_test_acc, best_val_loss = 0, 0, float("inf")
-
+    if device.type == 'cuda':
+        th.cuda.reset_peak_memory_stats(device)
+
+    # Decoupled.py passes the precomputed hops as feat, training reads mini-batches of them without the graph
+    precomputed = isinstance(feat, PropagatedFeatures)
+    fanouts = layer_fanouts(args.fanouts, args.n_layers)
+    if args.sampled:
+        train_loader = sampled_loader(graph, train_idx, fanouts, args.batch_size, block=is_block_model(model),
+                                      num_workers=args.num_workers)
+    elif args.partition == 'cluster':
+        assignment = partition_assignment(graph, args.n_parts, None if args.no_graph_cache else GRAPH_CACHE_DIR,
+                                          args.data_name)
+        train_batches = ClusterBatches(assignment, args.parts_per_batch)
+        eval_batches = ClusterBatches(assignment, args.parts_per_batch, shuffle=False)
+    elif args.partition == 'saint':
+        train_batches = RandomWalkBatches(graph, train_idx, args.walk_roots, args.walk_length,
+                                          -(-len(train_idx) // args.walk_roots))
+    # Without dropout or batch norm the training forward already gives the evaluation logits
+    reuse_train_logits = is_deterministic_in_train(model)
+    if args.partition is not None:
+        train_mask = th.zeros(graph.num_nodes(), dtype=th.bool, device=graph.device)
+        train_mask[train_idx] = True
 
     for epoch in range(1, args.n_epochs + 1):
         tic = time.time()
 
         adjust_learning_rate(optimizer, args.lr, epoch)
 
-        loss, pred = train(
-            model, graph, feat, labels, train_idx, optimizer
-        )
+        if precomputed:
+            loss = train_propagated(model, feat, labels, train_idx, optimizer, cross_entropy, args.batch_size, device)
+        elif args.sampled:
+            loss = train_sampled(model, train_loader, feat, labels, optimizer, cross_entropy, device)
+        elif args.partition is not None:
+            loss = train_partitions(model, graph, train_batches, feat, labels, train_mask, optimizer, cross_entropy,
+                                    device)
+        else:
+            loss, pred = train(
+                model, graph, feat, labels, train_idx, optimizer
+            )
+        train_time += time.time() - tic
         # acc = compute_acc(pred[train_idx], labels[train_idx])
         if epoch % args.eval_steps == 0:
-            (
-                train_acc,
-                val_acc,
-                test_acc,
-                val_loss,
-                test_loss,
-            ) = evaluate(
-                model,
-                graph,
-                feat,
-                labels,
-                train_idx,
-                val_idx,
-                test_idx,
-                args.metric,
-            )
+            if precomputed:
+                pred = propagated_inference(model, feat, args.eval_batch_size, device)
+                eval_results = split_metrics(pred, labels, train_idx, val_idx, test_idx, cross_entropy, args.metric)
+            elif args.sampled or (args.partition == 'saint' and not is_block_model(model)):
+                pred = sampled_inference(model, graph, feat, fanouts, args.eval_batch_size, device,
+                                         args.num_workers)
+                eval_results = split_metrics(pred, labels, train_idx, val_idx, test_idx, cross_entropy, args.metric)
+            elif args.partition is not None:
+                pred = partition_inference(model, graph, eval_batches if args.partition == 'cluster' else None,
+                                           feat, args.eval_batch_size, device)
+                eval_results = split_metrics(pred, labels, train_idx, val_idx, test_idx, cross_entropy, args.metric)
+            elif reuse_train_logits:
+                # Logits of this epoch's training forward, i.e. of the parameters before the optimizer step
+                eval_results = split_metrics(pred.detach(), labels, train_idx, val_idx, test_idx, cross_entropy,
+                                             args.metric)
+            else:
+                eval_results = evaluate(
+                    model,
+                    graph,
+                    feat,
+                    labels,
+                    train_idx,
+                    val_idx,
+                    test_idx,
+                    args.metric,
+                )
+            train_acc, val_acc, test_acc, val_loss, test_loss = eval_results
             wandb.log({'Train_loss': loss, 'Val_loss': val_loss, 'Test_loss': test_loss})
             lr_scheduler.step(loss)
 
@@ -253,13 +286,106 @@ def run(
                 )
 
 
+    mode = 'precomputed' if precomputed else 'sampled' if args.sampled else args.partition or 'full-batch'
     print("*" * 50)
     print(f"Best val acc: {best_val_acc}, Final test acc: {final_test_acc}")
+    print(f"Training mode: {mode}, average train epoch time: {train_time / args.n_epochs:.3f}s, "
+          f"peak memory: {peak_memory(device):.0f}MB")
     print("*" * 50)
+    wandb.log({'Train_epoch_time': train_time / args.n_epochs, 'Peak_memory_MB': peak_memory(device)})
 
     return best_val_acc, final_test_acc
 
 
+def run_replicas(
+    args, graph, feat, labels, train_idx, val_idx, test_idx, runs
+):
+    """run() of every run in runs at once, on stacked replicas of the model"""
+    models = []
+    for n_running in runs:
+        seed_run(args, n_running)
+        models.append(gen_model(args))
+    model = Replicas(models).to(device)
+    optimizers = [optim.AdamW(m.parameters(), lr=args.lr, weight_decay=args.wd) for m in model.models]
+    lr_schedulers = [
+        optim.lr_scheduler.ReduceLROnPlateau(
+            optimizer,
+            mode="min",
+            factor=0.5,
+            patience=100,
+            verbose=True,
+            min_lr=1e-3,
+        )
+        for optimizer in optimizers
+    ]
+
+    # training loop
+    total_time, train_time = 0, 0
+    best_val_acc, final_test_acc, best_val_loss = [0] * len(runs), [0] * len(runs), [float("inf")] * len(runs)
+    if device.type == 'cuda':
+        th.cuda.reset_peak_memory_stats(device)
+    reuse_train_logits = is_deterministic_in_train(model)
+
+    for epoch in range(1, args.n_epochs + 1):
+        tic = time.time()
+
+        for optimizer in optimizers:
+            adjust_learning_rate(optimizer, args.lr, epoch)
+            optimizer.zero_grad()
+
+        model.train()
+        pred = model(graph, feat)
+        losses = [cross_entropy(pred[train_idx, r], labels[train_idx]) for r in range(len(runs))]
+        # The replicas share no parameters, so the gradient of the sum is every replica's own gradient
+        sum(losses).backward()
+        for optimizer in optimizers:
+            optimizer.step()
+        train_time += time.time() - tic
+
+        if epoch % args.eval_steps == 0:
+            if not reuse_train_logits:
+                model.eval()
+                with th.no_grad():
+                    pred = model(graph, feat)
+            for r, n_running in enumerate(runs):
+                loss = losses[r].detach()
+                train_acc, val_acc, test_acc, val_loss, test_loss = split_metrics(
+                    pred[:, r].detach(), labels, train_idx, val_idx, test_idx, args.metric
+                )
+                wandb.log({'Train_loss': loss, 'Val_loss': val_loss, 'Test_loss': test_loss})
+                lr_schedulers[r].step(loss)
+
+                if val_loss < best_val_loss[r]:
+                    best_val_loss[r] = val_loss
+                    best_val_acc[r] = val_acc
+                    final_test_acc[r] = test_acc
+
+                if epoch % args.log_every == 0:
+                    print(
+                        f"Run: {n_running}/{args.n_runs}, Epoch: {epoch}/{args.n_epochs}, Average epoch time: {total_time / epoch:.2f}\n"
+                        f"Train/Val/Test loss: {loss:.4f}/{val_loss:.4f}/{test_loss:.4f}\n"
+                        f"Train/Val/Test/Best val/Final test {args.metric}: {train_acc:.4f}/{val_acc:.4f}/{test_acc:.4f}/{best_val_acc[r]:.4f}/{final_test_acc[r]:.4f}"
+                    )
+
+            total_time += time.time() - tic
+
+    print("*" * 50)
+    for n_running, val_acc, test_acc in zip(runs, best_val_acc, final_test_acc):
+        print(f"Run: {n_running}, Best val acc: {val_acc}, Final test acc: {test_acc}")
+    print(f"Training mode: {len(runs)} replicas, average train epoch time: {train_time / args.n_epochs:.3f}s, "
+          f"peak memory: {peak_memory(device):.0f}MB")
+    print("*" * 50)
+    wandb.log({'Train_epoch_time': train_time / args.n_epochs, 'Peak_memory_MB': peak_memory(device)})
+
+    return list(zip(best_val_acc, final_test_acc))
+
+
+def seed_run(args, n_running):
+    if args.seed is not None:
+        th.manual_seed(args.seed + n_running)
+        np.random.seed(args.seed + n_running)
+
+
 def count_parameters(args):
     model = gen_model(args)
     return sum(
@@ -271,6 +397,8 @@ def main():
     global device, in_feats, n_classes
     argparser = args_init()
     args = argparser.parse_args()
+    if args.model_name in DECOUPLED_MODELS:
+        raise ValueError(f'{args.model_name} trains on precomputed propagated features, run it with Decoupled.py')
     wandb.config = args
     wandb.init(config=args, reinit=True)
 
@@ -280,47 +408,54 @@ def main():
         device = th.device("cuda:%d" % args.gpu)
 
     # ! load data
-    data = load_data(name=args.data_name, train_ratio=args.train_ratio, val_ratio=args.val_ratio)
+    # bidirected, self-looped graph with its formats materialised, cached on disk across launches
+    data = load_preprocessed_data(name=args.data_name, train_ratio=args.train_ratio, val_ratio=args.val_ratio,
+                                  cache_dir=None if args.no_graph_cache else GRAPH_CACHE_DIR)
     graph, labels, train_idx, val_idx, test_idx = data
 
-    # add reverse edges
-    srcs, dsts = graph.all_edges()
-    graph.add_edges(dsts, srcs)
-
-    # add self-loop
-    print(f"Total edges before adding self-loop {graph.number_of_edges()}")
-    graph = graph.remove_self_loop().add_self_loop()
-    print(f"Total edges after adding self-loop {graph.number_of_edges()}")
-
+    # Sampled mini-batches and partitions only move their own blocks and features to the device
+    storage = th.device("cpu") if args.sampled or args.partition is not None else device
     if args.use_PLM:
-        feat = th.from_numpy(np.load(args.use_PLM).astype(np.float32)).to(device)
+        feat = th.from_numpy(np.load(args.use_PLM).astype(np.float32)).to(storage)
         in_feats = feat.shape[1]
     else:
-        feat = graph.ndata["feat"].to(device)
+        feat = graph.ndata["feat"].to(storage)
         in_feats = graph.ndata["feat"].shape[1]
     n_classes = (labels.max() + 1).item()
-    graph.create_formats_()
 
-    train_idx = train_idx.to(device)
-    val_idx = val_idx.to(device)
-    test_idx = test_idx.to(device)
+    train_idx = train_idx.to(storage)
+    val_idx = val_idx.to(storage)
+    test_idx = test_idx.to(storage)
     print(f'Train_idx: {len(train_idx)}')
     print(f'Valid_idx: {len(val_idx)}')
     print(f'Test_idx: {len(test_idx)}')
-    labels = labels.to(device)
-    graph = graph.to(device)
+    labels = labels.to(storage)
+    graph = graph.to(storage)
 
     # run
     val_accs = []
     test_accs = []
 
-    for i in range(args.n_runs):
-        val_acc, test_acc = run(
-            args, graph, feat, labels, train_idx, val_idx, test_idx, i
-        )
-        wandb.log({'Val_Acc': val_acc, 'Test_Acc': test_acc})
-        val_accs.append(val_acc)
-        test_accs.append(test_acc)
+    # Several full-batch runs at once as stacked replicas, the other models and modes run one after another
+    parallel_runs = args.parallel_runs if not args.sampled and args.partition is None and \
+        supports_replicas(args.model_name, args.aggregator_type) else 1
+    if parallel_runs < args.parallel_runs:
+        print(f'--parallel-runs is not supported for {args.model_name} in this mode, the runs are sequential')
+
+    for i in range(0, args.n_runs, parallel_runs):
+        if parallel_runs > 1:
+            results = run_replicas(
+                args, graph, feat, labels, train_idx, val_idx, test_idx, range(i, min(i + parallel_runs, args.n_runs))
+            )
+        else:
+            seed_run(args, i)
+            results = [run(
+                args, graph, feat, labels, train_idx, val_idx, test_idx, i
+            )]
+        for val_acc, test_acc in results:
+            wandb.log({'Val_Acc': val_acc, 'Test_Acc': test_acc})
+            val_accs.append(val_acc)
+            test_accs.append(test_acc)
 
     print(f"Runned {args.n_runs} times")
     print("Val Accs:", val_accs)
@@ -7,51 +7,19 @@ import scipy.sparse as sp
 import os
 import random
 import pickle
+from model.splits import random_split, time_split, get_split
 
 
 def split_graph(nodes_num, train_ratio, val_ratio):
-    np.random.seed(42)
-    indices = np.random.permutation(nodes_num)
-    train_size = int(nodes_num * train_ratio)
-    val_size = int(nodes_num * val_ratio)
+    return tuple(ids.numpy() for ids in random_split(nodes_num, train_ratio, val_ratio))
 
-    train_ids = indices[:train_size]
-    val_ids = indices[train_size:train_size + val_size]
-    test_ids = indices[train_size + val_size:]
-
-    return train_ids, val_ids, test_ids
-
-
-# def split_time(g, train_year=2016, val_year=2017):
-#     year = list(np.array(g.ndata['year']))
-#     indices = np.arange(g.num_nodes())
-#     # 1999-2014 train
-#     train_ids = indices[:year.index(train_year)]
-#     val_ids = indices[year.index(train_year):year.index(val_year)]
-#     test_ids = indices[year.index(val_year):]
-#
-#     return train_ids, val_ids, test_ids
 
 def split_time(g, train_year=2016, val_year=2017):
-    np.random.seed(42)
-    year = list(np.array(g.ndata['year']))
-    indices = np.arange(g.num_nodes())
-    # 1999-2014 train
-    # Filter out nodes with label -1
-    valid_indices = [i for i in indices if g.ndata['label'][i] != -1]
-
-    # Filter out valid indices based on years
-    train_ids = [i for i in valid_indices if year[i] < train_year]
-    val_ids = [i for i in valid_indices if year[i] >= train_year and year[i] < val_year]
-    test_ids = [i for i in valid_indices if year[i] >= val_year]
-
-    train_length = len(train_ids)
-    val_length = len(val_ids)
-    test_length = len(test_ids)
-
-    print("Train set length:", train_length)
-    print("Validation set length:", val_length)
-    print("Test set length:", test_length)
+    train_ids, val_ids, test_ids = time_split(g.ndata['year'], g.ndata['label'], train_year, val_year)
+
+    print("Train set length:", len(train_ids))
+    print("Validation set length:", len(val_ids))
+    print("Test set length:", len(test_ids))
 
     return train_ids, val_ids, test_ids
 
@@ -70,38 +38,23 @@ def load_data(name, train_ratio=0.6, val_ratio=0.2):
     elif name == 'amazon-children':
         graph = dgl.load_graphs('/mnt/v-wzhuang/Amazon/Books/Amazon-Books-Children.pt')[0][0]
         labels = graph.ndata['label']
-        train_idx, val_idx, test_idx = split_graph(graph.num_nodes(), 0.6, 0.2)
-        train_idx = th.tensor(train_idx)
-        val_idx = th.tensor(val_idx)
-        test_idx = th.tensor(test_idx)
+        train_idx, val_idx, test_idx = get_split(graph, '/mnt/v-wzhuang/Amazon/Books/Amazon-Books-Children.pt', 'random', 0.6, 0.2)
     elif name == 'amazon-history':
         graph = dgl.load_graphs('/mnt/v-wzhuang/Amazon/Books/Amazon-Books-History.pt')[0][0]
         labels = graph.ndata['label']
-        train_idx, val_idx, test_idx = split_graph(graph.num_nodes(), 0.6, 0.2)
-        train_idx = th.tensor(train_idx)
-        val_idx = th.tensor(val_idx)
-        test_idx = th.tensor(test_idx)
+        train_idx, val_idx, test_idx = get_split(graph, '/mnt/v-wzhuang/Amazon/Books/Amazon-Books-History.pt', 'random', 0.6, 0.2)
     elif name == 'amazon-fitness':
         graph = dgl.load_graphs('/mnt/v-wzhuang/TAG-Benchmark/data/amazon/Sports/Fitness/Sports-Fitness.pt')[0][0]
         labels = graph.ndata['label']
-        train_idx, val_idx, test_idx = split_graph(graph.num_nodes(), train_ratio, val_ratio)
-        train_idx = th.tensor(train_idx)
-        val_idx = th.tensor(val_idx)
-        test_idx = th.tensor(test_idx)
+        train_idx, val_idx, test_idx = get_split(graph, '/mnt/v-wzhuang/TAG-Benchmark/data/amazon/Sports/Fitness/Sports-Fitness.pt', 'random', train_ratio, val_ratio)
     elif name == 'amazon-photo':
         graph = dgl.load_graphs('/mnt/v-wzhuang/TAG-Benchmark/data/amazon/Electronics/Photo/Electronics-Photo.pt')[0][0]
         labels = graph.ndata['label']
-        train_idx, val_idx, test_idx = split_time(graph, 2015, 2016)
-        train_idx = th.tensor(train_idx)
-        val_idx = th.tensor(val_idx)
-        test_idx = th.tensor(test_idx)
+        train_idx, val_idx, test_idx = get_split(graph, '/mnt/v-wzhuang/TAG-Benchmark/data/amazon/Electronics/Photo/Electronics-Photo.pt', 'time', train_year=2015, val_year=2016)
     elif name == 'dblp':
         graph = dgl.load_graphs('/mnt/v-wzhuang/DBLP/Citation-V8.pt')[0][0]
         labels = graph.ndata['label']
-        train_idx, val_idx, test_idx = split_time(graph, 2010, 2011)
-        train_idx = th.tensor(train_idx)
-        val_idx = th.tensor(val_idx)
-        test_idx = th.tensor(test_idx)
+        train_idx, val_idx, test_idx = get_split(graph, '/mnt/v-wzhuang/DBLP/Citation-V8.pt', 'time', train_year=2010, val_year=2011)
     else:
         raise ValueError('Not implemetned')
     return graph, labels, train_idx, val_idx, test_idx
@@ -13,9 +13,9 @@ from matplotlib import pyplot as plt
 from matplotlib.ticker import AutoMinorLocator, MultipleLocator
 from model.GNN_library import MLP
 from model.GNN_arg import args_init
-from model.Dataloader import load_data
+from model.metrics import is_deterministic_in_train, split_metrics
+from model.Dataloader import load_preprocessed_data, GRAPH_CACHE_DIR
 from ogb.nodeproppred import DglNodePropPredDataset
-from sklearn.metrics import f1_score
 
 device = None
 in_feats, n_classes = None, None
@@ -43,19 +43,6 @@ def cross_entropy(x, labels):
     return th.mean(y)
 
 
-def compute_acc(pred, labels):
-    """
-    Compute the accuracy of prediction given the labels.
-    """
-    return ((th.argmax(pred, dim=1) == labels).float().sum() / len(pred) ).item()
-
-def compute_f1(pred, labels, average='macro'):
-    """
-    Compute the F1 of prediction given the labels.
-    """
-    return f1_score(y_true=labels.cpu(), y_pred=th.argmax(pred, dim=1).cpu(), average=average)
-
-
 def adjust_learning_rate(optimizer, lr, epoch):
     if epoch <= 50:
         for param_group in optimizer.param_groups:
@@ -81,25 +68,7 @@ def evaluate(
     model.eval()
     with th.no_grad():
         pred = model(feat)
-    val_loss = cross_entropy(pred[val_idx], labels[val_idx])
-    test_loss = cross_entropy(pred[test_idx], labels[test_idx])
-
-    if metric == 'acc':
-        return (
-        compute_acc(pred[train_idx], labels[train_idx]),
-        compute_acc(pred[val_idx], labels[val_idx]),
-        compute_acc(pred[test_idx], labels[test_idx]),
-        val_loss,
-        test_loss,
-    )
-    else:
-        return (
-        compute_f1(pred[train_idx], labels[train_idx]),
-        compute_f1(pred[val_idx], labels[val_idx]),
-        compute_f1(pred[test_idx], labels[test_idx]),
-        val_loss,
-        test_loss,
-    )
+    return split_metrics(pred, labels, train_idx, val_idx, test_idx, cross_entropy, metric)
 
 
 def run(
@@ -127,7 +96,8 @@ def run(
     # training loop
     total_time = 0
     best_val_acc, final_test_acc, best_val_loss = 0, 0, float("inf")
-
+    # Without dropout or batch norm the training forward already gives the evaluation logits
+    reuse_train_logits = is_deterministic_in_train(model)
 
     for epoch in range(1, args.n_epochs + 1):
         tic = time.time()
@@ -139,21 +109,21 @@ def run(
         )
         # acc = compute_acc(pred[train_idx], labels[train_idx])
         if epoch % args.eval_steps == 0:
-            (
-                train_acc,
-                val_acc,
-                test_acc,
-                val_loss,
-                test_loss,
-            ) = evaluate(
-                model,
-                feat,
-                labels,
-                train_idx,
-                val_idx,
-                test_idx,
-                args.metric,
-            )
+            if reuse_train_logits:
+                # Logits of this epoch's training forward, i.e. of the parameters before the optimizer step
+                eval_results = split_metrics(pred.detach(), labels, train_idx, val_idx, test_idx, cross_entropy,
+                                             args.metric)
+            else:
+                eval_results = evaluate(
+                    model,
+                    feat,
+                    labels,
+                    train_idx,
+                    val_idx,
+                    test_idx,
+                    args.metric,
+                )
+            train_acc, val_acc, test_acc, val_loss, test_loss = eval_results
             wandb.log({'Train_loss': loss, 'Val_loss': val_loss, 'Test_loss': test_loss})
             lr_scheduler.step(loss)
 
@@ -201,18 +171,11 @@ def main():
         device = th.device("cuda:%d" % args.gpu)
 
     # ! load data
-    data = load_data(name=args.data_name, train_ratio=args.train_ratio, val_ratio=args.val_ratio)
+    # bidirected, self-looped graph with its formats materialised, cached on disk across launches
+    data = load_preprocessed_data(name=args.data_name, train_ratio=args.train_ratio, val_ratio=args.val_ratio,
+                                  cache_dir=None if args.no_graph_cache else GRAPH_CACHE_DIR)
     graph, labels, train_idx, val_idx, test_idx = data
 
-    # add reverse edges
-    srcs, dsts = graph.all_edges()
-    graph.add_edges(dsts, srcs)
-
-    # add self-loop
-    print(f"Total edges before adding self-loop {graph.number_of_edges()}")
-    graph = graph.remove_self_loop().add_self_loop()
-    print(f"Total edges after adding self-loop {graph.number_of_edges()}")
-
     if args.use_PLM:
         feat = th.from_numpy(np.load(args.use_PLM).astype(np.float32)).to(device)
         in_feats = feat.shape[1]
@@ -220,7 +183,6 @@ def main():
         feat = graph.ndata["feat"].to(device)
         in_feats = graph.ndata["feat"].shape[1]
     n_classes = (labels.max() + 1).item()
-    graph.create_formats_()
 
     train_idx = train_idx.to(device)
     val_idx = val_idx.to(device)
@@ -12,7 +12,7 @@ import torch.optim as optim
 
 from model.GNN_library import MoNet
 from model.GNN_arg import args_init
-from model.Dataloader import load_data
+from model.Dataloader import load_preprocessed_data, GRAPH_CACHE_DIR
 from sklearn.metrics import f1_score
 
 
@@ -210,18 +210,11 @@ def main():
         device = th.device("cuda:%d" % args.gpu)
 
     # ! load data
-    data = load_data(name=args.data_name, train_ratio=args.train_ratio, val_ratio=args.val_ratio)
+    # bidirected, self-looped graph with its formats materialised, cached on disk across launches
+    data = load_preprocessed_data(name=args.data_name, train_ratio=args.train_ratio, val_ratio=args.val_ratio,
+                                  cache_dir=None if args.no_graph_cache else GRAPH_CACHE_DIR)
     graph, labels, train_idx, val_idx, test_idx = data
 
-    # add reverse edges
-    srcs, dsts = graph.all_edges()
-    graph.add_edges(dsts, srcs)
-
-    # add self-loop
-    print(f"Total edges before adding self-loop {graph.number_of_edges()}")
-    graph = graph.remove_self_loop().add_self_loop()
-    print(f"Total edges after adding self-loop {graph.number_of_edges()}")
-
     if args.use_PLM:
         feat = th.from_numpy(np.load(args.use_PLM).astype(np.float32)).to(device)
         in_feats = feat.shape[1]
@@ -229,7 +222,6 @@ def main():
         feat = graph.ndata["feat"].to(device)
         in_feats = graph.ndata["feat"].shape[1]
     n_classes = (labels.max() + 1).item()
-    graph.create_formats_()
 
     train_idx = train_idx.to(device)
     val_idx = val_idx.to(device)
@@ -7,57 +7,60 @@ import scipy.sparse as sp
 import os
 import random
 import pickle
+import hashlib
+import json
+from model.io_utils import atomic_path
+from model.splits import random_split, time_split, get_split
 
 
 def split_graph(nodes_num, train_ratio, val_ratio):
-    np.random.seed(42)
-    indices = np.random.permutation(nodes_num)
-    train_size = int(nodes_num * train_ratio)
-    val_size = int(nodes_num * val_ratio)
+    return tuple(ids.numpy() for ids in random_split(nodes_num, train_ratio, val_ratio, seed=42))
 
-    train_ids = indices[:train_size]
-    val_ids = indices[train_size:train_size + val_size]
-    test_ids = indices[train_size + val_size:]
 
-    return train_ids, val_ids, test_ids
+def split_time(g, train_year=2016, val_year=2017):
+    train_ids, val_ids, test_ids = time_split(g.ndata['year'], g.ndata['label'], train_year, val_year)
 
+    print("Train set length:", len(train_ids))
+    print("Validation set length:", len(val_ids))
+    print("Test set length:", len(test_ids))
 
-# def split_time(g, train_year=2016, val_year=2017):
-#     year = list(np.array(g.ndata['year']))
-#     indices = np.arange(g.num_nodes())
-#     # 1999-2014 train
-#     train_ids = indices[:year.index(train_year)]
-#     val_ids = indices[year.index(train_year):year.index(val_year)]
-#     test_ids = indices[year.index(val_year):]
-#
-#     return train_ids, val_ids, test_ids
+    return train_ids, val_ids, test_ids
 
-def split_time(g, train_year=2016, val_year=2017):
-    np.random.seed(42)
-    year = list(np.array(g.ndata['year']))
-    indices = np.arange(g.num_nodes())
-    # 1999-2014 train
-    # Filter out nodes with label -1
-    valid_indices = [i for i in indices if g.ndata['label'][i] != -1]
-
-    # Filter out valid indices based on years
-    train_ids = [i for i in valid_indices if year[i] < train_year]
-    val_ids = [i for i in valid_indices if year[i] >= train_year and year[i] < val_year]
-    test_ids = [i for i in valid_indices if year[i] >= val_year]
-
-    train_length = len(train_ids)
-    val_length = len(val_ids)
-    test_length = len(test_ids)
-
-    print("Train set length:", train_length)
-    print("Validation set length:", val_length)
-    print("Test set length:", test_length)
 
-    return train_ids, val_ids, test_ids
+# Dataset registry: graph file and split protocol of every dataset.
+# Ratios set to None follow the train_ratio/val_ratio passed to load_data.
+DATASETS = {
+    'ogbn-arxiv': {'graph': None, 'split': 'ogb'},
+    'Children': {'graph': 'data/CSTAG/Children/Children.pt', 'split': 'random', 'train_ratio': 0.6, 'val_ratio': 0.2},
+    'History': {'graph': 'data/CSTAG/History/History.pt', 'split': 'random', 'train_ratio': 0.6, 'val_ratio': 0.2},
+    'Fitness': {'graph': 'data/CSTAG/Fitness/Fitness.pt', 'split': 'random'},
+    'Photo': {'graph': 'data/CSTAG/Photo/Photo.pt', 'split': 'time', 'train_year': 2015, 'val_year': 2016},
+    'Computers': {'graph': 'data/CSTAG/Computers/Computers.pt', 'split': 'time', 'train_year': 2017, 'val_year': 2018},
+    'webkb-cornell': {'graph': 'data/webkb/Cornell/Cornell.pt', 'split': 'random'},
+    'webkb-texas': {'graph': 'data/webkb/Texas/Texas.pt', 'split': 'random'},
+    'webkb-washington': {'graph': 'data/webkb/Washington/Washington.pt', 'split': 'random'},
+    'webkb-wisconsin': {'graph': 'data/webkb/Wisconsin/Wisconsin.pt', 'split': 'random'},
+}
+GRAPH_CACHE_DIR = 'data/cache/graphs'
+# Bump when preprocess_graph changes, so that stale cached graphs are not picked up
+GRAPH_CACHE_VERSION = 1
+
+
+def _split_params(name, train_ratio, val_ratio):
+    info = DATASETS[name]
+    if info['split'] == 'random':
+        return {'way': 'random', 'train_ratio': info.get('train_ratio') or train_ratio,
+                'val_ratio': info.get('val_ratio') or val_ratio}
+    if info['split'] == 'time':
+        return {'way': 'time', 'train_year': info['train_year'], 'val_year': info['val_year']}
+    return {'way': info['split']}
 
 
 def load_data(name, train_ratio=0.6, val_ratio=0.2):
-    if name == 'ogbn-arxiv':
+    if name not in DATASETS:
+        raise ValueError('Not implemetned')
+    info = DATASETS[name]
+    if info['split'] == 'ogb':
         data = DglNodePropPredDataset(name=name)
         splitted_idx = data.get_idx_split()
         train_idx, val_idx, test_idx = (
@@ -67,71 +70,61 @@ def load_data(name, train_ratio=0.6, val_ratio=0.2):
         )
         graph, labels = data[0]
         labels = labels[:, 0]
-    elif name == 'Children':
-        graph = dgl.load_graphs('data/CSTAG/Children/Children.pt')[0][0]
-        labels = graph.ndata['label']
-        train_idx, val_idx, test_idx = split_graph(graph.num_nodes(), 0.6, 0.2)
-        train_idx = th.tensor(train_idx)
-        val_idx = th.tensor(val_idx)
-        test_idx = th.tensor(test_idx)
-    elif name == 'History':
-        graph = dgl.load_graphs('data/CSTAG/History/History.pt')[0][0]
-        labels = graph.ndata['label']
-        train_idx, val_idx, test_idx = split_graph(graph.num_nodes(), 0.6, 0.2)
-        train_idx = th.tensor(train_idx)
-        val_idx = th.tensor(val_idx)
-        test_idx = th.tensor(test_idx)
-    elif name == 'Fitness':
-        graph = dgl.load_graphs('data/CSTAG/Fitness/Fitness.pt')[0][0]
-        labels = graph.ndata['label']
-        train_idx, val_idx, test_idx = split_graph(graph.num_nodes(), train_ratio, val_ratio)
-        train_idx = th.tensor(train_idx)
-        val_idx = th.tensor(val_idx)
-        test_idx = th.tensor(test_idx)
-    elif name == 'Photo':
-        graph = dgl.load_graphs('data/CSTAG/Photo/Photo.pt')[0][0]
-        labels = graph.ndata['label']
-        train_idx, val_idx, test_idx = split_time(graph, 2015, 2016)
-        train_idx = th.tensor(train_idx)
-        val_idx = th.tensor(val_idx)
-        test_idx = th.tensor(test_idx)
-    elif name == 'Computers':
-        graph = dgl.load_graphs('data/CSTAG/Computers/Computers.pt')[0][0]
-        labels = graph.ndata['label']
-        train_idx, val_idx, test_idx = split_time(graph, 2017, 2018)
-        train_idx = th.tensor(train_idx)
-        val_idx = th.tensor(val_idx)
-        test_idx = th.tensor(test_idx)
-    elif name == 'webkb-cornell':
-        graph = dgl.load_graphs('data/webkb/Cornell/Cornell.pt')[0][0]
-        labels = graph.ndata['label']
-        train_idx, val_idx, test_idx = split_graph(graph.num_nodes(), train_ratio, val_ratio)
-        train_idx = th.tensor(train_idx)
-        val_idx = th.tensor(val_idx)
-        test_idx = th.tensor(test_idx)
-    elif name == 'webkb-texas':
-        graph = dgl.load_graphs('data/webkb/Texas/Texas.pt')[0][0]
-        labels = graph.ndata['label']
-        train_idx, val_idx, test_idx = split_graph(graph.num_nodes(), train_ratio, val_ratio)
-        train_idx = th.tensor(train_idx)
-        val_idx = th.tensor(val_idx)
-        test_idx = th.tensor(test_idx)
-    elif name == 'webkb-washington':
-        graph = dgl.load_graphs('data/webkb/Washington/Washington.pt')[0][0]
-        labels = graph.ndata['label']
-        train_idx, val_idx, test_idx = split_graph(graph.num_nodes(), train_ratio, val_ratio)
-        train_idx = th.tensor(train_idx)
-        val_idx = th.tensor(val_idx)
-        test_idx = th.tensor(test_idx)
-    elif name == 'webkb-wisconsin':
-        graph = dgl.load_graphs('data/webkb/Wisconsin/Wisconsin.pt')[0][0]
-        labels = graph.ndata['label']
-        train_idx, val_idx, test_idx = split_graph(graph.num_nodes(), train_ratio, val_ratio)
-        train_idx = th.tensor(train_idx)
-        val_idx = th.tensor(val_idx)
-        test_idx = th.tensor(test_idx)
     else:
-        raise ValueError('Not implemetned')
+        graph = dgl.load_graphs(info['graph'])[0][0]
+        labels = graph.ndata['label']
+        train_idx, val_idx, test_idx = get_split(graph, info['graph'], **_split_params(name, train_ratio, val_ratio))
+    return graph, labels, train_idx, val_idx, test_idx
+
+
+def preprocess_graph(graph):
+    # add reverse edges
+    srcs, dsts = graph.all_edges()
+    graph.add_edges(dsts, srcs)
+
+    # add self-loop
+    print(f"Total edges before adding self-loop {graph.number_of_edges()}")
+    graph = graph.remove_self_loop().add_self_loop()
+    print(f"Total edges after adding self-loop {graph.number_of_edges()}")
+    graph.create_formats_()
+    return graph
+
+
+def graph_key(graph):
+    # Structure of a preprocessed graph: sizes and the degree sequence
+    degrees = graph.in_degrees().cpu().numpy().tobytes()
+    return f'{graph.num_nodes()}_{graph.num_edges()}_{hashlib.sha1(degrees).hexdigest()[:16]}'
+
+
+def _graph_cache_file(name, train_ratio, val_ratio, cache_dir):
+    key = {'name': name, 'version': GRAPH_CACHE_VERSION, **_split_params(name, train_ratio, val_ratio)}
+    graph_file = DATASETS[name]['graph']
+    if graph_file is not None:
+        stat = os.stat(graph_file)
+        key.update({'graph': os.path.abspath(graph_file), 'size': stat.st_size, 'mtime': int(stat.st_mtime)})
+    key = hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f'{name}_{key}.bin')
+
+
+def load_preprocessed_data(name, train_ratio=0.6, val_ratio=0.2, cache_dir=GRAPH_CACHE_DIR):
+    """load_data followed by preprocess_graph (bidirected, self-looped, COO/CSR/CSC materialised).
+    The result is saved with dgl.save_graphs, splits and labels included, so that later launches on the same dataset
+    only deserialize it. Pass cache_dir=None to always preprocess from the raw graph.
+    """
+    cache_file = _graph_cache_file(name, train_ratio, val_ratio, cache_dir) if cache_dir is not None else None
+    if cache_file is not None and os.path.exists(cache_file):
+        print(f'Load preprocessed graph from {cache_file}')
+        graphs, tensors = dgl.load_graphs(cache_file)
+        return graphs[0], tensors['labels'], tensors['train_idx'], tensors['val_idx'], tensors['test_idx']
+
+    graph, labels, train_idx, val_idx, test_idx = load_data(name, train_ratio, val_ratio)
+    graph = preprocess_graph(graph)
+    if cache_file is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        tensors = {'labels': labels, 'train_idx': train_idx, 'val_idx': val_idx, 'test_idx': test_idx}
+        with atomic_path(cache_file) as tmp_file:
+            dgl.save_graphs(tmp_file, [graph], tensors, formats=['coo', 'csr', 'csc'])
+        print(f'Preprocessed graph saved to {cache_file}')
     return graph, labels, train_idx, val_idx, test_idx
 
 
@@ -213,46 +206,39 @@ def split_edge_MMR(dgl_graph, time=2015, random_seed=42, neg_len=1000, path=None
         edge_split = th.load(os.path.join(path, 'edge_split.pt'))
         train_g = dgl.load_graphs(os.path.join(path, 'train_G.pt'))[0][0]
     else:
-
-        np.random.seed(random_seed)
-        th.manual_seed(random_seed)
-
-        graph = from_dgl(dgl_graph)
-
-        year = list(np.array(graph.year))
-        indices = np.arange(graph.num_nodes)
-        # %%
-        all_source = graph.edge_index[0]
-        all_target = graph.edge_index[1]
-        # %%
-        import random
-        val_list = []
-        test_list = []
-        for i in range(year.index(time), graph.num_nodes):
-            indices = th.where(all_source == i)[0]
-            if len(indices) >= 2:
-                _list = random.sample(list(indices), k=2)
-                val_list.append(_list[0])
-                test_list.append(_list[1])
-
-        val_source = all_source[val_list]
-        val_target = all_target[val_list]
-
-        test_source = all_source[test_list]
-        test_target = all_target[test_list]
-
-        all_index = list(range(0, len(graph.edge_index[0])))
-
-        val_list = np.array(val_list).tolist()
-        test_list = np.array(test_list).tolist()
-
-        train_idx = set(all_index) - set(val_list) - set(test_list)
-
-        tra_source = all_source[list(train_idx)]
-        tra_target = all_target[list(train_idx)]
-
-        val_target_neg = th.randint(low=0, high=year.index(time), size=(len(val_source), neg_len))
-        test_target_neg = th.randint(low=0, high=year.index(time), size=(len(test_source), neg_len))
+        generator = th.Generator().manual_seed(random_seed)
+
+        all_source, all_target = dgl_graph.edges()
+        all_source, all_target = all_source.long(), all_target.long()
+        n_nodes, n_edges = dgl_graph.num_nodes(), len(all_source)
+        # Nodes are sorted by year, every node from the first one published in `time` on is a query source
+        first_node = th.nonzero(dgl_graph.ndata['year'].view(-1) == time)[0].item()
+
+        # CSR over the sources: out-edges of node i are order[indptr[i]:indptr[i + 1]]
+        order = th.sort(all_source, stable=True)[1]
+        degree = th.bincount(all_source, minlength=n_nodes)
+        indptr = th.cat([th.zeros(1, dtype=th.long), th.cumsum(degree, 0)])
+
+        # Two distinct out-edges per source with at least two of them: one for validation, one for test
+        sources = th.arange(first_node, n_nodes)
+        sources = sources[degree[sources] >= 2]
+        deg = degree[sources]
+        val_pos = (th.rand(len(sources), generator=generator) * deg).long()
+        test_pos = (th.rand(len(sources), generator=generator) * (deg - 1)).long()
+        test_pos = test_pos + (test_pos >= val_pos).long()
+        val_list = order[indptr[sources] + val_pos]
+        test_list = order[indptr[sources] + test_pos]
+
+        val_source, val_target = all_source[val_list], all_target[val_list]
+        test_source, test_target = all_source[test_list], all_target[test_list]
+
+        train_mask = th.ones(n_edges, dtype=th.bool)
+        train_mask[val_list] = False
+        train_mask[test_list] = False
+        tra_source, tra_target = all_source[train_mask], all_target[train_mask]
+
+        val_target_neg = th.randint(low=0, high=first_node, size=(len(val_source), neg_len), generator=generator)
+        test_target_neg = th.randint(low=0, high=first_node, size=(len(test_source), neg_len), generator=generator)
 
         # ! 创建dict类型存法
         edge_split = {'train': {'source_node': tra_source, 'target_node': tra_target},
@@ -263,7 +249,7 @@ def split_edge_MMR(dgl_graph, time=2015, random_seed=42, neg_len=1000, path=None
 
         th.save(edge_split, os.path.join(path, 'edge_split.pt'))
         # ! 保存子图
-        train_g = dgl.remove_edges(dgl_graph, val_list + test_list)
+        train_g = dgl.remove_edges(dgl_graph, th.cat([val_list, test_list]).to(dgl_graph.idtype))
         dgl.save_graphs(os.path.join(path, 'train_G.pt'), train_g)
 
     return edge_split, train_g
@@ -20,6 +20,13 @@ def args_init():
     argparser.add_argument(
         "--n-epochs", type=int, default=1000, help="number of epochs"
     )
+    argparser.add_argument(
+        "--seed", type=int, default=None, help="run i is seeded with seed + i, unseeded if not given"
+    )
+    argparser.add_argument(
+        "--parallel-runs", type=int, default=1,
+        help="runs trained at once as stacked replicas of the model (full-batch GCN, SAGE, MLP, APPNP)"
+    )
     argparser.add_argument(
         "--lr", type=float, default=0.005, help="learning rate"
     )
@@ -110,6 +117,56 @@ def args_init():
     argparser.add_argument(
         "--val_ratio", type=float, default=0.2, help="training ratio"
     )
+    argparser.add_argument(
+        "--no_graph_cache", action="store_true",
+        help="Preprocess the raw graph (and propagate the Decoupled.py hops) on every launch instead of using the caches"
+    )
+    # ! Mini-batch training on sampled neighbourhoods
+    argparser.add_argument(
+        "--sampled", action="store_true",
+        help="Train on sampled mini-batches, the graph and features stay in host memory"
+    )
+    argparser.add_argument(
+        "--fanouts", type=int, nargs="+", default=[10],
+        help="Neighbours sampled per layer (one value for all layers, -1 for all neighbours)"
+    )
+    argparser.add_argument(
+        "--batch-size", type=int, default=1024, help="number of seed nodes per sampled mini-batch"
+    )
+    argparser.add_argument(
+        "--eval-batch-size", type=int, default=4096, help="number of nodes per batch of the sampled inference"
+    )
+    argparser.add_argument(
+        "--num-workers", type=int, default=0, help="sampling worker processes"
+    )
+    # ! Subgraph training on partitions
+    argparser.add_argument(
+        "--partition", type=str, default=None, choices=['cluster', 'saint'],
+        help="Train on induced subgraphs: METIS partitions (ClusterGCN) or random walks (GraphSAINT)"
+    )
+    argparser.add_argument(
+        "--n-parts", type=int, default=1000, help="number of METIS partitions, cached on disk"
+    )
+    argparser.add_argument(
+        "--parts-per-batch", type=int, default=20, help="partitions merged into one ClusterGCN batch"
+    )
+    argparser.add_argument(
+        "--walk-roots", type=int, default=3000, help="random walk roots per GraphSAINT batch"
+    )
+    argparser.add_argument(
+        "--walk-length", type=int, default=2, help="random walk length of the GraphSAINT sampler"
+    )
+    # ! Precomputed propagation (SGC / SIGN)
+    argparser.add_argument(
+        "--n-hops", type=int, default=3, help="number of precomputed propagation hops"
+    )
+    argparser.add_argument(
+        "--propagation-norm", type=str, default="sym", choices=["sym", "rw"],
+        help="adjacency normalisation of the propagation: D^-1/2 A D^-1/2 (sym) or D^-1 A (rw)"
+    )
+    argparser.add_argument(
+        "--propagation-chunk", type=int, default=65536, help="nodes propagated at a time while building the hops"
+    )
     return argparser
 
 class Logger(object):
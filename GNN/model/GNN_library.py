@@ -10,6 +10,31 @@ from dgl.sampling import node2vec_random_walk
 from torch.utils.data import DataLoader
 
 
+def _layer_graph(graph, i):
+    # A list of DGL blocks (sampled mini-batch) holds one block per layer, a full graph is shared by all layers
+    return graph[i] if isinstance(graph, (list, tuple)) else graph
+
+
+def _graph_conv(conv, graph, h, src_norm):
+    """dglnn.GraphConv(norm='both') with given source norms, e.g. those of the full graph for a block of it"""
+    with graph.local_scope():
+        h = h * src_norm.view(-1, *[1] * (h.dim() - 1))
+        # Same order of transform and aggregation as GraphConv
+        if conv._in_feats > conv._out_feats:
+            graph.srcdata['h'] = torch.matmul(h, conv.weight)
+            graph.update_all(fn.copy_u('h', 'm'), fn.sum('m', 'h'))
+            rst = graph.dstdata['h']
+        else:
+            graph.srcdata['h'] = h
+            graph.update_all(fn.copy_u('h', 'm'), fn.sum('m', 'h'))
+            rst = torch.matmul(graph.dstdata['h'], conv.weight)
+        dst_norm = torch.pow(graph.in_degrees().float().clamp(min=1), -0.5)
+        rst = rst * dst_norm.view(-1, *[1] * (rst.dim() - 1))
+        if conv.bias is not None:
+            rst = rst + conv.bias
+        return rst
+
+
 class ElementWiseLinear(nn.Module):
     def __init__(self, size, weight=True, bias=True, inplace=False):
         super().__init__()
@@ -122,18 +147,23 @@ class GraphSAGE(nn.Module):
         self.dropout = nn.Dropout(dropout)
         self.activation = activation
 
+    def forward_layer(self, l, graph, h, src_norm=None):
+        # src_norm is unused, the mean aggregation does not depend on the source degrees
+        h = self.layers[l](graph, h)
+
+        if l != len(self.layers) - 1:
+            h = self.norms[l](h)
+            h = self.activation(h)
+            h = self.dropout(h)
+
+        return h
+
     def forward(self, graph, feat):
         h = feat
         h = self.input_drop(h)
 
-        for l, layer in enumerate(self.layers):
-            conv = layer(graph, h)
-            h = conv
-
-            if l != len(self.layers) - 1:
-                h = self.norms[l](h)
-                h = self.activation(h)
-                h = self.dropout(h)
+        for l in range(len(self.layers)):
+            h = self.forward_layer(l, _layer_graph(graph, l), h)
 
         return h
 
@@ -173,18 +203,26 @@ class GCN(nn.Module):
         self.dropout = nn.Dropout(dropout)
         self.activation = activation
 
+    def forward_layer(self, i, graph, h, src_norm=None):
+        # On a block, src_norm replaces the norms of its out-degrees, which only count the batch's destination nodes
+        if src_norm is None:
+            h = self.convs[i](graph, h)
+        else:
+            h = _graph_conv(self.convs[i], graph, h, src_norm)
+
+        if i < self.n_layers - 1:
+            h = self.norms[i](h)
+            h = self.activation(h)
+            h = self.dropout(h)
+
+        return h
+
     def forward(self, graph, feat):
         h = feat
         h = self.input_drop(h)
 
         for i in range(self.n_layers):
-            conv = self.convs[i](graph, h)
-            h = conv
-
-            if i < self.n_layers - 1:
-                h = self.norms[i](h)
-                h = self.activation(h)
-                h = self.dropout(h)
+            h = self.forward_layer(i, _layer_graph(graph, i), h)
 
         return h
 
@@ -260,7 +298,7 @@ class GATConv(nn.Module):
     def set_allow_zero_in_degree(self, set_value):
         self._allow_zero_in_degree = set_value
 
-    def forward(self, graph, feat):
+    def forward(self, graph, feat, src_norm=None):
         with graph.local_scope():
             if not self._allow_zero_in_degree:
                 if (graph.in_degrees() == 0).any():
@@ -292,10 +330,12 @@ class GATConv(nn.Module):
                     feat_dst = feat_src
 
             if self._use_symmetric_norm:
-                degs = graph.out_degrees().float().clamp(min=1)
-                norm = torch.pow(degs, -0.5)
-                shp = norm.shape + (1,) * (feat_src.dim() - 1)
-                norm = torch.reshape(norm, shp)
+                # src_norm overrides the norms of the out-degrees, which on a block only count its destination nodes
+                if src_norm is None:
+                    degs = graph.out_degrees().float().clamp(min=1)
+                    src_norm = torch.pow(degs, -0.5)
+                shp = src_norm.shape + (1,) * (feat_src.dim() - 1)
+                norm = torch.reshape(src_norm, shp)
                 feat_src = feat_src * norm
 
             # NOTE: GAT paper uses "first concatenation then linear projection"
@@ -412,23 +452,26 @@ class GAT(nn.Module):
         self.dropout = nn.Dropout(dropout)
         self.activation = activation
 
+    def forward_layer(self, i, graph, h, src_norm=None):
+        h = self.convs[i](graph, h, src_norm=src_norm)
+
+        if i < self.n_layers - 1:
+            h = h.flatten(1)
+            h = self.norms[i](h)
+            h = self.activation(h, inplace=True)
+            h = self.dropout(h)
+        else:
+            h = h.mean(1)
+            h = self.bias_last(h)
+
+        return h
+
     def forward(self, graph, feat):
         h = feat
         h = self.input_drop(h)
 
         for i in range(self.n_layers):
-            conv = self.convs[i](graph, h)
-
-            h = conv
-
-            if i < self.n_layers - 1:
-                h = h.flatten(1)
-                h = self.norms[i](h)
-                h = self.activation(h, inplace=True)
-                h = self.dropout(h)
-
-        h = h.mean(1)
-        h = self.bias_last(h)
+            h = self.forward_layer(i, _layer_graph(graph, i), h)
 
         return h
 
@@ -504,6 +547,37 @@ class MLP(nn.Module):
             return self.linears[-1](h)
 
 
+class SGC(nn.Module):
+    """SGC on precomputed hops (model/propagation.py): a linear classifier of the last hop"""
+    def __init__(self, in_feats, n_classes, input_drop=0.0):
+        super(SGC, self).__init__()
+        self.input_drop = nn.Dropout(input_drop)
+        self.linear = nn.Linear(in_feats, n_classes)
+
+    def forward(self, hops):
+        # hops: (batch, n_hops + 1, in_feats)
+        return self.linear(self.input_drop(hops[:, -1]))
+
+
+class SIGN(nn.Module):
+    """SIGN on precomputed hops (model/propagation.py): one linear branch per hop, concatenated and classified by
+    an MLP
+    """
+    def __init__(self, in_feats, n_hidden, n_classes, n_hops, n_layers, dropout=0.5, input_drop=0.0):
+        super(SIGN, self).__init__()
+        self.inception = nn.ModuleList([nn.Linear(in_feats, n_hidden) for _ in range(n_hops + 1)])
+        self.input_drop = nn.Dropout(input_drop)
+        self.dropout = nn.Dropout(dropout)
+        self.project = MLP(n_layers, (n_hops + 1) * n_hidden, n_hidden, n_classes, dropout=dropout)
+
+    def forward(self, hops):
+        # hops: (batch, n_hops + 1, in_feats)
+        hops = self.input_drop(hops)
+        h = torch.cat([layer(hops[:, k]) for k, layer in enumerate(self.inception)], dim=-1)
+        h = self.dropout(F.relu(h))
+        return self.project(h)
+
+
 class GIN(nn.Module):
     """GIN model"""
     def __init__(self, in_feats, n_hidden, n_classes, n_layers, num_mlp_layers,
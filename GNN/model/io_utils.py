@@ -0,0 +1,19 @@
+import os
+from contextlib import contextmanager
+
+
+@contextmanager
+def atomic_path(path):
+    """Yield a temporary path next to path, renamed onto path once the block exits cleanly.
+    The temporary name is private to the process, so concurrent launches of a sweep never read (or interleave)
+    a half written cache file, and a crash leaves a stray .tmp file instead of a truncated path.
+    """
+    root, ext = os.path.splitext(path)
+    tmp_path = f'{root}.{os.getpid()}.tmp{ext}'
+    try:
+        yield tmp_path
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
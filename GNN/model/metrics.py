@@ -0,0 +1,52 @@
+import torch as th
+
+# Evaluation of all splits in one pass on the device of the logits.
+# Macro-F1 follows sklearn's f1_score(average='macro'): classes absent from both y_true and y_pred are skipped,
+# classes with an empty denominator count as 0.
+
+
+def macro_f1(pred_label, labels, splits, n_classes):
+    """Macro-F1 of every split from one bincount of (split, label, prediction) triples"""
+    ids = th.cat(splits)
+    sizes = th.tensor([len(idx) for idx in splits], device=ids.device)
+    split_id = th.repeat_interleave(th.arange(len(splits), device=ids.device), sizes)
+    confusion = th.bincount((split_id * n_classes + labels[ids]) * n_classes + pred_label[ids],
+                            minlength=len(splits) * n_classes ** 2).view(len(splits), n_classes, n_classes)
+    tp = confusion.diagonal(dim1=1, dim2=2).float()
+    # 2 tp + fp + fn = row sum (true) + column sum (predicted)
+    denominator = (confusion.sum(1) + confusion.sum(2)).float()
+    return (2 * tp / denominator.clamp(min=1)).sum(1) / (denominator > 0).sum(1).clamp(min=1)
+
+
+@th.no_grad()
+def fused_metrics(pred, labels, splits, metric='acc', loss_fn=None, loss_splits=()):
+    """metric ('acc' or macro-'f1') of every split followed by loss_fn of every loss split, as python floats.
+    Everything is computed on the device of pred and copied to the host once.
+    """
+    pred_label = pred.argmax(1)
+    if metric == 'acc':
+        scores = [(pred_label[idx] == labels[idx]).float().mean() for idx in splits]
+    else:
+        scores = list(macro_f1(pred_label, labels, splits, pred.shape[1]))
+    losses = [loss_fn(pred[idx], labels[idx]).float() for idx in loss_splits]
+    return th.stack(scores + losses).tolist()
+
+
+def split_metrics(pred, labels, train_idx, val_idx, test_idx, loss_fn, metric='acc'):
+    """Train/val/test metric followed by the val/test loss_fn, in one pass on device"""
+    return fused_metrics(pred, labels, (train_idx, val_idx, test_idx), metric, loss_fn, (val_idx, test_idx))
+
+
+def is_deterministic_in_train(model):
+    """True if the train mode forward of model equals its eval mode forward: no active dropout (including edge
+    dropout) and no batch norm, so that the training logits can be evaluated directly
+    """
+    for module in model.modules():
+        if isinstance(module, th.nn.modules.batchnorm._BatchNorm):
+            return False
+        if 'Dropout' in type(module).__name__ and getattr(module, 'p', 0) > 0:
+            return False
+        # Rates kept as plain floats and applied functionally (GATConv edge_drop, RevGAT dropout)
+        if any(isinstance(getattr(module, k, None), float) and getattr(module, k) > 0 for k in ['edge_drop', 'dropout']):
+            return False
+    return True
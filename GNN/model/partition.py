@@ -0,0 +1,111 @@
+import os
+import resource
+
+import dgl
+import torch as th
+
+from model.Dataloader import graph_key
+from model.io_utils import atomic_path
+from model.sampling import is_block_model, layerwise_inference
+
+# Subgraph training on graph partitions.
+# cluster (ClusterGCN): the graph is METIS-partitioned once, each step trains on the subgraph induced by a random
+# union of partitions. saint (GraphSAINT random-walk sampler): each step trains on the subgraph induced by random
+# walks from random training nodes. Any gen_model model runs unchanged on the induced subgraphs.
+PARTITION_DIR = 'partitions'
+
+
+def partition_assignment(graph, n_parts, cache_dir=None, name='graph'):
+    """METIS partition id of every node, cached in {cache_dir}/partitions/"""
+    cache_file = None
+    if cache_dir is not None:
+        cache_file = os.path.join(cache_dir, PARTITION_DIR, f'{name}_{graph_key(graph)}_{n_parts}.pt')
+        if os.path.exists(cache_file):
+            return th.load(cache_file)
+    assignment = dgl.metis_partition_assignment(graph, n_parts)
+    if cache_file is not None:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with atomic_path(cache_file) as tmp_file:
+            th.save(assignment, tmp_file)
+    return assignment
+
+
+class ClusterBatches:
+    """Every batch is the union of parts_per_batch partitions, all partitions are visited once per epoch"""
+
+    def __init__(self, assignment, parts_per_batch, shuffle=True):
+        self.n_parts = int(assignment.max()) + 1
+        self.nodes = th.argsort(assignment)
+        self.offsets = th.cat([th.zeros(1, dtype=th.long), th.cumsum(th.bincount(assignment, minlength=self.n_parts), 0)])
+        self.parts_per_batch = parts_per_batch
+        self.shuffle = shuffle
+
+    def __len__(self):
+        return -(-self.n_parts // self.parts_per_batch)
+
+    def __iter__(self):
+        parts = th.randperm(self.n_parts) if self.shuffle else th.arange(self.n_parts)
+        for i in range(0, self.n_parts, self.parts_per_batch):
+            yield th.cat([self.nodes[self.offsets[p]:self.offsets[p + 1]] for p in parts[i:i + self.parts_per_batch]])
+
+
+class RandomWalkBatches:
+    """Every batch is the set of nodes visited by random walks of walk_length from n_roots random training nodes"""
+
+    def __init__(self, graph, train_idx, n_roots, walk_length, n_steps):
+        self.graph, self.train_idx = graph, train_idx
+        self.n_roots, self.walk_length, self.n_steps = n_roots, walk_length, n_steps
+
+    def __len__(self):
+        return self.n_steps
+
+    def __iter__(self):
+        for _ in range(self.n_steps):
+            roots = self.train_idx[th.randint(len(self.train_idx), (self.n_roots,))]
+            traces, _ = dgl.sampling.random_walk(self.graph, roots, length=self.walk_length)
+            yield th.unique(traces[traces >= 0])
+
+
+def train_partitions(model, graph, batches, feat, labels, train_mask, optimizer, loss_fn, device):
+    """One epoch over the induced subgraphs of batches, returns the mean training loss"""
+    model.train()
+    total_loss, n_seeds = 0, 0
+    for nodes in batches:
+        mask = train_mask[nodes]
+        n_train = int(mask.sum())
+        if n_train == 0:
+            continue
+        subgraph = dgl.node_subgraph(graph, nodes).to(device)
+        pred = model(subgraph, feat[nodes].to(device))
+        loss = loss_fn(pred[mask.to(device)], labels[nodes[mask]].to(device))
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+        total_loss += loss.detach() * n_train
+        n_seeds += n_train
+    return total_loss / max(n_seeds, 1)
+
+
+@th.no_grad()
+def partition_inference(model, graph, batches, feat, batch_size, device):
+    """Logits of every node. Block models get their full-graph logits from layerwise_inference (degree norms of the
+    full graph). Other models run on the induced subgraphs of the (unshuffled) batches, an approximation: edges
+    leaving a batch are dropped and degrees are those of the subgraph.
+    """
+    if is_block_model(model):
+        return layerwise_inference(model, graph, feat, batch_size, device)
+    model.eval()
+    out = None
+    for nodes in batches:
+        pred = model(dgl.node_subgraph(graph, nodes).to(device), feat[nodes].to(device))
+        if out is None:
+            out = th.empty((graph.num_nodes(), *pred.shape[1:]), dtype=pred.dtype, device=feat.device)
+        out[nodes] = pred.to(feat.device)
+    return out
+
+
+def peak_memory(device):
+    """Peak memory in MB: allocated on the GPU, resident set of the process on CPU"""
+    if device.type == 'cuda':
+        return th.cuda.max_memory_allocated(device) / 2 ** 20
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+import scipy.sparse as sp
+import torch as th
+from numpy.lib.format import open_memmap
+
+from model.Dataloader import graph_key
+from model.io_utils import atomic_path
+
+# Precomputed propagation (SGC / SIGN) of fixed node features over the fixed preprocessed graph.
+# Hop k is Â^k X, Â being the symmetrically ('sym', D^-1/2 A D^-1/2) or row ('rw', D^-1 A) normalised adjacency of
+# the self-looped graph. Hops 1..K are saved as fp32 hop_{k}.npy and read memory-mapped, hop 0 is the feature array
+# itself. Every hop is computed from the previous one a chunk of destination nodes at a time, reading only the rows
+# of their neighbours, so neither the features nor the hops ever have to fit in memory. propagation.json is the
+# header, rewritten after every finished hop; a later request for more hops continues from the last one.
+# Without a cache folder the hops are computed in memory for the current launch only.
+PROPAGATION_DIR = 'propagation'
+PROPAGATION_HEADER = 'propagation.json'
+
+
+def propagation_folder(cache_dir, name, graph, norm, feat_file=None):
+    """Cache folder of the features (the feat_file .npy, or the graph's own features) propagated over graph,
+    None without cache_dir
+    """
+    if cache_dir is None:
+        return None
+    identity = {'graph': graph_key(graph), 'norm': norm, 'feat': 'ndata'}
+    if feat_file is not None:
+        stat = os.stat(feat_file)
+        identity.update({'feat': os.path.abspath(feat_file), 'size': stat.st_size, 'mtime': int(stat.st_mtime)})
+    key = hashlib.sha1(json.dumps(identity, sort_keys=True).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, PROPAGATION_DIR, f'{name}_{key}')
+
+
+def normalized_adjacency(graph, norm='sym'):
+    """Â as a scipy CSR matrix, row i holds the in-edges of node i"""
+    src, dst = (e.cpu().numpy() for e in graph.edges())
+    n = graph.num_nodes()
+    in_deg = np.bincount(dst, minlength=n).clip(min=1).astype(np.float32)
+    if norm == 'sym':
+        out_deg = np.bincount(src, minlength=n).clip(min=1).astype(np.float32)
+        values = out_deg[src] ** -0.5 * in_deg[dst] ** -0.5
+    elif norm == 'rw':
+        values = 1 / in_deg[dst]
+    else:
+        raise ValueError(f'Unknown normalisation {norm}')
+    return sp.csr_matrix((values, (dst, src)), shape=(n, n))
+
+
+def _propagate(adj, x, out, chunk_size):
+    # out = adj @ x, one chunk of rows at a time over the neighbour rows of x only
+    for i in range(0, adj.shape[0], chunk_size):
+        block = adj[i:i + chunk_size]
+        cols, local = np.unique(block.indices, return_inverse=True)
+        block = sp.csr_matrix((block.data, local, block.indptr), shape=(block.shape[0], len(cols)))
+        out[i:i + block.shape[0]] = block @ np.asarray(x[cols], dtype=np.float32)
+
+
+def _read_header(folder):
+    header_file = os.path.join(folder, PROPAGATION_HEADER)
+    if not os.path.exists(header_file):
+        return None
+    with open(header_file) as f:
+        return json.load(f)
+
+
+def load_propagation(folder, graph, feat, n_hops, norm='sym', chunk_size=65536, log=print):
+    """Hops 0..n_hops of feat (an (N, C) array, memory-mapped or not) over graph, computing the missing ones.
+    folder=None computes all of them in memory without caching.
+    """
+    if folder is None:
+        start = time.time()
+        adj = normalized_adjacency(graph, norm)
+        hops = [feat]
+        for k in range(1, n_hops + 1):
+            hops.append(np.empty(feat.shape, dtype=np.float32))
+            _propagate(adj, hops[-2], hops[-1], chunk_size)
+        log(f'Hops 1..{n_hops} of the {norm} propagation computed in memory in {time.time() - start:.1f}s')
+        return PropagatedFeatures(hops)
+    header = _read_header(folder)
+    done = header['n_hops'] if header is not None else 0
+    if done < n_hops:
+        start = time.time()
+        os.makedirs(folder, exist_ok=True)
+        adj = normalized_adjacency(graph, norm)
+        prev = feat if done == 0 else np.load(os.path.join(folder, f'hop_{done}.npy'), mmap_mode='r')
+        for k in range(done + 1, n_hops + 1):
+            with atomic_path(os.path.join(folder, f'hop_{k}.npy')) as tmp_file:
+                out = open_memmap(tmp_file, mode='w+', dtype=np.float32, shape=feat.shape)
+                _propagate(adj, prev, out, chunk_size)
+                out.flush()
+                del out
+            header = {'n_hops': k, 'norm': norm, 'n_nodes': int(feat.shape[0]), 'n_feats': int(feat.shape[1])}
+            with atomic_path(os.path.join(folder, PROPAGATION_HEADER)) as tmp_file:
+                with open(tmp_file, 'w') as f:
+                    json.dump(header, f)
+            prev = np.load(os.path.join(folder, f'hop_{k}.npy'), mmap_mode='r')
+        log(f'Hops {done + 1}..{n_hops} of the {norm} propagation saved to {folder} in {time.time() - start:.1f}s')
+    return PropagatedFeatures([feat] + [np.load(os.path.join(folder, f'hop_{k}.npy'), mmap_mode='r')
+                                        for k in range(1, n_hops + 1)])
+
+
+class PropagatedFeatures:
+    """Hops 0..n_hops of every node, hop 0 being the input features"""
+
+    def __init__(self, hops):
+        self.hops = hops
+
+    def __len__(self):
+        return len(self.hops[0])
+
+    @property
+    def n_hops(self):
+        return len(self.hops) - 1
+
+    @property
+    def n_feats(self):
+        return self.hops[0].shape[1]
+
+    def gather(self, nodes):
+        """(len(nodes), n_hops + 1, n_feats) fp32 tensor; a slice or sorted node ids keep the reads sequential"""
+        if isinstance(nodes, th.Tensor):
+            nodes = nodes.cpu().numpy()
+        return th.from_numpy(np.stack([np.asarray(hop[nodes], dtype=np.float32) for hop in self.hops], 1))
+
+
+def train_propagated(model, hops, labels, train_idx, optimizer, loss_fn, batch_size, device):
+    """One epoch over shuffled mini-batches of training nodes, returns the mean training loss"""
+    model.train()
+    total_loss = 0
+    for batch in th.randperm(len(train_idx), device=train_idx.device).split(batch_size):
+        # Sorted ids read the memory-mapped hops sequentially, the loss does not depend on the order
+        nodes, _ = th.sort(train_idx[batch])
+        pred = model(hops.gather(nodes).to(device))
+        loss = loss_fn(pred, labels[nodes].to(device))
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+        total_loss += loss.detach() * len(nodes)
+    return total_loss / len(train_idx)
+
+
+@th.no_grad()
+def propagated_inference(model, hops, batch_size, device):
+    """Logits of every node, a contiguous range of nodes at a time"""
+    model.eval()
+    return th.cat([model(hops.gather(slice(i, i + batch_size)).to(device)) for i in range(0, len(hops), batch_size)])
@@ -0,0 +1,168 @@
+import dgl.function as fn
+import torch as th
+import torch.nn as nn
+import torch.nn.functional as F
+
+from model.GNN_library import APPNP, GCN, GraphSAGE, MLP
+
+# Several independent runs of one gen_model model trained at once on the same graph and features.
+# Every replica keeps its own parameters (and so its own optimizer and scheduler), the forward stacks their weights
+# and runs every layer once for all of them on (N, R, C) node features: one feature transform per layer, a single GEMM
+# while the input is still shared, and one message passing pass over the graph. Node features stay (N, C) while they
+# are shared by all replicas, i.e. until the first dropout or weight. Every layer follows the arithmetic of the
+# module it replaces, so a replica computes what the model alone computes; dropout masks are drawn per replica.
+
+
+def _stack(tensors):
+    return th.stack(list(tensors))
+
+
+def _linear(h, weight, bias=None):
+    """h (N, in) shared by all replicas or (N, R, in), weight (R, in, out), bias (R, out) -> (N, R, out)"""
+    if h.dim() == 2:
+        out = (h @ weight.transpose(0, 1).reshape(weight.shape[1], -1)).view(len(h), weight.shape[0], -1)
+    else:
+        out = th.matmul(h.transpose(0, 1), weight).transpose(0, 1)
+    return out if bias is None else out + bias
+
+
+def _nn_linear(linears, h):
+    bias = None if linears[0].bias is None else _stack(l.bias for l in linears)
+    return _linear(h, _stack(l.weight.t() for l in linears), bias)
+
+
+def _dropout(dropout, h, n_replicas):
+    # A shared input is expanded first, so that every replica draws its own mask
+    if not dropout.training or dropout.p == 0:
+        return h
+    if h.dim() == 2:
+        h = h.unsqueeze(1).expand(-1, n_replicas, -1)
+    return dropout(h)
+
+
+def _batch_norm(norms, h):
+    """BatchNorm1d of every replica on (N, R, C), the running statistics are written back to the replicas"""
+    norm = norms[0]
+    mean, var = th.cat([n.running_mean for n in norms]), th.cat([n.running_var for n in norms])
+    out = F.batch_norm(h.reshape(len(h), -1), mean, var, th.cat([n.weight for n in norms]),
+                       th.cat([n.bias for n in norms]), norm.training, norm.momentum, norm.eps)
+    if norm.training:
+        with th.no_grad():
+            for n, m, v in zip(norms, mean.chunk(len(norms)), var.chunk(len(norms))):
+                n.running_mean.copy_(m)
+                n.running_var.copy_(v)
+                n.num_batches_tracked += 1
+    return out.view(h.shape)
+
+
+def _aggregate(graph, h, reducer=fn.sum):
+    with graph.local_scope():
+        graph.srcdata['h'] = h
+        graph.update_all(fn.copy_u('h', 'm'), reducer('m', 'h'))
+        return graph.dstdata['h']
+
+
+def _graph_conv(convs, graph, h):
+    """dglnn.GraphConv(norm='both') of every replica"""
+    conv = convs[0]
+    norm = th.pow(graph.out_degrees().float().clamp(min=1), -0.5)
+    h = h * norm.view(-1, *[1] * (h.dim() - 1))
+    weight = _stack(c.weight for c in convs)
+    # Same order of transform and aggregation as GraphConv
+    if conv._in_feats > conv._out_feats:
+        h = _aggregate(graph, _linear(h, weight))
+    else:
+        h = _linear(_aggregate(graph, h), weight)
+    h = h * th.pow(graph.in_degrees().float().clamp(min=1), -0.5).view(-1, 1, 1)
+    if conv.bias is not None:
+        h = h + _stack(c.bias for c in convs)
+    return h
+
+
+def _sage_conv(convs, graph, h):
+    """dglnn.SAGEConv(aggregator_type='mean') of every replica"""
+    conv = convs[0]
+    fc_neigh = [c.fc_neigh for c in convs]
+    if conv._in_src_feats > conv._out_feats:
+        h_neigh = _aggregate(graph, _nn_linear(fc_neigh, h), fn.mean)
+    else:
+        h_neigh = _nn_linear(fc_neigh, _aggregate(graph, h, fn.mean))
+    rst = _nn_linear([c.fc_self for c in convs], h) + h_neigh
+    if getattr(conv, 'bias', None) is not None:
+        rst = rst + _stack(c.bias for c in convs)
+    return rst
+
+
+def _gcn(models, graph, feat):
+    model = models[0]
+    h = _dropout(model.input_drop, feat, len(models))
+    for i in range(model.n_layers):
+        h = _graph_conv([m.convs[i] for m in models], graph, h)
+        if i < model.n_layers - 1:
+            h = _batch_norm([m.norms[i] for m in models], h)
+            h = model.activation(h)
+            h = _dropout(model.dropout, h, len(models))
+    return h
+
+
+def _sage(models, graph, feat):
+    model = models[0]
+    h = _dropout(model.input_drop, feat, len(models))
+    for l in range(len(model.layers)):
+        h = _sage_conv([m.layers[l] for m in models], graph, h)
+        if l != len(model.layers) - 1:
+            h = _batch_norm([m.norms[l] for m in models], h)
+            h = model.activation(h)
+            h = _dropout(model.dropout, h, len(models))
+    return h
+
+
+def _mlp(models, graph, feat):
+    model = models[0]
+    if model.linear_or_not:
+        return _nn_linear([m.linear for m in models], feat)
+    h = _dropout(model.input_drop, feat, len(models))
+    for i in range(model.num_layers - 1):
+        h = F.relu(_batch_norm([m.batch_norms[i] for m in models], _nn_linear([m.linears[i] for m in models], h)))
+        h = _dropout(model.dropout, h, len(models))
+    return _nn_linear([m.linears[-1] for m in models], h)
+
+
+def _appnp(models, graph, feat):
+    model = models[0]
+    h = _dropout(model.input_drop, feat, len(models))
+    h = model.activation(_nn_linear([m.layers[0] for m in models], h))
+    for i in range(1, model.n_layers - 1):
+        h = model.activation(_nn_linear([m.layers[i] for m in models], h))
+    h = _nn_linear([m.layers[-1] for m in models], _dropout(model.input_drop, h, len(models)))
+    # The edge dropout of the propagation is drawn once per call, so every replica propagates on its own
+    if model.propagate.training and model.propagate.edge_drop.p > 0:
+        return th.stack([m.propagate(graph, h[:, r]) for r, m in enumerate(models)], 1)
+    return model.propagate(graph, h)
+
+
+REPLICA_FORWARDS = {GCN: _gcn, GraphSAGE: _sage, MLP: _mlp, APPNP: _appnp}
+# gen_model names of the models above
+REPLICA_MODEL_NAMES = {'GCN', 'SAGE', 'MLP', 'APPNP'}
+
+
+def supports_replicas(model_name, aggregator_type='mean'):
+    """Decided from the gen_model arguments, without building a model. SAGE only with the mean aggregator"""
+    if model_name == 'SAGE':
+        return aggregator_type == 'mean'
+    return model_name in REPLICA_MODEL_NAMES
+
+
+class Replicas(nn.Module):
+    """Independently initialised copies of one model, forward gives the (N, R, n_classes) logits of all of them"""
+
+    def __init__(self, models):
+        super().__init__()
+        self.models = nn.ModuleList(models)
+        self._forward = REPLICA_FORWARDS[type(models[0])]
+
+    def __len__(self):
+        return len(self.models)
+
+    def forward(self, graph, feat):
+        return self._forward(list(self.models), graph, feat)
@@ -0,0 +1,86 @@
+import dgl
+import torch as th
+
+# Mini-batch training on sampled neighbourhoods.
+# Models with a forward_layer (GCN, SAGE, GAT in GNN_library) run on per-layer blocks of a NeighborSampler and are
+# evaluated with exact layer-wise full-neighbour inference. Every other model runs unchanged on the ShaDow subgraph
+# sampled around its seeds (the seeds come first in the subgraph), with the same sampler at evaluation.
+
+
+def is_block_model(model):
+    return hasattr(model, 'forward_layer')
+
+
+def layer_fanouts(fanouts, n_layers):
+    # A single fanout is used for every layer, -1 takes all the neighbours
+    return list(fanouts) * n_layers if len(fanouts) == 1 else list(fanouts)
+
+
+def sampled_loader(graph, nodes, fanouts, batch_size, block=True, shuffle=True, num_workers=0):
+    sampler = dgl.dataloading.NeighborSampler(fanouts) if block else dgl.dataloading.ShaDowKHopSampler(fanouts)
+    return dgl.dataloading.DataLoader(graph, nodes, sampler, batch_size=batch_size, shuffle=shuffle,
+                                      drop_last=False, num_workers=num_workers)
+
+
+def _forward(model, sample, feat, device):
+    input_nodes, output_nodes, blocks = sample
+    x = feat[input_nodes].to(device)
+    if isinstance(blocks, list):
+        return output_nodes, model([block.to(device) for block in blocks], x)
+    return output_nodes, model(blocks.to(device), x)[:len(output_nodes)]
+
+
+def train_sampled(model, loader, feat, labels, optimizer, loss_fn, device):
+    """One epoch over the sampled mini-batches, returns the mean training loss"""
+    model.train()
+    total_loss, n_seeds = 0, 0
+    for sample in loader:
+        output_nodes, pred = _forward(model, sample, feat, device)
+        loss = loss_fn(pred, labels[output_nodes].to(device))
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+        total_loss += loss.detach() * len(output_nodes)
+        n_seeds += len(output_nodes)
+    return total_loss / n_seeds
+
+
+@th.no_grad()
+def layerwise_inference(model, graph, feat, batch_size, device, num_workers=0):
+    """Full-graph logits of every node, one layer over all nodes at a time, independent of batch_size.
+    The blocks hold all the in-neighbours of their nodes, but their out-degrees only count the batch's nodes, so the
+    symmetric norms of GCN (and GAT with use_symmetric_norm) are taken from the full graph's out-degrees.
+    The intermediate representations stay on the device of feat, so the graph never has to fit on the GPU.
+    """
+    model.eval()
+    nodes = th.arange(graph.num_nodes(), device=graph.device)
+    loader = sampled_loader(graph, nodes, [-1], batch_size, shuffle=False, num_workers=num_workers)
+    src_norm = th.pow(graph.out_degrees().float().clamp(min=1), -0.5)
+    h = feat
+    for i in range(model.n_layers):
+        out = None
+        for input_nodes, output_nodes, blocks in loader:
+            y = model.forward_layer(i, blocks[0].to(device), h[input_nodes].to(device),
+                                    src_norm=src_norm[input_nodes].to(device))
+            if out is None:
+                out = th.empty((graph.num_nodes(), *y.shape[1:]), dtype=y.dtype, device=feat.device)
+            out[output_nodes.to(feat.device)] = y.to(feat.device)
+        h = out
+    return h
+
+
+@th.no_grad()
+def sampled_inference(model, graph, feat, fanouts, batch_size, device, num_workers=0):
+    """Logits of every node: layer-wise for block models, on the ShaDow subgraphs otherwise"""
+    if is_block_model(model):
+        return layerwise_inference(model, graph, feat, batch_size, device, num_workers)
+    model.eval()
+    nodes = th.arange(graph.num_nodes(), device=graph.device)
+    loader = sampled_loader(graph, nodes, fanouts, batch_size, block=False, shuffle=False, num_workers=num_workers)
+    out = None
+    for sample in loader:
+        output_nodes, pred = _forward(model, sample, feat, device)
+        if out is None:
+            out = th.empty((graph.num_nodes(), *pred.shape[1:]), dtype=pred.dtype, device=feat.device)
+        out[output_nodes.to(feat.device)] = pred.to(feat.device)
+    return out
@@ -0,0 +1,77 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import torch as th
+
+from .io_utils import atomic_path
+
+# Node splits shared by the GNN entry points and the LM data layer.
+# All masks are vectorized; get_split additionally caches the index tensors next to the graph file.
+
+
+def random_split(n_nodes, train_ratio, val_ratio, seed=42, label=None):
+    """Random split, identical to the np.random.seed(42) permutation used so far.
+    If label is given, nodes labelled -1 are dropped after the permutation.
+    """
+    indices = np.random.RandomState(seed).permutation(n_nodes)
+    train_size = int(n_nodes * train_ratio)
+    val_size = int(n_nodes * val_ratio)
+    train_ids, val_ids, test_ids = indices[:train_size], indices[train_size:train_size + val_size], \
+        indices[train_size + val_size:]
+    if label is not None:
+        labelled = np.asarray(label) != -1
+        train_ids, val_ids, test_ids = [ids[labelled[ids]] for ids in (train_ids, val_ids, test_ids)]
+    return tuple(th.from_numpy(ids).long() for ids in (train_ids, val_ids, test_ids))
+
+
+def time_split(year, label, train_year, val_year):
+    """Temporal split of the labelled nodes: [.., train_year) / [train_year, val_year) / [val_year, ..)"""
+    year, label = th.as_tensor(year).view(-1), th.as_tensor(label).view(-1)
+    labelled = label != -1
+    train_mask = labelled & (year < train_year)
+    val_mask = labelled & (year >= train_year) & (year < val_year)
+    test_mask = labelled & (year >= val_year)
+    return tuple(th.nonzero(mask, as_tuple=True)[0] for mask in (train_mask, val_mask, test_mask))
+
+
+def _file_fingerprint(graph_file):
+    # Path, size and mtime: cheap to get and changes whenever the graph file is rewritten
+    stat = os.stat(graph_file)
+    return {'graph': os.path.abspath(graph_file), 'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+
+
+def get_split(graph, graph_file=None, way='random', train_ratio=0.6, val_ratio=0.2, train_year=None, val_year=None,
+              seed=42, drop_unlabeled=False):
+    """Returns (train_idx, val_idx, test_idx) as LongTensors.
+    way: 'random' or 'time'. When graph_file is given the split is cached in {graph_dir}/splits/, keyed by the graph
+    file fingerprint and the split parameters.
+    """
+    if way == 'random':
+        params = {'way': way, 'train_ratio': train_ratio, 'val_ratio': val_ratio, 'seed': seed,
+                  'drop_unlabeled': drop_unlabeled}
+    elif way == 'time':
+        params = {'way': way, 'train_year': train_year, 'val_year': val_year}
+    else:
+        raise ValueError('Please check the split datasets way')
+
+    cache_file = None
+    if graph_file is not None:
+        key = hashlib.sha1(json.dumps({**_file_fingerprint(graph_file), **params}, sort_keys=True).encode()).hexdigest()
+        cache_file = os.path.join(os.path.dirname(os.path.abspath(graph_file)), 'splits', f'{way}_{key[:16]}.pt')
+        if os.path.exists(cache_file):
+            split = th.load(cache_file)
+            return split['train'], split['valid'], split['test']
+
+    if way == 'random':
+        label = graph.ndata['label'] if drop_unlabeled else None
+        split = random_split(graph.num_nodes(), train_ratio, val_ratio, seed, label)
+    else:
+        split = time_split(graph.ndata['year'], graph.ndata['label'], train_year, val_year)
+
+    if cache_file is not None:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with atomic_path(cache_file) as tmp_file:
+            th.save(dict(zip(['train', 'valid', 'test'], split)), tmp_file)
+    return split
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The GNN scripts import their modules as model.*, from the GNN directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
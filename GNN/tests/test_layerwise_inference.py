@@ -0,0 +1,34 @@
+import pytest
+
+th = pytest.importorskip('torch')
+dgl = pytest.importorskip('dgl')
+F = th.nn.functional
+
+from model.GNN_library import GAT, GCN, GraphSAGE
+from model.sampling import layerwise_inference
+
+
+def _graph(n_nodes=40, n_edges=120):
+    th.manual_seed(0)
+    src, dst = th.randint(n_nodes, (n_edges,)), th.randint(n_nodes, (n_edges,))
+    graph = dgl.graph((th.cat([src, dst]), th.cat([dst, src])), num_nodes=n_nodes)
+    return graph.remove_self_loop().add_self_loop()
+
+
+MODELS = {
+    'GCN': lambda: GCN(8, 16, 3, 3, F.relu, 0.5),
+    'SAGE': lambda: GraphSAGE(8, 16, 3, 3, F.relu, 0.5, 'mean'),
+    'GAT': lambda: GAT(8, 3, 16, 3, 2, F.relu, 0.5, use_attn_dst=False, use_symmetric_norm=True),
+}
+
+
+@pytest.mark.parametrize('name', sorted(MODELS))
+@pytest.mark.parametrize('batch_size', [3, 7, 40])
+def test_layerwise_matches_full_graph(name, batch_size):
+    graph = _graph()
+    feat = th.randn(graph.num_nodes(), 8)
+    model = MODELS[name]().eval()
+    with th.no_grad():
+        expected = model(graph, feat)
+    pred = layerwise_inference(model, graph, feat, batch_size, th.device('cpu'))
+    assert th.allclose(pred, expected, atol=1e-5)
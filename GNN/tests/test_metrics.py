@@ -0,0 +1,35 @@
+import pytest
+
+th = pytest.importorskip('torch')
+sklearn_metrics = pytest.importorskip('sklearn.metrics')
+
+from model.metrics import fused_metrics, macro_f1, split_metrics
+
+
+def _predictions(n=200, n_classes=7, seed=0):
+    g = th.Generator().manual_seed(seed)
+    pred = th.randn(n, n_classes, generator=g)
+    # Class 6 never appears, class 5 only in the labels
+    labels = th.randint(5, (n,), generator=g)
+    labels[:3] = 5
+    pred[:, 5:] = -1e3
+    splits = tuple(th.randperm(n, generator=g).split([120, 50, 30]))
+    return pred, labels, splits
+
+
+def test_macro_f1_matches_sklearn():
+    pred, labels, splits = _predictions()
+    pred_label = pred.argmax(1)
+    expected = [sklearn_metrics.f1_score(labels[idx], pred_label[idx], average='macro') for idx in splits]
+    assert macro_f1(pred_label, labels, splits, pred.shape[1]).tolist() == pytest.approx(expected)
+
+
+def test_split_metrics():
+    pred, labels, (train_idx, val_idx, test_idx) = _predictions()
+    loss_fn = th.nn.functional.cross_entropy
+    results = split_metrics(pred, labels, train_idx, val_idx, test_idx, loss_fn)
+    expected = [(pred[idx].argmax(1) == labels[idx]).float().mean().item() for idx in (train_idx, val_idx, test_idx)]
+    expected += [loss_fn(pred[idx], labels[idx]).item() for idx in (val_idx, test_idx)]
+    assert results == pytest.approx(expected, rel=1e-5)
+    assert fused_metrics(pred, labels, (val_idx,), 'f1') == pytest.approx(
+        [sklearn_metrics.f1_score(labels[val_idx], pred[val_idx].argmax(1), average='macro')])
@@ -0,0 +1,55 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+th = pytest.importorskip('torch')
+dgl = pytest.importorskip('dgl')
+pytest.importorskip('ogb')
+pytest.importorskip('sklearn')
+
+from model.propagation import load_propagation, normalized_adjacency, propagation_folder
+
+
+def _graph(n_nodes=50, n_edges=200, n_feats=5):
+    th.manual_seed(0)
+    graph = dgl.add_self_loop(dgl.graph((th.randint(n_nodes, (n_edges,)), th.randint(n_nodes, (n_edges,))),
+                                        num_nodes=n_nodes))
+    return graph, np.random.RandomState(0).randn(n_nodes, n_feats).astype(np.float32)
+
+
+def _dense_hops(graph, feat, n_hops, norm):
+    # Â^k X with the dense adjacency, A[dst, src] = 1 for every edge
+    src, dst = (e.numpy() for e in graph.edges())
+    adj = np.zeros((graph.num_nodes(),) * 2)
+    np.add.at(adj, (dst, src), 1)
+    in_deg = adj.sum(1).clip(min=1)
+    if norm == 'sym':
+        adj = adj / np.sqrt(in_deg)[:, None] / np.sqrt(adj.sum(0).clip(min=1))[None]
+    else:
+        adj = adj / in_deg[:, None]
+    hops = [feat.astype(np.float64)]
+    for _ in range(n_hops):
+        hops.append(adj @ hops[-1])
+    return hops
+
+
+@pytest.mark.parametrize('norm', ['sym', 'rw'])
+def test_normalized_adjacency(norm):
+    graph, feat = _graph()
+    expected = _dense_hops(graph, feat, 1, norm)[1]
+    assert np.allclose(normalized_adjacency(graph, norm) @ feat, expected, atol=1e-5)
+
+
+@pytest.mark.parametrize('norm', ['sym', 'rw'])
+def test_propagation_matches_dense(tmp_path, norm):
+    graph, feat = _graph()
+    expected = _dense_hops(graph, feat, 3, norm)
+    folder = propagation_folder(str(tmp_path), 'toy', graph, norm)
+    # Chunks smaller than the graph, and a second request for more hops extending the cache
+    load_propagation(folder, graph, feat, 2, norm, chunk_size=7, log=lambda *_: None)
+    hops = load_propagation(folder, graph, feat, 3, norm, chunk_size=7, log=lambda *_: None)
+    in_memory = load_propagation(None, graph, feat, 3, norm, chunk_size=64, log=lambda *_: None)
+    for propagated in (hops, in_memory):
+        assert propagated.n_hops == 3
+        gathered = propagated.gather(th.tensor([0, 3, 49])).numpy()
+        for k in range(4):
+            assert np.allclose(gathered[:, k], expected[k][[0, 3, 49]], atol=1e-5)
@@ -0,0 +1,47 @@
+import pytest
+
+th = pytest.importorskip('torch')
+dgl = pytest.importorskip('dgl')
+F = th.nn.functional
+
+from model.GNN_library import APPNP, GCN, GraphSAGE, MLP
+from model.replicas import Replicas, supports_replicas
+
+IN_FEATS, N_HIDDEN, N_CLASSES = 6, 8, 3
+MODELS = {
+    'GCN': lambda: GCN(IN_FEATS, N_HIDDEN, N_CLASSES, 3, F.relu, 0.5, 0.1),
+    # in > out feats on the first layer, transform before aggregation
+    'SAGE': lambda: GraphSAGE(IN_FEATS, 4, N_CLASSES, 3, F.relu, 0.5, 'mean', 0.1),
+    'MLP': lambda: MLP(3, IN_FEATS, N_HIDDEN, N_CLASSES, 0.1, 0.5),
+    'APPNP': lambda: APPNP(IN_FEATS, 3, N_HIDDEN, N_CLASSES, F.relu, 0.1, 0.2, 0.1, 5),
+}
+
+
+def _graph(n_nodes=30, n_edges=90):
+    th.manual_seed(0)
+    graph = dgl.add_self_loop(dgl.graph((th.randint(n_nodes, (n_edges,)), th.randint(n_nodes, (n_edges,))),
+                                        num_nodes=n_nodes))
+    return graph, th.randn(n_nodes, IN_FEATS)
+
+
+@pytest.mark.parametrize('model_name', sorted(MODELS))
+def test_replicas_match_individual_models(model_name):
+    graph, feat = _graph()
+    models = [MODELS[model_name]() for _ in range(3)]
+    replicas = Replicas(models)
+    # Populate the batch norm statistics, then compare the deterministic eval forward
+    replicas.train()
+    replicas(graph, feat)
+    replicas.eval()
+    logits = replicas(graph, feat)
+    assert logits.shape == (graph.num_nodes(), len(models), N_CLASSES)
+    for r, model in enumerate(models):
+        expected = model(feat) if model_name == 'MLP' else model(graph, feat)
+        assert th.allclose(logits[:, r], expected, atol=1e-5)
+
+
+def test_supports_replicas():
+    assert all(supports_replicas(name) for name in MODELS)
+    assert not supports_replicas('SAGE', 'gcn')
+    assert not supports_replicas('GAT')
+    assert not supports_replicas('RevGAT')
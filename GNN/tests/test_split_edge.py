@@ -0,0 +1,59 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+th = pytest.importorskip('torch')
+dgl = pytest.importorskip('dgl')
+pytest.importorskip('ogb')
+
+from model.Dataloader import split_edge_MMR
+
+
+def _year_graph(n_nodes=60, n_edges=400, seed=0):
+    # Nodes sorted by year as split_edge_MMR expects, duplicate edges included
+    rng = np.random.RandomState(seed)
+    graph = dgl.graph((th.from_numpy(rng.randint(n_nodes, size=n_edges)),
+                       th.from_numpy(rng.randint(n_nodes, size=n_edges))), num_nodes=n_nodes)
+    graph.ndata['year'] = th.from_numpy(np.sort(rng.randint(2010, 2020, n_nodes))).view(-1, 1)
+    return graph
+
+
+def _loop_sources(graph, time):
+    # Reference: the per-node scan of the old split_edge_MMR, which sources get a validation and a test edge
+    year = list(graph.ndata['year'].view(-1).numpy())
+    all_source = graph.edges()[0]
+    return [i for i in range(year.index(time), graph.num_nodes()) if len(th.where(all_source == i)[0]) >= 2]
+
+
+def test_split_edge_matches_loop(tmp_path):
+    graph = _year_graph()
+    time = int(graph.ndata['year'][30])
+    edge_split, train_g = split_edge_MMR(graph, time=time, neg_len=5, path=str(tmp_path))
+    first_node = list(graph.ndata['year'].view(-1).numpy()).index(time)
+    src, dst = (x.long() for x in graph.edges())
+    expected_sources = _loop_sources(graph, time)
+
+    val, test = edge_split['valid'], edge_split['test']
+    assert val['source_node'].tolist() == expected_sources
+    assert test['source_node'].tolist() == expected_sources
+    # Two distinct edges of every source: the pairs must be edges of the graph, used once each
+    edges = list(zip(src.tolist(), dst.tolist()))
+    held_out = list(zip(val['source_node'].tolist(), val['target_node'].tolist())) + \
+        list(zip(test['source_node'].tolist(), test['target_node'].tolist()))
+    train = list(zip(edge_split['train']['source_node'].tolist(), edge_split['train']['target_node'].tolist()))
+    assert sorted(train + held_out) == sorted(edges)
+    assert train_g.num_edges() == len(train)
+    for split in (val, test):
+        assert split['target_node_neg'].shape == (len(expected_sources), 5)
+        assert int(split['target_node_neg'].max()) < first_node
+
+
+def test_split_edge_is_reproducible(tmp_path):
+    graph = _year_graph()
+    time = int(graph.ndata['year'][30])
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'b').mkdir()
+    first, _ = split_edge_MMR(graph, time=time, neg_len=5, path=str(tmp_path / 'a'))
+    second, _ = split_edge_MMR(graph, time=time, neg_len=5, path=str(tmp_path / 'b'))
+    for name in ['valid', 'test']:
+        for key, value in first[name].items():
+            assert th.equal(value, second[name][key])
@@ -0,0 +1,59 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+th = pytest.importorskip('torch')
+
+from model.splits import get_split, random_split, time_split
+
+
+def _split_graph(nodes_num, train_ratio, val_ratio):
+    # Reference: the per-script split used before model.splits
+    np.random.seed(42)
+    indices = np.random.permutation(nodes_num)
+    train_size = int(nodes_num * train_ratio)
+    val_size = int(nodes_num * val_ratio)
+    return indices[:train_size], indices[train_size:train_size + val_size], indices[train_size + val_size:]
+
+
+def _split_time(year, label, train_year, val_year):
+    # Reference: the per-node loop of the old Dataloader.split_time
+    valid_indices = [i for i in range(len(year)) if label[i] != -1]
+    train_ids = [i for i in valid_indices if year[i] < train_year]
+    val_ids = [i for i in valid_indices if train_year <= year[i] < val_year]
+    test_ids = [i for i in valid_indices if year[i] >= val_year]
+    return train_ids, val_ids, test_ids
+
+
+@pytest.mark.parametrize('n_nodes, train_ratio, val_ratio', [(100, 0.6, 0.2), (1001, 0.1, 0.1), (7, 0.5, 0.0)])
+def test_random_split_matches_split_graph(n_nodes, train_ratio, val_ratio):
+    for ids, expected in zip(random_split(n_nodes, train_ratio, val_ratio),
+                             _split_graph(n_nodes, train_ratio, val_ratio)):
+        assert ids.dtype == th.long
+        assert np.array_equal(ids.numpy(), expected)
+
+
+def test_random_split_drops_unlabeled():
+    label = np.arange(50) % 3 - 1
+    for ids, expected in zip(random_split(50, 0.6, 0.2, label=label), _split_graph(50, 0.6, 0.2)):
+        assert np.array_equal(ids.numpy(), expected[label[expected] != -1])
+
+
+def test_time_split_matches_loop():
+    rng = np.random.RandomState(0)
+    year = rng.randint(2010, 2020, 200)
+    label = rng.randint(-1, 4, 200)
+    for ids, expected in zip(time_split(year, label, 2016, 2017), _split_time(year, label, 2016, 2017)):
+        assert ids.tolist() == expected
+
+
+def test_get_split_cache(tmp_path):
+    dgl = pytest.importorskip('dgl')
+    graph_file = tmp_path / 'graph.pt'
+    graph_file.write_bytes(b'graph')
+    graph = dgl.graph(([0, 1], [1, 2]), num_nodes=30)
+    split = get_split(graph, str(graph_file), train_ratio=0.5, val_ratio=0.2)
+    assert len(list((tmp_path / 'splits').iterdir())) == 1
+    cached = get_split(graph, str(graph_file), train_ratio=0.5, val_ratio=0.2)
+    for ids, expected, ref in zip(cached, split, _split_graph(30, 0.5, 0.2)):
+        assert th.equal(ids, expected)
+        assert np.array_equal(ids.numpy(), ref)
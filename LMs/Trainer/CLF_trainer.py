@@ -100,6 +100,7 @@ class CLFTrainer():
             num_train_epochs=cf.epochs,
             local_rank=cf.local_rank,
             dataloader_num_workers=1,
+            group_by_length=cf.group_by_length,
             fp16=True,
         )
 
@@ -111,10 +112,11 @@ class CLFTrainer():
                                                                                    average='macro')
                     for m_name, metric in self.metrics.items()}
 
-        self.trainer = Trainer(
+        self.trainer = SeqTrainer(
             model=self.model,
             args=training_args,
             train_dataset=self.train_data,
+            data_collator=TokenCollator(d.tokens.pad_token_id),
             eval_dataset=self.datasets['valid'],
             compute_metrics=compute_metrics,
         )
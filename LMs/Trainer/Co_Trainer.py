@@ -33,25 +33,75 @@ class CoTModel(PreTrainedModel):
         self.classifier = nn.Linear(hidden_dim, n_labels, bias=cla_bias)
         init_random_state(seed)
 
-    def forward(self, g, input_text):
+    def encode(self, input_text):
         # Extract outputs from the model
         outputs = self.bert_encoder(**input_text, output_hidden_states=True)
         emb = self.dropout(outputs['hidden_states'][-1])  # outputs[0]=last hidden state
         # Use CLS Emb as sentence emb.
-        text_emb = emb.permute(1, 0, 2)[0]
+        return emb.permute(1, 0, 2)[0]
+
+    def forward(self, g, input_text=None, text_emb=None):
+        if text_emb is None:
+            text_emb = self.encode(input_text)
         x = self.gnn(g, text_emb)
         logits = self.classifier(x)
 
         return logits
 
 
+class EmbHistory:
+    """Historical text embeddings of all nodes (GNNAutoScale style).
+    Each training step re-encodes the seed nodes with gradients and only those input nodes whose embedding is missing
+    or older than `staleness` steps, the other neighbours are served from the table.
+    """
+
+    def __init__(self, n_nodes, dim, staleness, device, dtype=th.float16):
+        self.emb = th.zeros(n_nodes, dim, dtype=dtype, device=device)
+        self.step = th.full((n_nodes,), -1, dtype=th.long, device=device)
+        self.staleness = staleness
+        self.device = device
+
+    def stale(self, nodes, now):
+        step = self.step[nodes.to(self.device)]
+        return (step < 0) | (now - step > self.staleness)
+
+    def pull(self, nodes):
+        return self.emb[nodes.to(self.device)].float()
+
+    def push(self, nodes, emb, now):
+        nodes = nodes.to(self.device)
+        self.emb[nodes] = emb.detach().to(self.emb.dtype)
+        self.step[nodes] = now
+
+
+def history_text_emb(model, ndata, history, input_nodes, n_seeds, now, device, chunk_size):
+    """Input embeddings of a sampled block: seeds encoded with gradients, stale neighbours refreshed without, the
+    rest pulled from the history. Both refreshed sets are pushed back to the history.
+    """
+    _load = lambda nodes: {k: th.IntTensor(np.array(ndata[k][nodes.cpu()])).to(device) for k in ndata.keys()
+                           if k != 'labels'}
+    seeds = input_nodes[:n_seeds]
+    seed_emb = model.encode(_load(seeds))
+    text_emb = history.pull(input_nodes).to(seed_emb.dtype)
+    neighbours = input_nodes[n_seeds:]
+    stale = th.nonzero(history.stale(neighbours, now), as_tuple=True)[0].to(input_nodes.device)
+    with th.no_grad():
+        for start in range(0, len(stale), chunk_size):
+            pos = stale[start:start + chunk_size]
+            emb = model.encode(_load(neighbours[pos]))
+            history.push(neighbours[pos], emb, now)
+            text_emb[n_seeds + pos.to(text_emb.device)] = emb.to(text_emb.dtype)
+    history.push(seeds, seed_emb, now)
+    return th.cat([seed_emb, text_emb[n_seeds:]])
+
+
 def load_subtensor(ndata, seeds, labels, input_nodes, device):
     """
     Extracts features and labels for a subset of nodes.
     """
     # ! To Tensor
 
-    _load = lambda k: th.IntTensor(np.array(ndata[k][input_nodes]))
+    _load = lambda k: th.IntTensor(np.array(ndata[k][input_nodes.cpu()]))
     input_text = {}
     for k in ndata.keys():
         if k != 'labels':
@@ -215,15 +265,29 @@ class CoT_Trainer():
         completed_steps = starting_epoch * num_update_steps_per_epoch
         self.loss_func = th.nn.CrossEntropyLoss(label_smoothing=cf.label_smoothing_factor, reduction=cf.ce_reduction)
 
+        # ! Historical embeddings: out-of-batch neighbours are re-encoded at most every history_staleness steps
+        history = None
+        if cf.history_staleness is not None:
+            if cf.sampler_way == 'shadow':
+                raise ValueError('Historical embeddings need block samplers whose seeds lead the input nodes')
+            history = EmbHistory(self.g.num_nodes(), PLM.config.hidden_size, cf.history_staleness, self.device)
+            self.log(f"  Historical embeddings with staleness bound {cf.history_staleness} steps")
+
         best_val = 0
         for epoch in range(self.cf.epochs):
             self.model.train()
 
             for batch, (input_nodes, output_nodes, block) in enumerate(self.train_dataloader):
-                input_text, labels = load_subtensor(self.d.ndata, output_nodes, self.labels, input_nodes, self.device)
                 block = [block_.to(self.device) for block_ in block]
-
-                y_pre = self.model(block, input_text)
+                if history is None:
+                    input_text, labels = load_subtensor(self.d.ndata, output_nodes, self.labels, input_nodes,
+                                                        self.device)
+                    y_pre = self.model(block, input_text)
+                else:
+                    labels = self.labels[output_nodes].to(self.device)
+                    text_emb = history_text_emb(self.model, self.d.ndata, history, input_nodes, len(output_nodes),
+                                                completed_steps, self.device, cf.per_eval_bsz)
+                    y_pre = self.model(block, text_emb=text_emb)
                 if labels.shape[-1] == 1:
                     labels = labels.squeeze()
                 loss = self.loss_func(y_pre, labels)
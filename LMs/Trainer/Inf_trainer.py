@@ -1,17 +1,29 @@
+import os
 import os.path as osp
 import sys
+from functools import partial
 from tqdm import tqdm
 
 from transformers import AutoModel, TrainingArguments, Trainer
 
 from lm_utils import *
 from utils.function.os_utils import mkdir_p
+from utils.function.np_utils import open_npy_memmap
+from utils.function.inf_utils import TokenBatchBuilder, cpu_parallel_inference, default_precision, apply_precision, \
+    check_precision_drift
+from utils.function.emb_cache import EmbCache, encode_with_cache, token_keys
 from model import *
 import numpy as np
-from utils.data.datasets import SeqGraphDataset
+from utils.data.datasets import SeqGraphDataset, TokenCollator
 from transformers import logging as trfm_logging
 from ogb.nodeproppred import Evaluator
 
+def _build_inf_model(hf_model, pretrain_path=None, precision='fp32'):
+    model = AutoModel.from_pretrained(hf_model) if pretrain_path is None else AutoModel.from_pretrained(
+        f'{pretrain_path}')
+    return apply_precision(BertEmbInfModel(model), precision)
+
+
 class LmInfTrainer:
     """Convert textural graph to text list"""
 
@@ -20,16 +32,29 @@ class LmInfTrainer:
         self.logger = cf.logger
         self.log = cf.logger.log
 
+    def check_precision(self, d):
+        # Compare the first fidelity_sample nodes against fp32 before the full inference
+        cf = self.cf
+        cf.precision = cf.precision or default_precision()
+        if cf.precision in {'bf16', 'int8'} and cf.fidelity_sample > 0:
+            batch = TokenBatchBuilder(d.tokens)(np.arange(min(cf.fidelity_sample, len(d.tokens))))
+            check_precision_drift(_build_inf_model(cf.hf_model, cf.pretrain_path), cf.precision, batch,
+                                  cf.max_drift, log=self.log)
+
     @torch.no_grad()
     def inference_emb(self):
+        if self.cf.inf_workers > 0:
+            if self.cf.emb_cache is not None:
+                raise ValueError('--inf_workers does not read the embedding cache, it can not be combined with --emb_cache')
+            return self.cpu_inference_emb()
         self.d = d = Sequence(cf := self.cf).tokenize_init()
+        self.check_precision(d)
         inference_dataset = SeqGraphDataset(self.d, mode='inference')
         # Save embedding and predictions
-        self.model = AutoModel.from_pretrained(cf.hf_model) if cf.pretrain_path is None else AutoModel.from_pretrained(
-            f'{cf.pretrain_path}')
         # The reduction should be sum in case unbalanced gold and pseudo data
         self.log(f'Performing inference using LM model: {cf.pretrain_path}')
-        inf_model = BertEmbInfModel(self.model)
+        inf_model = _build_inf_model(cf.hf_model, cf.pretrain_path, cf.precision)
+        self.model = inf_model.bert_encoder
         inf_model.eval()
         inference_args = TrainingArguments(
             output_dir=f'{self.cf.out_dir}inf/',
@@ -39,17 +64,49 @@ class LmInfTrainer:
             dataloader_drop_last=False,
             dataloader_num_workers=1,
             local_rank=self.cf.local_rank,
-            fp16_full_eval=True,
+            fp16_full_eval=cf.precision == 'fp16',
+            no_cuda=cf.precision == 'int8',  # dynamic quantization only runs on CPU
         )
-        self.trainer = Trainer(model=inf_model, args=inference_args)
-        out_emb = self.trainer.predict(inference_dataset)
+        self.trainer = Trainer(model=inf_model, args=inference_args, data_collator=TokenCollator(d.tokens.pad_token_id))
+        if cf.emb_cache is not None:
+            # Only the nodes whose tokens are not cached for this model are encoded
+            cache = EmbCache(cf.emb_cache, osp.abspath(cf.pretrain_path) if cf.pretrain_path is not None else cf.hf_model,
+                             'cls', d.max_length, precision=cf.precision, log=self.log)
+            keys = token_keys(d.tokens.get('input_ids'), d.tokens.lengths())
+            predict = lambda node_ids: (self.trainer.predict(torch.utils.data.Subset(inference_dataset, node_ids)).predictions,)
+            emb, = encode_with_cache(np.arange(len(keys)), [cache], predict, keys=keys, log=self.log)
+        else:
+            emb = self.trainer.predict(inference_dataset).predictions
         if self.cf.inference_dir is None:
             raise ValueError('Please input the true inference dir.')
         else:
             if not osp.exists(self.cf.inference_dir):
                 mkdir_p(self.cf.inference_dir)
                 with open(osp.join(self.cf.inference_dir, 'emb.npy'), 'wb') as f:
-                    np.save(f, out_emb.predictions)
+                    np.save(f, emb)
             else:
                 self.log('LM have inferenced before')
             self.log(f'LM inference completed in {self.cf.inference_dir})')
+
+    def cpu_inference_emb(self):
+        """Data-parallel inference over cf.inf_workers CPU processes writing into one memory-mapped emb.npy"""
+        self.d = d = Sequence(cf := self.cf).tokenize_init()
+        self.check_precision(d)
+        if self.cf.inference_dir is None:
+            raise ValueError('Please input the true inference dir.')
+        emb_file = osp.join(cf.inference_dir, 'emb.npy')
+        if osp.exists(emb_file):
+            self.log('LM have inferenced before')
+            return
+        mkdir_p(cf.inference_dir)
+        partial_file = osp.join(cf.inference_dir, 'emb.partial.npy')
+        open_npy_memmap(partial_file, (len(d.tokens), d.lm_emb_dim), np.float32, log=self.log).flush()
+        # Longest sequences first, dealt round-robin so that every worker gets the same mix of lengths
+        order = np.argsort(-d.tokens.lengths(), kind='stable')
+        self.log(f'Performing CPU inference using LM model: {cf.pretrain_path}')
+        cpu_parallel_inference(partial(_build_inf_model, cf.hf_model, cf.pretrain_path, cf.precision),
+                               TokenBatchBuilder(d.tokens),
+                               order, [partial_file], cf.inf_workers, cf.inf_batch_size, cf.threads_per_worker,
+                               log=self.log)
+        os.replace(partial_file, emb_file)
+        self.log(f'LM inference completed in {self.cf.inference_dir})')
@@ -17,43 +17,6 @@ METRICS = {  # metric -> metric_path
 
 }
 
-class CLModel(PreTrainedModel):
-    def __init__(self, PLM, dropout=0.0, cl_dim=128):
-        super().__init__(PLM.config)
-        self.dropout = nn.Dropout(dropout)
-        hidden_dim = PLM.config.hidden_size
-        self.text_encoder = PLM
-
-        self.project = torch.nn.Sequential(
-            nn.Linear(hidden_dim, hidden_dim),
-            nn.ReLU(inplace=True),
-            nn.Linear(hidden_dim, cl_dim))
-
-    def forward(self, input_ids=None, attention_mask=None, nb_input_ids=None, nb_attention_mask=None):
-        # Getting Center Node text features and its neighbours feature
-        center_node_outputs = self.text_encoder(
-            input_ids=input_ids, attention_mask=attention_mask, output_hidden_states=True
-        )
-        center_node_emb = self.dropout(center_node_outputs['hidden_states'][-1]).permute(1, 0, 2)[0]
-
-        toplogy_node_outputs = self.text_encoder(
-            input_ids=nb_input_ids, attention_mask=nb_attention_mask, output_hidden_states=True
-        )
-
-        toplogy_emb = self.dropout(toplogy_node_outputs['hidden_states'][-1]).permute(1, 0, 2)[0]
-
-        center_contrast_embeddings = self.project(center_node_emb)
-        toplogy_contrast_embeddings = self.project(toplogy_emb)
-
-        return center_contrast_embeddings, toplogy_contrast_embeddings
-
-class CustomTrainer(Trainer):
-    def compute_loss(self, model, inputs):
-        # forward pass
-        center_contrast_embeddings, toplogy_contrast_embeddings = model(**inputs)
-        # compute
-        loss = infonce(center_contrast_embeddings, toplogy_contrast_embeddings)
-        return  loss
 
 class TCLTrainer():
     def __init__(self, cf):
@@ -90,8 +53,10 @@ class TCLTrainer():
         # ! Prepare your Dataloader
         per_device_eval_batch_size = cf.batch_size * 6 if cf.hf_model in {'distilbert-base-uncased',
                                                                           'google/electra-base-discriminator'} else cf.batch_size * 10
-        train_dataloader = DataLoader(self.train_data, shuffle=True, batch_size=cf.batch_size)
-        eval_dataloader = DataLoader(self.datasets['valid'], batch_size=per_device_eval_batch_size)
+        train_dataloader = DataLoader(self.train_data, shuffle=True, batch_size=cf.batch_size,
+                                      collate_fn=TokenCollator(d.tokens.pad_token_id))
+        eval_dataloader = DataLoader(self.datasets['valid'], batch_size=per_device_eval_batch_size,
+                                     collate_fn=TokenCollator(d.tokens.pad_token_id))
         # ! Load Model for NP with no trainer
         PLM = AutoModel.from_pretrained(cf.hf_model)
 
@@ -208,6 +173,7 @@ class TCLTrainer():
                 PLM,
                 dropout=cf.cla_dropout,
                 cl_dim=cf.cl_dim,
+                shared_pass=cf.shared_pass,
             )
         if cf.local_rank <= 0:
             trainable_params = sum(
@@ -287,11 +253,14 @@ class TCLTrainer():
             fp16=True,
         )
 
-        self.trainer = CustomTrainer(
+        self.trainer = ContrastiveTrainer(
             model=self.model,
             args=training_args,
             train_dataset=self.train_data,
             data_collator=data_collator,
+            cl_chunk_size=cf.cl_chunk_size,
+            gather_negatives=cf.gather_negatives,
+            grad_cache_chunks=cf.grad_cache,
         )
         self.trainer.train()
 
@@ -16,13 +16,10 @@ METRICS = {  # metric -> metric_path
 
 }
 
-class CustomTrainer(Trainer):
-    def compute_loss(self, model, inputs):
-        # forward pass
-        center_contrast_embeddings, toplogy_contrast_embeddings, dpk = model(**inputs)
-        # compute
-        loss = infonce(center_contrast_embeddings, toplogy_contrast_embeddings) + infonce(center_contrast_embeddings, dpk)
-        return  loss
+class CustomTrainer(ContrastiveTrainer):
+    def contrastive_loss(self, center_contrast_embeddings, toplogy_contrast_embeddings, dpk):
+        return self.infonce(center_contrast_embeddings, toplogy_contrast_embeddings) + \
+            self.infonce(center_contrast_embeddings, dpk)
 
 class Multi_Model(PreTrainedModel):
     def __init__(self, PLM, dropout=0.0, cl_dim=128):
@@ -70,7 +67,7 @@ class TCL_DK_Trainer():
     def train_trainer(self):
         # ! Prepare data
         self.d = d = Sequence(cf := self.cf).init(dpk=True)
-        self.train_data = DK_CL_Dataset(self.d)
+        self.train_data = SeqNodeDataset(self.d)
 
         # Finetune on dowstream tasks
         train_steps = len(d.train_x) // cf.eq_batch_size + 1
@@ -135,9 +132,11 @@ class TCL_DK_Trainer():
             warmup_steps=warmup_steps,
             disable_tqdm=False,
             dataloader_drop_last=True,
+            remove_unused_columns=False,
             num_train_epochs=cf.epochs,
             local_rank=cf.local_rank,
             dataloader_num_workers=1,
+            group_by_length=cf.group_by_length,
             fp16=True,
         )
 
@@ -145,6 +144,10 @@ class TCL_DK_Trainer():
             model=self.model,
             args=training_args,
             train_dataset=self.train_data,
+            data_collator=d.pair_collator(dpk=True),
+            cl_chunk_size=cf.cl_chunk_size,
+            gather_negatives=cf.gather_negatives,
+            grad_cache_chunks=cf.grad_cache,
         )
         self.trainer.train()
 
@@ -16,14 +16,6 @@ METRICS = {  # metric -> metric_path
 
 }
 
-class CustomTrainer(Trainer):
-    def compute_loss(self, model, inputs):
-        # forward pass
-        center_contrast_embeddings, toplogy_contrast_embeddings = model(**inputs)
-        # compute
-        loss = infonce(center_contrast_embeddings, toplogy_contrast_embeddings)
-        return  loss
-
 class CL_DK_Model(PreTrainedModel):
     def __init__(self, PLM, dropout=0.0, cl_dim=128):
         super().__init__(PLM.config)
@@ -120,13 +112,18 @@ class TDK_Trainer():
             num_train_epochs=cf.epochs,
             local_rank=cf.local_rank,
             dataloader_num_workers=1,
+            group_by_length=cf.group_by_length,
             fp16=True,
         )
 
-        self.trainer = CustomTrainer(
+        self.trainer = ContrastiveTrainer(
             model=self.model,
             args=training_args,
             train_dataset=self.train_data,
+            data_collator=TokenCollator(d.tokens.pad_token_id),
+            cl_chunk_size=cf.cl_chunk_size,
+            gather_negatives=cf.gather_negatives,
+            grad_cache_chunks=cf.grad_cache,
         )
         self.trainer.train()
 
@@ -16,44 +16,6 @@ METRICS = {  # metric -> metric_path
 
 }
 
-class CLModel(PreTrainedModel):
-    def __init__(self, PLM, dropout=0.0, cl_dim=128):
-        super().__init__(PLM.config)
-        self.dropout = nn.Dropout(dropout)
-        hidden_dim = PLM.config.hidden_size
-        self.text_encoder = PLM
-
-        self.project = torch.nn.Sequential(
-            nn.Linear(hidden_dim, hidden_dim),
-            nn.ReLU(inplace=True),
-            nn.Linear(hidden_dim, cl_dim))
-
-    def forward(self, input_ids=None, attention_mask=None, nb_input_ids=None, nb_attention_mask=None):
-        # Getting Center Node text features and its neighbours feature
-        center_node_outputs = self.text_encoder(
-            input_ids=input_ids, attention_mask=attention_mask, output_hidden_states=True
-        )
-        center_node_emb = self.dropout(center_node_outputs['hidden_states'][-1]).permute(1, 0, 2)[0]
-
-        toplogy_node_outputs = self.text_encoder(
-            input_ids=nb_input_ids, attention_mask=nb_attention_mask, output_hidden_states=True
-        )
-
-        toplogy_emb = self.dropout(toplogy_node_outputs['hidden_states'][-1]).permute(1, 0, 2)[0]
-
-        center_contrast_embeddings = self.project(center_node_emb)
-        toplogy_contrast_embeddings = self.project(toplogy_emb)
-
-        return center_contrast_embeddings, toplogy_contrast_embeddings
-
-class CustomTrainer(Trainer):
-    def compute_loss(self, model, inputs):
-        # forward pass
-        center_contrast_embeddings, toplogy_contrast_embeddings = model(**inputs)
-        # compute
-        loss = infonce(center_contrast_embeddings, toplogy_contrast_embeddings)
-        return  loss
-
 class TLink_Trainer():
     def __init__(self, cf):
         self.cf = cf
@@ -67,7 +29,7 @@ class TLink_Trainer():
     def train_trainer(self):
         # ! Prepare data
         self.d = d = Sequence(cf := self.cf).init(link=True, lab=False)
-        self.train_data = Seq_Link_Dataset(self.d)
+        self.train_data = SeqNodeDataset(self.d)
 
         # Finetune on dowstream tasks
         train_steps = len(self.train_data) // cf.eq_batch_size + 1
@@ -98,6 +60,7 @@ class TLink_Trainer():
                 PLM,
                 dropout=cf.cla_dropout,
                 cl_dim=cf.cl_dim,
+                shared_pass=cf.shared_pass,
             )
         if cf.local_rank <= 0:
             trainable_params = sum(
@@ -128,16 +91,22 @@ class TLink_Trainer():
             warmup_steps=warmup_steps,
             disable_tqdm=False,
             dataloader_drop_last=True,
+            remove_unused_columns=False,
             num_train_epochs=cf.epochs,
             local_rank=cf.local_rank,
             dataloader_num_workers=1,
+            group_by_length=cf.group_by_length,
             fp16=True,
         )
 
-        self.trainer = CustomTrainer(
+        self.trainer = ContrastiveTrainer(
             model=self.model,
             args=training_args,
             train_dataset=self.train_data,
+            data_collator=d.pair_collator(link=True, node_ids=cf.shared_pass),
+            cl_chunk_size=cf.cl_chunk_size,
+            gather_negatives=cf.gather_negatives,
+            grad_cache_chunks=cf.grad_cache,
         )
         self.trainer.train()
 
@@ -62,8 +62,21 @@ class LMTrainer():
                 )
                 print(f" Pass the freeze layer, the LM Encoder  parameters are {trainable_params}")
 
+        #! Train the unfrozen top layers on the cached hidden states of the frozen ones
+        encoder, data_collator = model, TokenCollator(d.tokens.pad_token_id)
+        if cf.freeze_cache:
+            if cf.freeze is None:
+                raise ValueError('--freeze_cache needs --freeze')
+            n_frozen = len(model.encoder.layer) - cf.freeze
+            encoder = CachedPrefixEncoder(model, n_frozen)
+            data_collator = StoreCollator(d.hidden_store(model, n_frozen, cf.pretrain_path or cf.hf_model))
+            node_data = SeqNodeDataset(d, labels=True)
+            self.datasets = {_: th.utils.data.Subset(node_data, getattr(d, f'{_}_x'))
+                             for _ in ['train', 'valid', 'test']}
+            self.train_data = self.datasets['train']
+
         self.model = BertClassifier(
-                model, cf.data.n_labels,
+                encoder, cf.data.n_labels,
                 dropout=cf.cla_dropout,
                 loss_func=th.nn.CrossEntropyLoss(label_smoothing=cf.label_smoothing_factor, reduction=cf.ce_reduction),
                 cla_bias=cf.cla_bias == 'T',
@@ -99,9 +112,11 @@ class LMTrainer():
             warmup_steps=warmup_steps,
             disable_tqdm=False,
             dataloader_drop_last=True,
+            remove_unused_columns=not cf.freeze_cache,
             num_train_epochs=cf.epochs,
             local_rank=cf.local_rank,
             dataloader_num_workers=1,
+            group_by_length=cf.group_by_length,
             fp16=True,
         )
 
@@ -113,10 +128,11 @@ class LMTrainer():
                                                                                    average='macro')
                     for m_name, metric in self.metrics.items()}
 
-        self.trainer = Trainer(
+        self.trainer = SeqTrainer(
             model=self.model,
             args=training_args,
             train_dataset=self.train_data,
+            data_collator=data_collator,
             eval_dataset=self.datasets['valid'],
             compute_metrics=compute_metrics,
         )
@@ -117,6 +117,22 @@ class LMConfig(ModelConfig):
         parser.add_argument("-per_bsz", "--per_device_bsz", default=36, type=int)  #
         parser.add_argument("-per_eval", "--per_eval_bsz", default=360, type=int)  #
         parser.add_argument("-per_infer", "--inf_batch_size", default=400, type=int)  #
+        parser.add_argument("--inf_workers", default=0, type=int,
+                            help='if > 0, run the inference on CPU with this number of processes')
+        parser.add_argument("--threads_per_worker", default=None, type=int,
+                            help='torch threads per CPU inference worker, default: cores / inf_workers')
+        parser.add_argument("--emb_cache", default=None, type=str,
+                            help='folder of the embedding cache, only uncached nodes are encoded at inference')
+        parser.add_argument("--precision", default=None, type=str, choices=['fp32', 'fp16', 'bf16', 'int8'],
+                            help='inference precision, int8/bf16 for CPU, default: fp16 on GPU, fp32 on CPU')
+        parser.add_argument("--fidelity_sample", default=256, type=int,
+                            help='nodes compared against fp32 when precision is bf16/int8, 0 to skip')
+        parser.add_argument("--max_drift", default=0.01, type=float,
+                            help='largest mean cosine drift (1 - cos) against fp32 accepted')
+        parser.add_argument("--tokenize_workers", default=min(8, os.cpu_count() or 1), type=int,
+                            help='Processes tokenizing the corpus chunk by chunk, 0 tokenizes in the main process')
+        parser.add_argument("--group_by_length", action="store_true",
+                            help='Batch nodes of similar token length together to cut padding')
         parser.add_argument("-gra", "--grad_steps", default=1, type=int)  # 梯度累积 18 bsz;
         parser.add_argument("-wd", "--weight_decay", default=0.01)
         parser.add_argument("-do", "--dropout", default=0.1, type=float)
@@ -126,6 +142,15 @@ class LMConfig(ModelConfig):
         parser.add_argument("-wmp", "--warmup_epochs", default=0.2, type=float)  # 0.5 1.0 0.75
         parser.add_argument("-ef", "--eval_patience", default=50000, type=int)
         parser.add_argument("-CLD", "--cl_dim", default=128, type=int, help='The dimension of the contrastive space')
+        parser.add_argument("--cl_chunk_size", default=None, type=int,
+                            help='Score the InfoNCE anchors in chunks of this size, recomputed in backward')
+        parser.add_argument("--gather_negatives", action="store_true",
+                            help='Use the samples of all DDP ranks as InfoNCE negatives, their gradients are sent back to '
+                                 'their ranks (exact gradient of the mean loss over ranks)')
+        parser.add_argument("--grad_cache", default=None, type=int,
+                            help='Split every contrastive batch into this many sub-batches with gradient caching')
+        parser.add_argument("--shared_pass", action="store_true",
+                            help='Encode center and neighbour texts of a contrastive batch in one deduplicated pass')
         parser.add_argument("-lsf", "--label_smoothing_factor", default=0.1, type=float)
         parser.add_argument("-ce", "--ce_reduction", default='mean')
         # parser.add_argument("-feat_shrink", "--feat_shrink", default=None, type=str)
@@ -140,6 +165,9 @@ class LMConfig(ModelConfig):
         parser.add_argument("-fz", "--freeze", default=None,
                             help='freeze control whether to freeze the lm model, its number means how many layers do not freezed.',
                             type=int)
+        parser.add_argument("--freeze_cache", action="store_true",
+                            help='With --freeze, run the frozen layers once and train the top layers on their cached '
+                                 'fp16 hidden states')
         # For GNN
         parser.add_argument("-gnn-name", "--gnn-name", default='SAGE', type=str, help='The name of the GNN')
         parser.add_argument("-n-hidden", "--n-hidden", default=256, type=int, help="number of hidden units")
@@ -149,6 +177,9 @@ class LMConfig(ModelConfig):
         parser.add_argument("-sampler-way", "--sampler-way", type=str, default='default', help="the sampler way")
         # add fanouts
         parser.add_argument("--fanouts", default=1, type=int, help="fanouts")
+        parser.add_argument("--history_staleness", default=None, type=int,
+                            help="Co-training: serve neighbour text embeddings from a history refreshed at least every"
+                                 " N steps (off by default)")
         parser.add_argument("--metric", default='acc', type=str, help="the metric")
         # For split datasets
         parser.add_argument("--train_ratio", default=0.6, type=float)
@@ -1,8 +1,15 @@
 import torch.nn as nn
-from transformers import PreTrainedModel
+from transformers import PreTrainedModel, Trainer
+from transformers.trainer_pt_utils import LengthGroupedSampler, DistributedLengthGroupedSampler
 from transformers.modeling_outputs import TokenClassifierOutput
+import numpy as np
 import torch
 import torch.nn.functional as F
+from torch.utils.data import Subset
+import torch.distributed as dist
+from contextlib import contextmanager, nullcontext
+from functools import partial
+from torch.utils.checkpoint import checkpoint
 from utils.function import init_random_state
 from torch_geometric.nn import GINConv, global_add_pool
 
@@ -51,37 +58,260 @@ class BertClassifier(PreTrainedModel):
         return TokenClassifierOutput(loss=loss, logits=logits)
 
 
+class CachedPrefixEncoder(nn.Module):
+    """The trainable top layers of a partially frozen BERT-style PLM, run on the hidden states cached at the freeze
+    boundary (utils/data/hidden_store.py). The cached states come in place of input_ids and the output has the
+    fields read by BertClassifier / CLModel, so it replaces the PLM there. PLM stays registered, the top layers are
+    trained in place and PLM.save_pretrained() saves the fine-tuned model.
+    State dicts have the keys of PLM itself, so checkpoints of the wrapping model load with or without the cache.
+    """
+
+    def __init__(self, PLM, n_frozen):
+        super().__init__()
+        self.PLM = PLM
+        self.config = PLM.config
+        self.n_frozen = n_frozen
+        self._register_state_dict_hook(self._unwrap_keys)
+        self._register_load_state_dict_pre_hook(self._wrap_keys)
+
+    @staticmethod
+    def _unwrap_keys(module, state_dict, prefix, local_metadata):
+        for k in [k for k in state_dict if k.startswith(f'{prefix}PLM.')]:
+            state_dict[prefix + k[len(f'{prefix}PLM.'):]] = state_dict.pop(k)
+
+    @staticmethod
+    def _wrap_keys(state_dict, prefix, *args):
+        for k in [k for k in state_dict if k.startswith(prefix) and not k.startswith(f'{prefix}PLM.')]:
+            state_dict[f'{prefix}PLM.{k[len(prefix):]}'] = state_dict.pop(k)
+
+    def forward(self, input_ids=None, attention_mask=None, output_hidden_states=True):
+        hidden_states = input_ids.float()
+        extended_mask = self.PLM.get_extended_attention_mask(attention_mask, attention_mask.shape)
+        for layer in self.PLM.encoder.layer[self.n_frozen:]:
+            hidden_states = layer(hidden_states, attention_mask=extended_mask)[0]
+        return {'last_hidden_state': hidden_states, 'hidden_states': (hidden_states,)}
+
+
 class BertEmbInfModel(PreTrainedModel):
     def __init__(self, model):
         super().__init__(model.config)
         self.bert_encoder = model
+        self.precision = 'fp32'
 
     @torch.no_grad()
     def forward(self, input_ids=None, attention_mask=None, token_type_ids=None):
         # Extract outputs from the model
-        outputs = self.bert_encoder(input_ids=input_ids, attention_mask=attention_mask,
-                                    output_hidden_states=True)
-        emb = outputs['hidden_states'][-1]  # Last layer
+        with torch.autocast(device_type=input_ids.device.type, dtype=torch.bfloat16, enabled=self.precision == 'bf16'):
+            outputs = self.bert_encoder(input_ids=input_ids, attention_mask=attention_mask,
+                                        output_hidden_states=True)
+        emb = outputs['hidden_states'][-1].float()  # Last layer
         # Use CLS Emb as sentence emb.
         node_cls_emb = emb.permute(1, 0, 2)[0]
         return TokenClassifierOutput(logits=node_cls_emb)
 
 
-def _similarity(h1: torch.Tensor, h2: torch.Tensor):
-    h1 = F.normalize(h1)
-    h2 = F.normalize(h2)
-    return h1 @ h2.t()
+class CLModel(PreTrainedModel):
+    """Projected CLS embeddings of the center nodes and of their neighbours.
+    shared_pass: both views go through text_encoder in a single call, padded to the longest row of the concatenation.
+    If the collator also passes node_id / nb_node_id, nodes appearing twice in the batch are encoded once; a node that is
+    its own neighbour (self contrastive fallback) keeps two passes so that the views differ by their dropout.
+    """
+
+    def __init__(self, PLM, dropout=0.0, cl_dim=128, shared_pass=False):
+        super().__init__(PLM.config)
+        self.dropout = nn.Dropout(dropout)
+        hidden_dim = PLM.config.hidden_size
+        self.text_encoder = PLM
+        self.shared_pass = shared_pass
+
+        self.project = torch.nn.Sequential(
+            nn.Linear(hidden_dim, hidden_dim),
+            nn.ReLU(inplace=True),
+            nn.Linear(hidden_dim, cl_dim))
+
+    def _encode(self, input_ids, attention_mask):
+        outputs = self.text_encoder(input_ids=input_ids, attention_mask=attention_mask, output_hidden_states=True)
+        return self.dropout(outputs['hidden_states'][-1]).permute(1, 0, 2)[0]
+
+    def _shared_encode(self, input_ids, attention_mask, nb_input_ids, nb_attention_mask, node_id, nb_node_id):
+        n = input_ids.shape[0]
+        seq_len = max(input_ids.shape[1], nb_input_ids.shape[1])
+        pad = lambda x, value: F.pad(x, (0, seq_len - x.shape[1]), value=value)
+        pad_token_id = self.config.pad_token_id or 0
+        input_ids = torch.cat([pad(input_ids, pad_token_id), pad(nb_input_ids, pad_token_id)])
+        attention_mask = torch.cat([pad(attention_mask, 0), pad(nb_attention_mask, 0)])
+        inverse = None
+        if node_id is not None and nb_node_id is not None:
+            self_loop = -1 - torch.arange(n, device=nb_node_id.device)
+            keys = torch.cat([node_id, torch.where(nb_node_id == node_id, self_loop, nb_node_id)])
+            unique_keys, inverse = torch.unique(keys, return_inverse=True)
+            if len(unique_keys) < len(keys):
+                rep = inverse.new_empty(len(unique_keys)).scatter_(0, inverse, torch.arange(len(keys), device=keys.device))
+                input_ids, attention_mask = input_ids[rep], attention_mask[rep]
+            else:
+                inverse = None
+        # Dynamic padding of the (deduplicated) concatenation, tokens are right padded
+        seq_len = int(attention_mask.sum(dim=1).max())
+        emb = self._encode(input_ids[:, :seq_len], attention_mask[:, :seq_len])
+        if inverse is not None:
+            emb = emb[inverse]
+        return emb[:n], emb[n:]
+
+    def forward(self, input_ids=None, attention_mask=None, nb_input_ids=None, nb_attention_mask=None, node_id=None,
+                nb_node_id=None):
+        # Getting Center Node text features and its neighbours feature
+        if self.shared_pass:
+            center_node_emb, toplogy_emb = self._shared_encode(input_ids, attention_mask, nb_input_ids,
+                                                               nb_attention_mask, node_id, nb_node_id)
+        else:
+            center_node_emb = self._encode(input_ids, attention_mask)
+            toplogy_emb = self._encode(nb_input_ids, nb_attention_mask)
+
+        center_contrast_embeddings = self.project(center_node_emb)
+        toplogy_contrast_embeddings = self.project(toplogy_emb)
+
+        return center_contrast_embeddings, toplogy_contrast_embeddings
+
+
+def _gather_with_grad(x):
+    # Rows of every DDP rank and the offset of the local ones. The autograd all_gather sends the gradient of every
+    # rank's loss w.r.t. these rows back to their rank (summed), so after DDP's averaging the gradient is exactly that
+    # of the mean loss over ranks, the negatives of other ranks included.
+    if not (dist.is_available() and dist.is_initialized()) or dist.get_world_size() == 1:
+        return x, 0
+    from torch.distributed.nn.functional import all_gather
+    return torch.cat(all_gather(x.contiguous())), dist.get_rank() * x.shape[0]
+
+
+def _infonce_rows(anchor, sample, pos, tau):
+    sim = anchor @ sample.t() / tau
+    return torch.logsumexp(sim, dim=1) - sim[torch.arange(len(pos), device=sim.device), pos]
 
 
-def infonce(anchor, sample, tau=0.2):
-    sim = _similarity(anchor, sample) / tau
+def infonce(anchor, sample, tau=0.2, chunk_size=None, gather=False):
+    """InfoNCE of anchor[i] against sample[i], all other samples being negatives: mean_i(logsumexp_j s_ij - s_ii).
+    chunk_size: anchors are scored chunk_size rows at a time and every chunk is recomputed in backward, so only a
+    chunk_size x N similarity block is alive at once.
+    gather: under DDP the samples of all ranks are used as negatives (same per-device batch size on every rank).
+    """
+    anchor, sample = F.normalize(anchor), F.normalize(sample)
+    offset = 0
+    if gather:
+        sample, offset = _gather_with_grad(sample)
     num_nodes = anchor.shape[0]
-    device = anchor.device
-    pos_mask = torch.eye(num_nodes, dtype=torch.float32).to(device)
-    neg_mask = 1. - pos_mask
-    assert sim.size() == pos_mask.size()  # sanity check
-    exp_sim = torch.exp(sim) * (pos_mask + neg_mask)
-    log_prob = sim - torch.log(exp_sim.sum(dim=1, keepdim=True))
-    loss = log_prob * pos_mask
-    loss = loss.sum(dim=1) / pos_mask.sum(dim=1)
-    return -loss.mean()
\ No newline at end of file
+    chunk_size = chunk_size or num_nodes
+    rows = partial(_infonce_rows, tau=tau)
+    loss = []
+    for start in range(0, num_nodes, chunk_size):
+        chunk = anchor[start:start + chunk_size]
+        pos = torch.arange(start, start + chunk.shape[0], device=chunk.device) + offset
+        if chunk_size < num_nodes and torch.is_grad_enabled() and (chunk.requires_grad or sample.requires_grad):
+            loss.append(checkpoint(rows, chunk, sample, pos))
+        else:
+            loss.append(rows(chunk, sample, pos))
+    return torch.cat(loss).mean()
+
+
+def dataset_lengths(dataset):
+    """Token lengths of the center nodes of a Sequence dataset, None if unknown."""
+    if isinstance(dataset, Subset):
+        lengths = dataset_lengths(dataset.dataset)
+        return None if lengths is None else lengths[np.asarray(dataset.indices)]
+    d = getattr(dataset, 'd', None)
+    return None if getattr(d, 'tokens', None) is None else d.tokens.lengths()
+
+
+class SeqTrainer(Trainer):
+    """HF Trainer for Sequence datasets: group_by_length reads the lengths from the token store instead of
+    materialising every item of the dataset.
+    """
+
+    def _get_train_sampler(self):
+        lengths = dataset_lengths(self.train_dataset) if self.args.group_by_length else None
+        if lengths is None:
+            return super()._get_train_sampler()
+        batch_size = self.args.train_batch_size * self.args.gradient_accumulation_steps
+        if self.args.world_size <= 1:
+            return LengthGroupedSampler(batch_size, lengths=lengths.tolist())
+        return DistributedLengthGroupedSampler(batch_size, num_replicas=self.args.world_size,
+                                               rank=self.args.process_index, seed=self.args.seed,
+                                               lengths=lengths.tolist())
+
+
+@contextmanager
+def _replay_rng(state):
+    # Same RNG (i.e. dropout masks) as the recorded forward pass
+    devices = [] if state[1] is None else [torch.cuda.current_device()]
+    with torch.random.fork_rng(devices=devices):
+        torch.set_rng_state(state[0])
+        if state[1] is not None:
+            torch.cuda.set_rng_state(state[1])
+        yield
+
+
+def grad_cache_step(model, inputs, loss_fn, n_chunks, backward):
+    """Gradient caching: the contrastive loss of the whole batch at the activation memory of batch / n_chunks.
+    1. every sub-batch is encoded without graph; 2. loss_fn over the detached outputs, backward(loss) stores the
+    gradient w.r.t. the outputs; 3. every sub-batch is re-encoded with graph and the cached gradient backpropagated.
+    model returns a tuple of row-aligned tensors, loss_fn takes them in the same order.
+    """
+    batch_size = next(iter(inputs.values())).shape[0]
+    size = -(-batch_size // n_chunks)
+    chunks = [{k: v[start:start + size] for k, v in inputs.items()} for start in range(0, batch_size, size)]
+    states, outputs = [], []
+    with torch.no_grad():
+        for chunk in chunks:
+            states.append((torch.get_rng_state(), torch.cuda.get_rng_state() if torch.cuda.is_available() else None))
+            outputs.append(model(**chunk))
+    reps = [torch.cat([o[i] for o in outputs]).detach().requires_grad_(outputs[0][i].is_floating_point())
+            for i in range(len(outputs[0]))]
+    loss = loss_fn(*reps)
+    backward(loss)
+    no_sync = getattr(model, 'no_sync', None)
+    for i, (chunk, state) in enumerate(zip(chunks, states)):
+        # DDP all-reduces the gradients once, in the backward of the last sub-batch
+        sync = no_sync() if no_sync is not None and i < len(chunks) - 1 else nullcontext()
+        with sync, _replay_rng(state):
+            start = i * size
+            surrogate = [(o * r.grad[start:start + o.shape[0]]).sum() for o, r in zip(model(**chunk), reps)
+                         if o.requires_grad and r.grad is not None]
+            sum(surrogate).backward()
+    return loss.detach()
+
+
+class ContrastiveTrainer(SeqTrainer):
+    """SeqTrainer for models returning contrastive embeddings, the loss is contrastive_loss(*model(**inputs)).
+    cl_chunk_size / gather_negatives are passed to infonce, grad_cache_chunks > 1 turns on gradient caching.
+    """
+
+    def __init__(self, *args, cl_chunk_size=None, gather_negatives=False, grad_cache_chunks=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cl_chunk_size = cl_chunk_size
+        self.gather_negatives = gather_negatives
+        self.grad_cache_chunks = grad_cache_chunks
+
+    def infonce(self, anchor, sample):
+        return infonce(anchor, sample, chunk_size=self.cl_chunk_size, gather=self.gather_negatives)
+
+    def contrastive_loss(self, center_contrast_embeddings, toplogy_contrast_embeddings):
+        return self.infonce(center_contrast_embeddings, toplogy_contrast_embeddings)
+
+    def compute_loss(self, model, inputs):
+        return self.contrastive_loss(*model(**inputs))
+
+    def training_step(self, model, inputs):
+        if not self.grad_cache_chunks or self.grad_cache_chunks <= 1:
+            return super().training_step(model, inputs)
+        model.train()
+        inputs = self._prepare_inputs(inputs)
+
+        def backward(loss):
+            loss = loss / self.args.gradient_accumulation_steps
+            if self.do_grad_scaling:
+                self.scaler.scale(loss).backward()
+            else:
+                loss.backward()
+
+        with self.compute_loss_context_manager():
+            loss = grad_cache_step(model, inputs, self.contrastive_loss, self.grad_cache_chunks, backward)
+        return loss / self.args.gradient_accumulation_steps
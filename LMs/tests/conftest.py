@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The LM scripts import their modules as utils.*, from the LMs directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,56 @@
+import pytest
+
+th = pytest.importorskip('torch')
+pytest.importorskip('transformers')
+pytest.importorskip('torch_geometric')
+
+import torch.nn.functional as F
+
+from model import grad_cache_step, infonce
+
+
+def _dense_infonce(anchor, sample, tau=0.2):
+    # The full N x N formulation infonce replaced
+    sim = F.normalize(anchor) @ F.normalize(sample).t() / tau
+    return -th.diagonal(th.log_softmax(sim, dim=1)).mean()
+
+
+def _embeddings(n=13, dim=8, seed=0):
+    g = th.Generator().manual_seed(seed)
+    return (th.randn(n, dim, generator=g, requires_grad=True),
+            th.randn(n, dim, generator=g, requires_grad=True))
+
+
+@pytest.mark.parametrize('chunk_size', [None, 1, 4, 13, 32])
+def test_chunked_matches_dense(chunk_size):
+    anchor, sample = _embeddings()
+    expected = _dense_infonce(anchor, sample)
+    expected_grads = th.autograd.grad(expected, [anchor, sample])
+    loss = infonce(anchor, sample, chunk_size=chunk_size)
+    grads = th.autograd.grad(loss, [anchor, sample])
+    assert th.allclose(loss, expected, atol=1e-6)
+    for g, e in zip(grads, expected_grads):
+        assert th.allclose(g, e, atol=1e-6)
+
+
+def test_gather_without_ddp_is_local():
+    anchor, sample = _embeddings()
+    assert th.allclose(infonce(anchor, sample, gather=True), infonce(anchor, sample))
+
+
+def test_grad_cache_matches_full_batch():
+    th.manual_seed(0)
+    encoder = th.nn.Sequential(th.nn.Linear(6, 16), th.nn.Dropout(0.1), th.nn.Linear(16, 8))
+    model = lambda x, nb_x: (encoder(x), encoder(nb_x))
+    inputs = {'x': th.randn(10, 6), 'nb_x': th.randn(10, 6)}
+    encoder.eval()  # Dropout masks differ between the two runs otherwise
+
+    loss = infonce(*model(**inputs))
+    loss.backward()
+    expected = [p.grad.clone() for p in encoder.parameters()]
+    encoder.zero_grad()
+
+    cached = grad_cache_step(model, inputs, infonce, n_chunks=3, backward=lambda l: l.backward())
+    assert th.allclose(cached, loss.detach(), atol=1e-6)
+    for p, e in zip(encoder.parameters(), expected):
+        assert th.allclose(p.grad, e, atol=1e-6)
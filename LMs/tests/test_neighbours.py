@@ -0,0 +1,66 @@
+import pickle
+
+import pytest
+
+np = pytest.importorskip('numpy')
+th = pytest.importorskip('torch')
+dgl = pytest.importorskip('dgl')
+pytest.importorskip('tqdm')
+
+from utils.data.neighbours import CSRNeighbours
+
+
+def _graph(n_nodes=12, n_edges=30, seed=0):
+    # Symmetric without multi-edges, nodes 10 and 11 isolated
+    rng = np.random.RandomState(seed)
+    edges = {(s, d) for s, d in rng.randint(10, size=(n_edges, 2)).tolist() if s != d}
+    src, dst = zip(*(edges | {(d, s) for s, d in edges}))
+    return dgl.graph((th.tensor(src), th.tensor(dst)), num_nodes=n_nodes)
+
+
+def test_neighbour_lists(tmp_path):
+    graph = _graph()
+    nb = CSRNeighbours.save(str(tmp_path), graph)
+    assert len(nb) == graph.num_nodes()
+    for node in range(graph.num_nodes()):
+        assert sorted(nb[node].tolist()) == sorted(graph.successors(node).tolist())
+    assert nb.degree([0, 10]).tolist() == [graph.out_degrees(0), 0]
+
+
+def test_sample(tmp_path):
+    graph = _graph()
+    nb = CSRNeighbours.save(str(tmp_path), graph)
+    rng = np.random.RandomState(0)
+    nodes = np.repeat(np.arange(graph.num_nodes()), 400)
+    picked = nb.sample(nodes, rng)
+    assert picked.shape == nodes.shape
+    for node in range(graph.num_nodes()):
+        drawn = picked[nodes == node]
+        neighbours = nb[node]
+        if len(neighbours) == 0:
+            # Isolated nodes fall back to themselves
+            assert (drawn == node).all()
+            continue
+        assert np.isin(drawn, neighbours).all()
+        # Uniform over the neighbour list
+        freq = np.array([(drawn == v).mean() for v in neighbours])
+        assert np.abs(freq - 1 / len(neighbours)).max() < 0.1
+
+
+def test_sample_without_edges(tmp_path):
+    nb = CSRNeighbours.save(str(tmp_path), dgl.graph(([], []), num_nodes=5))
+    assert nb.sample([3, 0, 4]).tolist() == [3, 0, 4]
+
+
+def test_cached_rebuilds_on_source_change(tmp_path):
+    source = tmp_path / 'graph.bin'
+    source.write_bytes(b'v1')
+    builds = []
+    build = lambda: builds.append(1) or _graph()
+    CSRNeighbours.cached(str(tmp_path / 'nb'), str(source), build, log=lambda *_: None)
+    nb = CSRNeighbours.cached(str(tmp_path / 'nb'), str(source), build, log=lambda *_: None)
+    assert len(builds) == 1
+    assert pickle.loads(pickle.dumps(nb))._arrays is None
+    source.write_bytes(b'v2 with another size')
+    CSRNeighbours.cached(str(tmp_path / 'nb'), str(source), build, log=lambda *_: None)
+    assert len(builds) == 2
@@ -0,0 +1,118 @@
+import pickle
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('torch')
+pytest.importorskip('tqdm')
+
+from utils.data.token_store import TOKEN_STORE_HEADER, TokenStore, text_chunks, tokenize_to_store
+
+PAD = 0
+
+
+class _Tokenizer:
+    """Texts are whitespace separated token ids; ids above type_from get token type 1."""
+
+    def __init__(self, vocab_size=100, pad_token_id=PAD, type_from=None):
+        self.vocab_size, self.pad_token_id, self.type_from = vocab_size, pad_token_id, type_from
+
+    def __len__(self):
+        return self.vocab_size
+
+    def __call__(self, texts, truncation=True, max_length=None, **kwargs):
+        ids = [[int(t) for t in text.split()][:max_length] for text in texts]
+        types = [[int(self.type_from is not None and i > self.type_from) for i in row] for row in ids]
+        return {'input_ids': ids, 'attention_mask': [[1] * len(row) for row in ids], 'token_type_ids': types}
+
+
+def _texts(n_nodes=23, max_length=8, vocab_size=100, seed=0):
+    rng = np.random.RandomState(seed)
+    # Some rows longer than max_length, truncated by the tokenizer
+    return [' '.join(map(str, rng.randint(1, vocab_size, rng.randint(1, max_length + 4)))) for _ in range(n_nodes)]
+
+
+def _dense(texts, max_length, type_from=None, pad_token_id=PAD):
+    # Reference: the tokenizer output padded to max_length
+    encoded = _Tokenizer(type_from=type_from)(texts, max_length=max_length)
+    dense = {k: np.full((len(texts), max_length), pad_token_id if k == 'input_ids' else 0) for k in encoded}
+    for k, rows in encoded.items():
+        for i, row in enumerate(rows):
+            dense[k][i, :len(row)] = row
+    return dense
+
+
+@pytest.mark.parametrize('type_from', [None, 50])
+@pytest.mark.parametrize('chunk_size', [5, 100])
+def test_round_trip(tmp_path, type_from, chunk_size):
+    texts = _texts()
+    header = tokenize_to_store(str(tmp_path), text_chunks(texts, chunk_size), _Tokenizer(type_from=type_from), 8,
+                               log=lambda *_: None)
+    expected = _dense(texts, 8, type_from)
+    assert header['token_type_ids'] == ('zeros' if type_from is None else 'flat')
+    assert header['n_tokens'] == expected['attention_mask'].sum()
+    assert (tmp_path / TOKEN_STORE_HEADER).exists()
+    assert sorted(f.name for f in tmp_path.iterdir() if '.tmp' in f.name or f.is_dir()) == []
+
+    store = TokenStore(str(tmp_path))
+    assert len(store) == len(texts)
+    lengths = expected['attention_mask'].sum(axis=1)
+    assert np.array_equal(store.lengths(), lengths)
+    assert np.array_equal(store.lengths([4, 1]), lengths[[4, 1]])
+    for field, dense in expected.items():
+        # get() pads back to the dense max_length layout
+        assert store[field].shape == dense.shape
+        assert np.array_equal(np.asarray(store[field]), dense)
+        assert np.array_equal(store[field][3], dense[3])
+        assert np.array_equal(store[field][-1], dense[-1])
+        assert np.array_equal(store[field][1:9:2], dense[1:9:2])
+        assert np.array_equal(store[field][[5, 0, 2]], dense[[5, 0, 2]])
+        assert np.array_equal(store[field][lengths > 4], dense[lengths > 4])
+        # row() drops the padding
+        assert np.array_equal(store.row(field, 2), dense[2][:lengths[2]])
+
+
+def test_padding(tmp_path):
+    texts = _texts()
+    tokenize_to_store(str(tmp_path), text_chunks(texts, 10), _Tokenizer(pad_token_id=7), 8, log=lambda *_: None)
+    store = TokenStore(str(tmp_path))
+    expected = _dense(texts, 8, pad_token_id=7)
+    lengths = store.lengths()
+    seq_len = int(lengths[:3].max())
+    ids = store.get('input_ids', [0, 1, 2], pad_to=seq_len)
+    mask = store.get('attention_mask', [0, 1, 2], pad_to=seq_len)
+    assert ids.shape == mask.shape == (3, seq_len)
+    assert np.array_equal(mask.sum(axis=1), lengths[:3])
+    assert np.array_equal(ids, expected['input_ids'][:3, :seq_len])
+    # Shorter than some rows: truncated
+    assert np.array_equal(store.get('input_ids', [0, 1], pad_to=1), expected['input_ids'][[0, 1], :1])
+
+
+def test_workers_match_in_process(tmp_path):
+    texts = _texts(n_nodes=57)
+    tokenize_to_store(str(tmp_path / 'serial'), text_chunks(texts, 10), _Tokenizer(type_from=50), 8,
+                      log=lambda *_: None)
+    tokenize_to_store(str(tmp_path / 'workers'), text_chunks(texts, 10), _Tokenizer(type_from=50), 8, n_workers=2,
+                      log=lambda *_: None)
+    serial, workers = TokenStore(str(tmp_path / 'serial')), TokenStore(str(tmp_path / 'workers'))
+    for field in ['input_ids', 'attention_mask', 'token_type_ids']:
+        assert np.array_equal(np.asarray(serial[field]), np.asarray(workers[field]))
+
+
+def test_id_dtype(tmp_path):
+    tokenize_to_store(str(tmp_path / 'small'), [['1 2 3']], _Tokenizer(vocab_size=100), 8, log=lambda *_: None)
+    tokenize_to_store(str(tmp_path / 'large'), [['1 69999 3']], _Tokenizer(vocab_size=70000), 8, log=lambda *_: None)
+    assert TokenStore(str(tmp_path / 'small')).arrays['input_ids'].dtype == np.uint16
+    large = TokenStore(str(tmp_path / 'large'))
+    assert large.arrays['input_ids'].dtype == np.uint32
+    assert large.row('input_ids', 0).tolist() == [1, 69999, 3]
+
+
+def test_pickle_drops_memory_maps(tmp_path):
+    texts = _texts()
+    tokenize_to_store(str(tmp_path), text_chunks(texts, 10), _Tokenizer(), 8, log=lambda *_: None)
+    store = TokenStore(str(tmp_path))
+    store['input_ids'][0]
+    clone = pickle.loads(pickle.dumps(store))
+    assert clone._arrays is None
+    assert np.array_equal(clone['input_ids'][2], _dense(texts, 8)['input_ids'][2])
@@ -6,6 +6,7 @@ import utils.function as uf
 from utils.settings import *
 from tqdm import tqdm
 from utils.function.os_utils import mkdir_p
+from utils.data.token_store import csv_text_chunks, TOKENIZE_CHUNK_SIZE
 
 
 def top_Augmentation(d, nums=1):
@@ -97,9 +98,6 @@ def _tokenize_ogb_arxiv_datasets(d):
         text_stat.index.rename('Statics', inplace=True)
         text_stat.columns = ["Length"]
         text_stat.to_csv(osp.join(d.data_root, 'ogbn-arxiv_stat.txt'))
-    else:
-        text = pd.read_csv(osp.join(d.data_root, 'ogbn-arxiv.txt'), sep='\t', header=None)
-        text = text[0]
 
     # Tokenize
     if d.hf_model in ['gpt2', 'gpt2-medium', 'gpt2-large', 'gpt2-xl']:
@@ -107,17 +105,14 @@ def _tokenize_ogb_arxiv_datasets(d):
         tokenizer = AutoTokenizer.from_pretrained(d.hf_model)
         tokenizer.padding_side = 'right'
         tokenizer.add_special_tokens({'pad_token': '[PAD]'})
-        tokenized = tokenizer(text.tolist(), padding='max_length', truncation=True, max_length=512,
-                              return_token_type_ids=True).data
+        max_length = 512
     else:
         tokenizer = AutoTokenizer.from_pretrained(d.hf_model)
-        tokenized = tokenizer(text.tolist(), padding='max_length', truncation=True, max_length=64,
-                              return_token_type_ids=True).data
-    mkdir_p(d._token_folder)
-    for k in tokenized:
-        with open(osp.join(d._token_folder, f'{k}.npy'), 'wb') as f:
-            np.save(f, tokenized[k])
-    uf.pickle_save('processed', d._processed_flag['token'])
+        max_length = 64
+    # Unpadded, streamed chunk by chunk across the tokenize workers; batches are padded by the collator
+    chunks = csv_text_chunks(osp.join(d.data_root, 'ogbn-arxiv.txt'), TOKENIZE_CHUNK_SIZE, column=0, sep='\t',
+                             header=None)
+    d.save_tokens(chunks, tokenizer, max_length)
     return
 
 
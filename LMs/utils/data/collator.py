@@ -0,0 +1,100 @@
+import numpy as np
+import torch as th
+from torch.utils.data.dataloader import default_collate
+
+
+class TokenCollator:
+    """Pad the unpadded token fields of a batch to its longest member.
+    Fields ending with input_ids are padded with pad_token_id, attention_mask/token_type_ids with 0 (this covers
+    the nb_* neighbour fields as well); every other field goes through the default collate.
+    pad_to_multiple_of keeps fp16 shapes friendly to tensor cores.
+    """
+
+    def __init__(self, pad_token_id, pad_to_multiple_of=8):
+        self.pad_token_id = pad_token_id
+        self.pad_to_multiple_of = pad_to_multiple_of
+
+    def _pad(self, rows, pad_value):
+        seq_len = max(len(r) for r in rows)
+        if self.pad_to_multiple_of:
+            seq_len = -(-seq_len // self.pad_to_multiple_of) * self.pad_to_multiple_of
+        out = th.full((len(rows), seq_len), pad_value, dtype=th.long)
+        for i, r in enumerate(rows):
+            out[i, :len(r)] = th.as_tensor(r)
+        return out
+
+    def __call__(self, features):
+        batch = {}
+        for k in features[0]:
+            if k.endswith('input_ids'):
+                batch[k] = self._pad([f[k] for f in features], self.pad_token_id)
+            elif k.endswith('attention_mask') or k.endswith('token_type_ids'):
+                batch[k] = self._pad([f[k] for f in features], 0)
+            else:
+                batch[k] = default_collate([f[k] for f in features])
+        return batch
+
+
+def _as_tensor(array):
+    # Token ids / masks as long, cached hidden states (HiddenStore) keep their float dtype
+    return th.from_numpy(array.astype(np.int64) if np.issubdtype(array.dtype, np.integer) else array)
+
+
+class StoreCollator:
+    """Gathers the fields of the node_id of every item from a TokenStore / HiddenStore with one fancy index per field,
+    padded to the longest node of the batch. The other fields of the items go through the default collate.
+    """
+
+    def __init__(self, store, fields=('input_ids', 'attention_mask'), pad_to_multiple_of=8):
+        self.store = store
+        self.fields = fields
+        self.pad_to_multiple_of = pad_to_multiple_of
+
+    def __call__(self, features):
+        node_ids = np.array([f['node_id'] for f in features], dtype=np.int64)
+        seq_len = int(self.store.lengths(node_ids).max())
+        if self.pad_to_multiple_of:
+            seq_len = -(-seq_len // self.pad_to_multiple_of) * self.pad_to_multiple_of
+        seq_len = min(seq_len, self.store.max_length)
+        batch = {k: _as_tensor(self.store.get(k, node_ids, pad_to=seq_len)) for k in self.fields}
+        for k in features[0]:
+            if k != 'node_id':
+                batch[k] = default_collate([f[k] for f in features])
+        return batch
+
+
+class NeighbourPairCollator:
+    """Builds (center, neighbour) batches for contrastive pretraining from node ids.
+    The neighbours of the whole batch are drawn in one vectorised call against the CSR index, and every node appearing
+    in the batch (as center or neighbour) is gathered once with a single fancy index per field, then expanded into
+    the center fields and their nb_* counterparts. Both views share the padded length of the batch.
+    node_ids: also return node_id / nb_node_id, used by CLModel(shared_pass=True) to encode every node once.
+    """
+
+    def __init__(self, tokens, neighbours, fields=('input_ids', 'attention_mask'), dpk=None, node_ids=False,
+                 pad_to_multiple_of=8):
+        self.tokens = tokens
+        self.neighbours = neighbours
+        self.fields = fields
+        self.dpk = dpk
+        self.node_ids = node_ids
+        self.pad_to_multiple_of = pad_to_multiple_of
+
+    def __call__(self, features):
+        centers = np.array([f['node_id'] if isinstance(f, dict) else f for f in features], dtype=np.int64)
+        nodes = np.concatenate([centers, self.neighbours.sample(centers)])
+        unique_nodes, inverse = np.unique(nodes, return_inverse=True)
+        seq_len = int(self.tokens.lengths(unique_nodes).max())
+        if self.pad_to_multiple_of:
+            seq_len = -(-seq_len // self.pad_to_multiple_of) * self.pad_to_multiple_of
+        seq_len = min(seq_len, self.tokens.max_length)
+        center_ids, nb_ids = th.from_numpy(inverse[:len(centers)]), th.from_numpy(inverse[len(centers):])
+        batch = {}
+        for k in self.fields:
+            block = _as_tensor(self.tokens.get(k, unique_nodes, pad_to=seq_len))
+            batch[k], batch[f'nb_{k}'] = block[center_ids], block[nb_ids]
+        if self.node_ids:
+            batch['node_id'], batch['nb_node_id'] = th.from_numpy(nodes[:len(centers)]), th.from_numpy(nodes[len(centers):])
+        if self.dpk is not None:
+            batch['dpk'] = th.from_numpy(np.asarray(self.dpk[centers]))
+        return batch
@@ -4,6 +4,10 @@ from utils.function import *
 from utils.function.dgl_utils import *
 from utils.settings import *
 from utils.data.preprocess import tokenize_graph, load_TAG_info
+from utils.data.token_store import TokenStore, TOKEN_STORE_HEADER, tokenize_to_shared_store
+from utils.data.collator import TokenCollator, NeighbourPairCollator, StoreCollator
+from utils.data.hidden_store import hidden_store_key, load_hidden_store
+from utils.data.neighbours import CSRNeighbours
 import numpy as np
 from torch_sparse import SparseTensor
 from scipy.sparse import coo_matrix
@@ -33,15 +37,18 @@ class Sequence():
         self._g_info_folder = init_path(f"{DATA_PATH}{cf.dataset}/")
         self._g_info_file = f"{self._g_info_folder}graph.info "
         self._token_folder = init_path(f"{DATA_PATH}{cf.dataset}/{self.father_model}/{cf.model}/")
+        # Tokens shared by every model with the same tokenizer, _token_folder links into it
+        self._shared_token_folder = f"{DATA_PATH}{cf.dataset}/tokens/"
         self._NP_token_folder = init_path(f"{DATA_PATH}{cf.dataset}/TNP/{self.father_model}/{cf.model}/")
         self._TRP_token_folder = init_path(f"{DATA_PATH}{cf.dataset}/TRP/{self.father_model}/{cf.model}/")
         self._processed_flag = {
             'g_info': f'{self._g_info_folder}processed.flag',
-            'token': f'{self._token_folder}processed.flag',
+            'token': f'{self._token_folder}{TOKEN_STORE_HEADER}',
             'TNP_token': f'{self._NP_token_folder}processed.flag',
             'TRP_token': f'{self._TRP_token_folder}processed.flag',
         }
         self.g, self.split = None, None
+        self.tokenize_workers = getattr(cf, 'tokenize_workers', 0) or 0
 
         self.info = {
             'input_ids': SN(shape=(self.md['n_nodes'], self.md['max_length']), type=np.uint16),
@@ -50,6 +57,7 @@ class Sequence():
         }
         for k, info in self.info.items():
             info.path = f'{self._token_folder}{k}.npy'
+        self.tokens = None
         return
 
     def init(self, dpk=False, link=False, lab=True):
@@ -136,18 +144,21 @@ class Sequence():
         self.ndata['labels'] = np.load(f'{self._TRP_token_folder}/labels.npy')
 
     def _load_data_fields(self):
+        # Read-only memory maps of the compact token store, shared by all ranks and dataloader workers
+        self.tokens = TokenStore(self._token_folder)
         for k in self.info:
-            i = self.info[k]
-            try:
-                self.ndata[k] = np.load(i.path, allow_pickle=True)  # np.memmap(i.path, mode='r', dtype=i.type, shape=i.shape)
-            except:
-                raise ValueError(f'Shape not match {i.shape}')
+            self.ndata[k] = self.tokens[k]
 
     def save_g_info(self, g_info):
         pickle_save(g_info, self._g_info_file)
         pickle_save('processed', self._processed_flag['g_info'])
         return
 
+    def save_tokens(self, chunks, tokenizer, max_length):
+        # The store header doubles as the processed flag of the tokens, models sharing a tokenizer share the tokens
+        tokenize_to_shared_store(self._token_folder, self._shared_token_folder, chunks, tokenizer, max_length,
+                                 self.process_mode, n_workers=self.tokenize_workers)
+
     def is_processed(self, field):
         return os.path.exists(self._processed_flag[field])
 
@@ -166,85 +177,94 @@ class Sequence():
         return self.ndata[k]
 
     def get_neighbours(self):
+        # CSR index of the bidirected graph, memory-mapped from {DATA_PATH}{dataset}/neighbours/graph/
         if self.md['type'] in {'amazon', 'dblp', 'good', 'webkb'}:
-            g = dgl.load_graphs(f"{self.data_root}{self.data_name}.pt")[0][0]
-            g = dgl.to_bidirected(g)
+            source = f"{self.data_root}{self.data_name}.pt"
+            load_graph = lambda: dgl.load_graphs(source)[0][0]
         elif self.md['type'] == 'ogb':
-            dataset = DglNodePropPredDataset('ogbn-arxiv', root=self.raw_data_path)
-            g, _ = dataset[0]
-            g = dgl.to_bidirected(g)
+            source = self.raw_data_path
+            load_graph = lambda: DglNodePropPredDataset('ogbn-arxiv', root=self.raw_data_path)[0][0]
         else:
             raise ValueError('Not implement!!')
 
-        neighbours_1 = list(g.adjacency_matrix_scipy().tolil().rows)
-        return neighbours_1
+        return CSRNeighbours.cached(f'{self._g_info_folder}neighbours/graph/', source,
+                                    lambda: dgl.to_bidirected(load_graph()))
 
     def get_train_edge(self):
         if self.md['data_name'] == 'Citation-2015':
-            train_g = dgl.load_graphs(os.path.join('/mnt/v-wzhuang/TAG/Link_Predction/DBLP-2015/', 'train_G.pt'))[0][0]
-            train_g = dgl.to_bidirected(train_g)
+            source = os.path.join('/mnt/v-wzhuang/TAG/Link_Predction/DBLP-2015/', 'train_G.pt')
         elif self.md['data_name'] == 'Books-Children':
-            edge_split = th.load('/mnt/v-wzhuang/TAG/Link_Predction/Photo/20000/edge_split.pt')
-            edge_index = edge_split['train']['edge'].t()
-            train_g = SparseTensor.from_edge_index(edge_index).t()
-            train_g = train_g.to_symmetric()
-            train_g = dgl.graph((train_g.coo()[0], train_g.coo()[1]))
+            source = '/mnt/v-wzhuang/TAG/Link_Predction/Photo/20000/edge_split.pt'
         elif self.md['data_name']  == 'GoodReads':
-            edge_split = th.load('/mnt/v-wzhuang/TAG/Link_Predction/GoodReads/5000/edge_split.pt')
-            edge_index = edge_split['train']['edge'].t()
-            train_g = SparseTensor.from_edge_index(edge_index).t()
-            train_g = train_g.to_symmetric()
-            train_g = dgl.graph((train_g.coo()[0], train_g.coo()[1]))
+            source = '/mnt/v-wzhuang/TAG/Link_Predction/GoodReads/5000/edge_split.pt'
         elif self.md['data_name'] == 'Electronics-Photo':
-            edge_split = th.load('/mnt/v-wzhuang/TAG/Link_Predction/Photo/20000/edge_split.pt')
-            edge_index = edge_split['train']['edge'].t()
-            train_g = SparseTensor.from_edge_index(edge_index).t()
-            train_g = train_g.to_symmetric()
-            train_g = dgl.graph((train_g.coo()[0], train_g.coo()[1]))
+            source = '/mnt/v-wzhuang/TAG/Link_Predction/Photo/20000/edge_split.pt'
         else:
             raise ValueError('Not implement!!')
 
-        neighbours_1 = list(train_g.adjacency_matrix_scipy().tolil().rows)
-        return neighbours_1
+        def load_graph():
+            if source.endswith('train_G.pt'):
+                return dgl.to_bidirected(dgl.load_graphs(source)[0][0])
+            edge_index = th.load(source)['train']['edge'].t()
+            train_g = SparseTensor.from_edge_index(edge_index).t()
+            train_g = train_g.to_symmetric()
+            return dgl.graph((train_g.coo()[0], train_g.coo()[1]))
+
+        return CSRNeighbours.cached(f'{self._g_info_folder}neighbours/train_edge/', source, load_graph)
 
     def get_tokens(self, node_id):
-        _load = lambda k: th.IntTensor(np.array(self.ndata[k][node_id]))
+        # Unpadded tokens, batches are padded to their longest member by TokenCollator
+        _load = lambda k: th.from_numpy(self.tokens.row(k, node_id).astype(np.int32))
         item = {}
         item['attention_mask'] = _load('attention_mask')
-        item['input_ids'] = th.IntTensor(np.array(self['input_ids'][node_id]).astype(np.int32))
+        item['input_ids'] = _load('input_ids')
         # item['dpk'] = (np.array(self.dpk[node_id]))
         if self.hf_model not in ['distilbert-base-uncased', 'roberta-base']:
             item['token_type_ids'] = _load('token_type_ids')
         return item
 
     def get_NP_tokens(self, node_id):
-        _load = lambda k: th.IntTensor(np.array(self.ndata[k][node_id]))
+        _load = lambda k: th.from_numpy(np.array(self.ndata[k][node_id], dtype=np.int32))
         item = {}
         item['attention_mask'] = _load('attention_mask')
-        item['input_ids'] = th.IntTensor(np.array(self['input_ids'][node_id]).astype(np.int32))
+        item['input_ids'] = th.from_numpy(np.array(self['input_ids'][node_id], dtype=np.int32))
         item['labels'] = self._from_numpy(self.ndata['labels'][node_id]).type(th.FloatTensor)
         if self.hf_model not in ['distilbert-base-uncased', 'roberta-base']:
             item['token_type_ids'] = _load('token_type_ids')
         return item
 
     def get_NB_tokens(self, item, node_id):
-        _load = lambda k: th.IntTensor(np.array(self.ndata[k][node_id]))
+        _load = lambda k: th.from_numpy(self.tokens.row(k, node_id).astype(np.int32))
         item['nb_attention_mask'] = _load('attention_mask')
-        item['nb_input_ids'] = th.IntTensor(np.array(self['input_ids'][node_id]).astype(np.int32))
+        item['nb_input_ids'] = _load('input_ids')
         if self.hf_model not in ['distilbert-base-uncased', 'roberta-base']:
             item['nb_token_type_ids'] = _load('token_type_ids')
         return item
 
     def get_DPK_tokens(self, node_id):
-        _load = lambda k: th.IntTensor(np.array(self.ndata[k][node_id]))
+        _load = lambda k: th.from_numpy(self.tokens.row(k, node_id).astype(np.int32))
         item = {}
         item['attention_mask'] = _load('attention_mask')
-        item['input_ids'] = th.IntTensor(np.array(self['input_ids'][node_id]).astype(np.int32))
+        item['input_ids'] = _load('input_ids')
         item['dpk'] = (np.array(self.dpk[node_id]))
         if self.hf_model not in ['distilbert-base-uncased', 'roberta-base']:
             item['token_type_ids'] = _load('token_type_ids')
         return item
 
+    def pair_collator(self, link=False, dpk=False, node_ids=False, store=None):
+        # Batch-level (center, neighbour) sampling for SeqNodeDataset, neighbours come from the training edges if link
+        # store: gather from a HiddenStore instead of the tokens
+        return NeighbourPairCollator(self.tokens if store is None else store,
+                                     self.edge_index if link else self.neighbours,
+                                     dpk=self.dpk if dpk else None, node_ids=node_ids)
+
+    def hidden_store(self, PLM, n_frozen, model_name):
+        # Hidden states of every node after the n_frozen lower layers of PLM, computed once (by rank 0) and cached
+        key = hidden_store_key(model_name, n_frozen, self.tokens)
+        device = th.device('cuda', max(self.cf.local_rank, 0)) if th.cuda.is_available() else 'cpu'
+        return load_hidden_store(f'{self._g_info_folder}hidden/{key}/', PLM, n_frozen, self.tokens,
+                                 self.cf.local_rank, self.cf.inf_batch_size, device)
+
 class SeqGraphDataset(th.utils.data.Dataset):  # Map style
     def __init__(self, data: Sequence, mode=None):
         super().__init__()
@@ -260,6 +280,22 @@ class SeqGraphDataset(th.utils.data.Dataset):  # Map style
         return self.d.n_nodes
 
 
+class SeqNodeDataset(th.utils.data.Dataset):
+    # Node ids (and labels), tokens and neighbours are gathered per batch by Sequence.pair_collator / StoreCollator
+    def __init__(self, data: Sequence, labels=False):
+        super().__init__()
+        self.d = data
+        self.labels = labels
+
+    def __getitem__(self, node_id):
+        item = {'node_id': node_id}
+        if self.labels:
+            item['labels'] = self.d.y_gold(node_id)
+        return item
+
+    def __len__(self):
+        return self.d.n_nodes
+
 class SeqCLDataset(th.utils.data.Dataset):
     def __init__(self, data: Sequence):
         super().__init__()
@@ -267,8 +303,7 @@ class SeqCLDataset(th.utils.data.Dataset):
 
     def __getitem__(self, node_id):
         item = self.d.get_tokens(node_id)
-        neighbours = self.d.neighbours[node_id]
-        k = np.random.choice(neighbours, 1)
+        k = self.d.neighbours.sample([node_id])
         item = self.d.get_NB_tokens(item, k[0]) #! 采样2个一阶邻居； 或者从二阶中采样一个；
         return item
 
@@ -294,8 +329,7 @@ class DK_CL_Dataset(th.utils.data.Dataset):
 
     def __getitem__(self, node_id):
         item = self.d.get_DPK_tokens(node_id)
-        neighbours = self.d.neighbours[node_id]
-        k = np.random.choice(neighbours, 1)
+        k = self.d.neighbours.sample([node_id])
         item = self.d.get_NB_tokens(item, k[0])
         return item
 
@@ -310,8 +344,7 @@ class CLFDataset(th.utils.data.Dataset):
     def __getitem__(self, node_id):
         item = self.d.get_tokens(node_id)
         item['labels'] = self.d.y_gold(node_id)
-        neighbours = self.d.neighbours[node_id]
-        k = np.random.choice(neighbours, 1)
+        k = self.d.neighbours.sample([node_id])
         item = self.d.get_NB_tokens(item, k[0]) #! 采样2个一阶邻居； 或者从二阶中采样一个；
         return item
 
@@ -325,15 +358,9 @@ class Seq_Link_Dataset(th.utils.data.Dataset):
 
     def __getitem__(self, node_id):
         item = self.d.get_tokens(node_id)
-        neighbour_id = self.d.edge_index[node_id]
-        if neighbour_id != []:
-            k = np.random.choice(neighbour_id, 1)
-            item = self.d.get_NB_tokens(item, k[0])
-        else:
-            # Do the self contrastive learning
-            k = node_id
-            item = self.d.get_NB_tokens(item, k)
-
+        # Nodes without training edges get themselves, i.e. do the self contrastive learning
+        k = self.d.edge_index.sample([node_id])
+        item = self.d.get_NB_tokens(item, k[0])
         return item
 
     def __len__(self):
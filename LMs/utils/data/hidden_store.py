@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+import torch as th
+from numpy.lib.format import open_memmap
+
+from utils.data.token_store import TokenStore
+from utils.function.np_utils import atomic_path, save_json_atomic, save_npy_atomic
+
+# Hidden states of a partially frozen encoder at the freeze boundary, i.e. the output of the embeddings and the
+# frozen lower layers, stored ragged like the token store: the fp16 states of the real tokens of all nodes are
+# concatenated in hidden.npy and node i owns hidden[offsets[i]:offsets[i + 1]]. Padding never changes the states of
+# real tokens, so re-padding the cached rows and running the trainable top layers gives the full model's output
+# (with the frozen layers in eval mode, i.e. without their dropout). hidden_store.json is the header, written last.
+HIDDEN_STORE_HEADER = 'hidden_store.json'
+
+
+def hidden_store_key(model, n_frozen, tokens):
+    # Model weights, boundary and the tokenization the states were computed from
+    identity = {'model': model, 'n_frozen': n_frozen, 'tokens': os.path.abspath(tokens.folder),
+                'n_tokens': tokens.header['n_tokens'], 'max_length': tokens.max_length}
+    return hashlib.sha1(json.dumps(identity, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+def frozen_prefix(PLM, n_frozen, input_ids, attention_mask, token_type_ids=None):
+    """Embeddings and the first n_frozen layers of a BERT-style encoder (PLM.encoder.layer)"""
+    hidden_states = PLM.embeddings(input_ids=input_ids, token_type_ids=token_type_ids)
+    extended_mask = PLM.get_extended_attention_mask(attention_mask, input_ids.shape)
+    for layer in PLM.encoder.layer[:n_frozen]:
+        hidden_states = layer(hidden_states, attention_mask=extended_mask)[0]
+    return hidden_states
+
+
+def build_hidden_store(folder, PLM, n_frozen, tokens, batch_size=256, device='cpu', log=print):
+    start = time.time()
+    os.makedirs(folder, exist_ok=True)
+    lengths = tokens.lengths()
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(lengths)
+    device = th.device(device)
+    was_training = PLM.training
+    PLM.eval().to(device)
+    # Length sorted batches, so that almost nothing is padding
+    order = np.argsort(lengths, kind='stable')
+    with atomic_path(os.path.join(folder, 'hidden.npy')) as hidden_file:
+        hidden = open_memmap(hidden_file, mode='w+', dtype=np.float16,
+                             shape=(int(offsets[-1]), PLM.config.hidden_size))
+        with th.no_grad(), th.autocast(device_type='cuda', enabled=device.type == 'cuda'):
+            for i in range(0, len(order), batch_size):
+                node_ids = order[i:i + batch_size]
+                seq_len = int(lengths[node_ids].max())
+                batch = {k: th.from_numpy(tokens.get(k, node_ids, pad_to=seq_len).astype(np.int64)).to(device)
+                         for k in ['input_ids', 'attention_mask', 'token_type_ids']}
+                states = frozen_prefix(PLM, n_frozen, **batch).half().cpu().numpy()
+                mask = batch['attention_mask'].cpu().numpy().astype(bool)
+                positions = offsets[node_ids][:, None] + np.arange(seq_len)
+                hidden[positions[mask]] = states[mask]
+        hidden.flush()
+        del hidden
+    PLM.train(was_training)
+    save_npy_atomic(os.path.join(folder, 'offsets.npy'), offsets)
+    save_json_atomic(os.path.join(folder, HIDDEN_STORE_HEADER),
+                     {'n_nodes': len(lengths), 'n_tokens': int(offsets[-1]), 'hidden_size': PLM.config.hidden_size,
+                      'n_frozen': n_frozen, 'max_length': tokens.max_length})
+    log(f'Hidden states of {len(lengths)} nodes after {n_frozen} frozen layers saved to {folder} in '
+        f'{time.time() - start:.1f}s')
+    return HiddenStore(folder)
+
+
+def load_hidden_store(folder, PLM, n_frozen, tokens, local_rank=-1, batch_size=256, device='cpu', log=print,
+                      interval=0.5):
+    """Open the hidden store of folder, built by rank 0 when missing while the other ranks wait for its header"""
+    if not os.path.exists(os.path.join(folder, HIDDEN_STORE_HEADER)):
+        if local_rank <= 0:
+            return build_hidden_store(folder, PLM, n_frozen, tokens, batch_size, device, log)
+        while not os.path.exists(os.path.join(folder, HIDDEN_STORE_HEADER)):
+            time.sleep(interval)
+    return HiddenStore(folder)
+
+
+class HiddenStore:
+    """Read-only view of a hidden store with the TokenStore interface used by the collators: get('input_ids')
+    returns the padded (n, seq_len, hidden_size) boundary states and get('attention_mask') their mask.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        with open(os.path.join(folder, HIDDEN_STORE_HEADER)) as f:
+            self.header = json.load(f)
+        self.n_nodes = self.header['n_nodes']
+        self.max_length = self.header['max_length']
+        self._arrays = None
+
+    def __getstate__(self):
+        return {**self.__dict__, '_arrays': None}
+
+    def __len__(self):
+        return self.n_nodes
+
+    _node_ids = TokenStore._node_ids
+
+    @property
+    def arrays(self):
+        if self._arrays is None:
+            self._arrays = {k: np.load(os.path.join(self.folder, f'{k}.npy'), mmap_mode='r')
+                            for k in ['hidden', 'offsets']}
+        return self._arrays
+
+    def lengths(self, idx=slice(None)):
+        offsets = self.arrays['offsets']
+        node_ids = self._node_ids(idx)
+        return offsets[node_ids + 1] - offsets[node_ids]
+
+    def get(self, field, idx=slice(None), pad_to=None):
+        node_ids = self._node_ids(idx)
+        pad_to = self.max_length if pad_to is None else pad_to
+        lengths = np.minimum(self.lengths(node_ids), pad_to)
+        mask = np.arange(pad_to) < lengths[:, None]
+        if field == 'attention_mask':
+            return mask.astype(np.uint8)
+        if field != 'input_ids':
+            raise KeyError(field)
+        out = np.zeros((*mask.shape, self.header['hidden_size']), dtype=np.float16)
+        positions = self.arrays['offsets'][node_ids][:, None] + np.arange(pad_to)
+        out[mask] = self.arrays['hidden'][positions[mask]]
+        return out
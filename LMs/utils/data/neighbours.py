@@ -0,0 +1,89 @@
+import json
+import os
+
+import numpy as np
+
+from utils.function.np_utils import save_json_atomic, save_npy_atomic
+
+# CSR neighbour index: the neighbours of node i are indices[indptr[i]:indptr[i + 1]].
+# Both arrays are .npy files memory-mapped read-only, so the index costs nothing to pickle into dataloader workers.
+NEIGHBOUR_HEADER = 'neighbours.json'
+
+
+def _fingerprint(source):
+    # Path, size and mtime of the file the graph comes from, only the path for folders (e.g. OGB roots)
+    if source is not None and os.path.isfile(source):
+        stat = os.stat(source)
+        return {'source': os.path.abspath(source), 'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+    return {'source': None if source is None else os.path.abspath(source)}
+
+
+class CSRNeighbours:
+    def __init__(self, folder):
+        self.folder = folder
+        with open(os.path.join(folder, NEIGHBOUR_HEADER)) as f:
+            self.header = json.load(f)
+        self.n_nodes = self.header['n_nodes']
+        self._arrays = None
+
+    @classmethod
+    def cached(cls, folder, source, build_graph, log=print):
+        """Load the index of folder, (re)built from build_graph() when missing or when source has changed"""
+        header_file = os.path.join(folder, NEIGHBOUR_HEADER)
+        if os.path.exists(header_file):
+            with open(header_file) as f:
+                if {k: v for k, v in json.load(f).items() if k in _fingerprint(source)} == _fingerprint(source):
+                    return cls(folder)
+        log(f'Building CSR neighbour index in {folder}')
+        return cls.save(folder, build_graph(), source)
+
+    @classmethod
+    def save(cls, folder, g, source=None):
+        os.makedirs(folder, exist_ok=True)
+        csr = g.adjacency_matrix_scipy(fmt='csr')
+        csr.sort_indices()
+        n_nodes = csr.shape[0]
+        save_npy_atomic(os.path.join(folder, 'indptr.npy'), csr.indptr.astype(np.int64))
+        save_npy_atomic(os.path.join(folder, 'indices.npy'),
+                        csr.indices.astype(np.int32 if n_nodes < np.iinfo(np.int32).max else np.int64))
+        save_json_atomic(os.path.join(folder, NEIGHBOUR_HEADER),
+                         {'n_nodes': n_nodes, 'n_edges': int(csr.nnz), **_fingerprint(source)})
+        return cls(folder)
+
+    def __getstate__(self):
+        return {**self.__dict__, '_arrays': None}
+
+    @property
+    def indptr(self):
+        return self._load()['indptr']
+
+    @property
+    def indices(self):
+        return self._load()['indices']
+
+    def _load(self):
+        if self._arrays is None:
+            self._arrays = {k: np.load(os.path.join(self.folder, f'{k}.npy'), mmap_mode='r') for k in
+                            ['indptr', 'indices']}
+        return self._arrays
+
+    def __len__(self):
+        return self.n_nodes
+
+    def __getitem__(self, node_id):
+        return np.asarray(self.indices[self.indptr[node_id]:self.indptr[node_id + 1]])
+
+    def degree(self, nodes):
+        nodes = np.asarray(nodes)
+        return self.indptr[nodes + 1] - self.indptr[nodes]
+
+    def sample(self, nodes, rng=np.random):
+        """One uniformly drawn neighbour per node, in a single vectorised pass.
+        Isolated nodes get themselves, i.e. fall back to self contrastive learning.
+        """
+        nodes = np.asarray(nodes, dtype=np.int64)
+        if len(self.indices) == 0:
+            return nodes
+        deg = self.degree(nodes)
+        picked = self.indptr[nodes] + (rng.random_sample(len(nodes)) * deg).astype(np.int64)
+        return np.where(deg > 0, self.indices[np.minimum(picked, len(self.indices) - 1)], nodes)
@@ -1,5 +1,6 @@
 import gc
 import os
+import sys
 import time
 
 import dgl
@@ -18,6 +19,10 @@ from torch_geometric.utils import to_undirected, dropout_adj
 from utils.data.OGB.arxiv import _tokenize_ogb_arxiv_datasets
 from utils.data.Amazon.Amazon_data import _tokenize_amazon_datasets
 from utils.data.WebKB.WebKB_data import _tokenize_webkb_datasets
+from utils.data.token_store import wait_for_token_store
+
+sys.path.append(PROJ_DIR)
+from GNN.model.splits import random_split, time_split, get_split
 
 
 def plot_length_distribution(node_text, tokenizer, g):
@@ -56,49 +61,25 @@ def tokenize_graph(cf):
         else:
             # If not main worker (i.e. Local_rank!=0), wait until data is processed and load
             print(f'Waiting for tokenization on LOCAL_RANK #{cf.local_rank}')
-            while not d.is_processed('token'):
-                time.sleep(2)  # Check if processed every 2 seconds
+            # The token store manifest is renamed into place once all arrays are written
+            wait_for_token_store(d._token_folder)
             print(f'Detected processed data, LOCAL_RANK #{cf.local_rank} start loading!')
-            time.sleep(5)  # Wait for file write for 5 seconds
     else:
         cf.log(f'Found processed {cf.dataset}.')
 
 
 def split_graph(nodes_num, train_ratio, val_ratio):
-    np.random.seed(42)
-    indices = np.random.permutation(nodes_num)
-    train_size = int(nodes_num * train_ratio)
-    val_size = int(nodes_num * val_ratio)
-
-    train_ids = indices[:train_size]
-    val_ids = indices[train_size:train_size + val_size]
-    test_ids = indices[train_size + val_size:]
-
-    return train_ids, val_ids, test_ids
+    return tuple(ids.numpy() for ids in random_split(nodes_num, train_ratio, val_ratio))
 
 
 def split_time(g, train_year=2016, val_year=2017):
-    np.random.seed(42)
-    year = list(np.array(g.ndata['year']))
-    indices = np.arange(g.num_nodes())
-    # 1999-2014 train
-    # Filter out nodes with label -1
     print(f'train year: {train_year}')
-    valid_indices = [i for i in indices if g.ndata['label'][i] != -1]
-
-    # Filter out valid indices based on years
-    train_ids = [i for i in valid_indices if year[i] < train_year]
-    val_ids = [i for i in valid_indices if year[i] >= train_year and year[i] < val_year]
-    test_ids = [i for i in valid_indices if year[i] >= val_year]
+    train_ids, val_ids, test_ids = (ids.numpy() for ids in
+                                    time_split(g.ndata['year'], g.ndata['label'], train_year, val_year))
 
-
-    train_length = len(train_ids)
-    val_length = len(val_ids)
-    test_length = len(test_ids)
-
-    print("Train set length:", train_length)
-    print("Validation set length:", val_length)
-    print("Test set length:", test_length)
+    print("Train set length:", len(train_ids))
+    print("Validation set length:", len(val_ids))
+    print("Test set length:", len(test_ids))
 
     return train_ids, val_ids, test_ids
 
@@ -114,23 +95,22 @@ def load_ogb_graph_structure_only(cf):
 
 def load_amazon_graph_structure_only(cf):
     import dgl
-    g = dgl.load_graphs(f"{cf.data.data_root}{cf.data.data_name}.pt")[0][0]
+    graph_file = f"{cf.data.data_root}{cf.data.data_name}.pt"
+    g = dgl.load_graphs(graph_file)[0][0]
     labels = g.ndata['label'].numpy()
-    if cf.splits == 'random':
-        split_idx = split_graph(g.num_nodes(), cf.train_ratio, cf.val_ratio)
-    elif cf.splits == 'time':
-        split_idx = split_time(g, cf.data.train_year, cf.data.val_year)
-    else:
-        raise ValueError('Please check the split datasets way')
+    split_idx = tuple(ids.numpy() for ids in get_split(
+        g, graph_file, cf.splits, cf.train_ratio, cf.val_ratio, getattr(cf.data, 'train_year', None),
+        getattr(cf.data, 'val_year', None)))
 
     return g, labels, split_idx
 
 def load_webkb_graph_structure_only(cf):
     import dgl
-    g = dgl.load_graphs(f"{cf.data.data_root}{cf.data.data_name}.pt")[0][0]
+    graph_file = f"{cf.data.data_root}{cf.data.data_name}.pt"
+    g = dgl.load_graphs(graph_file)[0][0]
     labels = g.ndata['label'].numpy()
     # random split
-    split_idx = split_graph(g.num_nodes(), cf.train_ratio, cf.val_ratio)
+    split_idx = tuple(ids.numpy() for ids in get_split(g, graph_file, 'random', cf.train_ratio, cf.val_ratio))
 
     return g, labels, split_idx
 
@@ -0,0 +1,278 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from itertools import chain, islice
+
+import numpy as np
+import torch.multiprocessing as mp
+
+from utils.function.np_utils import atomic_path, save_json_atomic, save_npy_atomic
+
+# Compact on-disk token store of a tokenized graph.
+# Tokens are stored ragged: the unpadded tokens of all nodes are concatenated in one flat buffer and node i owns
+# flat[offsets[i]:offsets[i + 1]]. input_ids are kept as uint16 (uint32 for vocabularies above 65536 tokens),
+# token_type_ids as uint8 and dropped entirely when all zero; the attention mask is implied by the lengths.
+# Every array is a .npy file opened read-only with mmap, so all DDP ranks and dataloader workers share the same
+# page cache. token_store.json is the header, written last: it doubles as the processed flag of the tokens.
+TOKEN_STORE_HEADER = 'token_store.json'
+TOKEN_STORE_VERSION = 2
+TOKENIZE_CHUNK_SIZE = 10000
+
+
+def id_dtype(vocab_size):
+    return np.uint16 if vocab_size <= np.iinfo(np.uint16).max + 1 else np.uint32
+
+
+def _save_array(folder, name, array):
+    save_npy_atomic(os.path.join(folder, f'{name}.npy'), array)
+
+
+_tokenizer = None
+
+
+def _init_worker(tokenizer):
+    global _tokenizer
+    # One tokenizer per process, its Rust thread pool would only oversubscribe the cores
+    os.environ['TOKENIZERS_PARALLELISM'] = 'false'
+    _tokenizer = tokenizer
+
+
+def _tokenize_chunk(task):
+    chunk_id, texts, max_length, dtype, chunk_dir = task
+    encoded = _tokenizer(texts, padding='do_not_pad', truncation=True, max_length=max_length,
+                         return_token_type_ids=True)
+    lengths = np.fromiter((len(row) for row in encoded['input_ids']), dtype=np.int64, count=len(texts))
+    n_tokens = int(lengths.sum())
+    prefix = os.path.join(chunk_dir, f'chunk_{chunk_id}')
+    np.save(f'{prefix}.input_ids.npy', np.fromiter(chain.from_iterable(encoded['input_ids']), dtype=dtype,
+                                                   count=n_tokens))
+    np.save(f'{prefix}.lengths.npy', lengths)
+    has_token_type = any(any(row) for row in encoded['token_type_ids'])
+    if has_token_type:
+        np.save(f'{prefix}.token_type_ids.npy', np.fromiter(chain.from_iterable(encoded['token_type_ids']),
+                                                            dtype=np.uint8, count=n_tokens))
+    return chunk_id, len(texts), n_tokens, has_token_type
+
+
+def text_chunks(texts, chunk_size):
+    """Split an in-memory list/Series of texts into chunks."""
+    for start in range(0, len(texts), chunk_size):
+        yield list(texts[start:start + chunk_size])
+
+
+def csv_text_chunks(path, chunk_size, column='text', **read_csv_kwargs):
+    """Stream the text column of a csv file chunk by chunk."""
+    import pandas as pd
+    for df in pd.read_csv(path, chunksize=chunk_size, **read_csv_kwargs):
+        yield df[column].astype(str).tolist()
+
+
+def tokenize_to_store(folder, chunks, tokenizer, max_length, n_workers=0, log=print):
+    """Tokenize an iterable of text chunks into a ragged token store.
+    Chunks are tokenized by n_workers spawned processes (in process if 0) with at most two chunks per worker in
+    flight, each worker writes the compact tokens of its chunk to disk. The chunks are then copied in order into the
+    preallocated final arrays, and the header (the manifest of the store) is written atomically at the very end.
+    """
+    os.makedirs(chunk_dir := os.path.join(folder, 'chunks'), exist_ok=True)
+    dtype = np.dtype(id_dtype(len(tokenizer))).name
+    tasks = ((i, texts, max_length, dtype, chunk_dir) for i, texts in enumerate(chunks))
+    start = time.time()
+    if n_workers > 0:
+        results = []
+        with mp.get_context('spawn').Pool(n_workers, initializer=_init_worker, initargs=(tokenizer,)) as pool:
+            while len(wave := list(islice(tasks, 2 * n_workers))) > 0:
+                results += pool.map(_tokenize_chunk, wave)
+                log(f'Tokenized {sum(r[1] for r in results)} texts in {time.time() - start:.1f}s')
+    else:
+        _init_worker(tokenizer)
+        results = [_tokenize_chunk(task) for task in tasks]
+    results.sort()
+
+    chunk_file = lambda i, name: os.path.join(chunk_dir, f'chunk_{i}.{name}.npy')
+    lengths = np.concatenate([np.load(chunk_file(i, 'lengths')) for i, *_ in results])
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    n_tokens = int(offsets[-1])
+    has_token_type = any(r[3] for r in results)
+    fields = {'input_ids': dtype, **({'token_type_ids': np.uint8} if has_token_type else {})}
+    for k, t in fields.items():
+        with atomic_path(os.path.join(folder, f'{k}.npy')) as tmp_file:
+            out = np.lib.format.open_memmap(tmp_file, mode='w+', dtype=t, shape=(n_tokens,))
+            pos = 0
+            for i, _, chunk_tokens, chunk_has_token_type in results:
+                # Chunks without token types were not saved, they are all zero
+                out[pos:pos + chunk_tokens] = np.load(chunk_file(i, k)) \
+                    if k == 'input_ids' or chunk_has_token_type else 0
+                pos += chunk_tokens
+            out.flush()
+            del out
+    _save_array(folder, 'offsets', offsets)
+    shutil.rmtree(chunk_dir)
+
+    header = {'version': TOKEN_STORE_VERSION, 'n_nodes': len(lengths), 'n_tokens': n_tokens,
+              'max_length': max_length, 'vocab_size': len(tokenizer), 'pad_token_id': tokenizer.pad_token_id or 0,
+              'token_type_ids': 'flat' if has_token_type else 'zeros', 'n_chunks': len(results)}
+    save_json_atomic(os.path.join(folder, TOKEN_STORE_HEADER), header)
+    log(f'Token store of {len(lengths)} nodes and {n_tokens} tokens saved to {folder} in {time.time() - start:.1f}s')
+    return header
+
+
+def tokenizer_key(tokenizer, max_length, text_mode):
+    """Identity of a tokenization: everything that decides the produced ids, but not the model name.
+    Fast tokenizers are identified by their serialized backend (vocab, normalizer, pre-tokenizer, post-processor and
+    added tokens), slow ones by their vocab and init settings.
+    """
+    backend = getattr(tokenizer, 'backend_tokenizer', None)
+    if backend is not None:
+        spec = backend.to_str()
+    else:
+        settings = {k: v for k, v in tokenizer.init_kwargs.items() if
+                    isinstance(v, (str, int, float, bool)) and 'file' not in k and k != 'name_or_path'}
+        spec = json.dumps([sorted(tokenizer.get_vocab().items()), sorted(settings.items())])
+    identity = {'spec': hashlib.sha1(spec.encode('utf-8')).hexdigest(), 'pad_token_id': tokenizer.pad_token_id,
+                'padding_side': tokenizer.padding_side, 'truncation_side': getattr(tokenizer, 'truncation_side', None),
+                'max_length': max_length, 'text_mode': text_mode, 'version': TOKEN_STORE_VERSION}
+    return hashlib.sha1(json.dumps(identity, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+def link_token_store(src, dst):
+    """Make dst a token store sharing the files of src, hard links where possible, copies otherwise."""
+    os.makedirs(dst, exist_ok=True)
+    files = [f for f in os.listdir(src) if f.endswith('.npy')] + [TOKEN_STORE_HEADER]
+    for f in files:
+        if os.path.exists(os.path.join(dst, f)):
+            os.remove(os.path.join(dst, f))
+        try:
+            os.link(os.path.join(src, f), os.path.join(dst, f))
+        except OSError:
+            shutil.copy2(os.path.join(src, f), os.path.join(dst, f))
+
+
+def tokenize_to_shared_store(folder, shared_root, chunks, tokenizer, max_length, text_mode, n_workers=0, log=print):
+    """tokenize_to_store through a cache shared by every model whose tokenizer resolves to the same tokenizer_key:
+    the corpus is tokenized once into shared_root/{key}/ and folder only links to it.
+    """
+    shared = os.path.join(shared_root, tokenizer_key(tokenizer, max_length, text_mode))
+    if os.path.exists(os.path.join(shared, TOKEN_STORE_HEADER)):
+        log(f'Found tokens of the same tokenizer in {shared}')
+    else:
+        # Tokenize into a private folder then rename, two runs racing on the same key never mix their chunks
+        tmp_folder = f'{shared}.{os.getpid()}.tmp'
+        tokenize_to_store(tmp_folder, chunks, tokenizer, max_length, n_workers, log)
+        try:
+            os.rename(tmp_folder, shared)
+        except OSError:
+            shutil.rmtree(tmp_folder)
+    link_token_store(shared, folder)
+    return shared
+
+
+def wait_for_token_store(folder, interval=0.5):
+    # The header is renamed into place once every array is complete, no grace period is needed after it shows up
+    while not os.path.exists(os.path.join(folder, TOKEN_STORE_HEADER)):
+        time.sleep(interval)
+
+
+class TokenStore:
+    """Read-only view of a token store.
+    row() returns the unpadded tokens of one node, get() pads a set of nodes to a common length (max_length by
+    default, i.e. the dense layout the tokenizer would have produced). The memory maps are opened lazily and not
+    pickled, so the store is cheap to send to worker processes.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        with open(os.path.join(folder, TOKEN_STORE_HEADER)) as f:
+            self.header = json.load(f)
+        if self.header['version'] != TOKEN_STORE_VERSION:
+            raise ValueError(f'Token store {folder} has version {self.header["version"]}, expected '
+                             f'{TOKEN_STORE_VERSION}, please tokenize again.')
+        self.n_nodes, self.max_length = self.header['n_nodes'], self.header['max_length']
+        self.pad_token_id = self.header['pad_token_id']
+        self._arrays = None
+
+    def __getstate__(self):
+        return {**self.__dict__, '_arrays': None}
+
+    def __len__(self):
+        return self.n_nodes
+
+    def __getitem__(self, field):
+        return TokenField(self, field)
+
+    @property
+    def arrays(self):
+        if self._arrays is None:
+            files = [f for f in os.listdir(self.folder) if f.endswith('.npy') and not f.endswith('.tmp.npy')]
+            self._arrays = {f[:-4]: np.load(os.path.join(self.folder, f), mmap_mode='r') for f in files}
+        return self._arrays
+
+    def _node_ids(self, idx):
+        # Ids selected by idx, only the selected ones are materialized
+        if isinstance(idx, slice):
+            return np.arange(*idx.indices(self.n_nodes))
+        node_ids = np.asarray(idx)
+        if node_ids.dtype == bool:
+            return np.nonzero(node_ids)[0]
+        return np.where(node_ids < 0, node_ids + self.n_nodes, node_ids)
+
+    def lengths(self, idx=slice(None)):
+        offsets = self.arrays['offsets']
+        node_ids = self._node_ids(idx)
+        return np.minimum(offsets[node_ids + 1] - offsets[node_ids], self.max_length)
+
+    def row(self, field, node_id):
+        start, end = self.arrays['offsets'][node_id], self.arrays['offsets'][node_id + 1]
+        end = min(end, start + self.max_length)
+        if field == 'input_ids':
+            return np.asarray(self.arrays['input_ids'][start:end])
+        if field == 'attention_mask':
+            return np.ones(end - start, dtype=np.uint8)
+        if field == 'token_type_ids':
+            if self.header['token_type_ids'] == 'zeros':
+                return np.zeros(end - start, dtype=np.uint8)
+            return np.asarray(self.arrays['token_type_ids'][start:end])
+        raise KeyError(field)
+
+    def get(self, field, idx=slice(None), pad_to=None):
+        node_ids = self._node_ids(idx)
+        if np.ndim(node_ids) == 0:
+            return self.get(field, [int(node_ids)], pad_to)[0]
+        pad_to = self.max_length if pad_to is None else pad_to
+        lengths = np.minimum(self.lengths(node_ids), pad_to)
+        mask = np.arange(pad_to) < lengths[:, None]
+        if field == 'attention_mask':
+            return mask.astype(np.uint8)
+        if field == 'token_type_ids' and self.header['token_type_ids'] == 'zeros':
+            return np.zeros(mask.shape, dtype=np.uint8)
+        if field not in {'input_ids', 'token_type_ids'}:
+            raise KeyError(field)
+        flat = self.arrays[field]
+        pad_value = self.pad_token_id if field == 'input_ids' else 0
+        out = np.full(mask.shape, pad_value, dtype=flat.dtype)
+        # Gather all tokens of the batch with one fancy index into the flat buffer
+        positions = self.arrays['offsets'][node_ids][:, None] + np.arange(pad_to)
+        out[mask] = flat[positions[mask]]
+        return out
+
+
+class TokenField:
+    """One field of a TokenStore, indexed like the dense (n_nodes, max_length) array it replaces."""
+
+    def __init__(self, store, field):
+        self.store, self.field = store, field
+
+    @property
+    def shape(self):
+        return self.store.n_nodes, self.store.max_length
+
+    def __len__(self):
+        return self.store.n_nodes
+
+    def __getitem__(self, idx):
+        return self.store.get(self.field, idx)
+
+    def __array__(self, dtype=None):
+        array = self.store.get(self.field)
+        return array if dtype is None else array.astype(dtype)
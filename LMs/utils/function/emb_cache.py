@@ -0,0 +1,109 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from utils.function.np_utils import save_json_atomic, save_npy_atomic
+
+
+def text_keys(texts):
+    """Content address of every text: hex blake2b digest, stored as fixed-width bytes."""
+    return np.array([hashlib.blake2b(str(t).encode('utf-8'), digest_size=16).hexdigest() for t in texts], dtype='S32')
+
+
+def token_keys(input_ids, lengths):
+    """Content address of pre-tokenized rows, padding excluded. Ids are hashed as int64 whatever their storage dtype."""
+    return np.array([hashlib.blake2b(np.ascontiguousarray(row[:l], dtype=np.int64).tobytes(), digest_size=16).hexdigest()
+                     for row, l in zip(input_ids, lengths)], dtype='S32')
+
+
+class EmbCache:
+    """On-disk embedding cache addressed by (model, revision, pooling, max_length, padding, precision, text hash).
+    padding is 'max_length' or 'longest' (of the batch or corpus): poolings that average the padding tokens
+    (nomask_mean) depend on it, so entries of one padding scheme are never served under the other.
+    Every (model, revision, pooling, max_length, padding, precision) gets its own folder of append-only segments:
+    seg_{i}.npy holds the embeddings and seg_{i}.keys.npy the matching text hashes, written last as commit marker.
+    """
+
+    def __init__(self, root, model, pooling, max_length, revision=None, precision='fp32', padding='longest',
+                 log=print):
+        self.meta = {'model': model, 'revision': revision, 'pooling': pooling, 'max_length': max_length,
+                     'padding': padding, 'precision': precision}
+        namespace = hashlib.sha1(json.dumps(self.meta, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+        self.folder = os.path.join(root, namespace)
+        self.log = log
+        os.makedirs(self.folder, exist_ok=True)
+        meta_file = os.path.join(self.folder, 'meta.json')
+        if not os.path.exists(meta_file):
+            save_json_atomic(meta_file, self.meta)
+        self._load_index()
+
+    def _segments(self):
+        return sorted(int(f.split('_')[1].split('.')[0]) for f in os.listdir(self.folder) if f.endswith('.keys.npy'))
+
+    def _load_index(self):
+        # key -> (segment, row)
+        self.index, self.segments = {}, {}
+        for seg in self._segments():
+            keys = np.load(os.path.join(self.folder, f'seg_{seg}.keys.npy'))
+            self.index.update({k: (seg, row) for row, k in enumerate(keys)})
+            self.segments[seg] = np.load(os.path.join(self.folder, f'seg_{seg}.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.index)
+
+    def get(self, keys):
+        """Returns the positions of keys found in the cache and their embeddings"""
+        hits = [(pos, self.index[k]) for pos, k in enumerate(keys) if k in self.index]
+        if len(hits) == 0:
+            return np.zeros(0, dtype=np.int64), None
+        pos = np.array([p for p, _ in hits])
+        embs = np.stack([self.segments[seg][row] for _, (seg, row) in hits])
+        return pos, embs
+
+    def put(self, keys, embs):
+        new = [i for i, k in enumerate(keys) if k not in self.index]
+        if len(new) == 0:
+            return
+        keys, embs = np.asarray(keys)[new], np.asarray(embs)[new]
+        seg = max(self._segments(), default=-1) + 1
+        emb_file, key_file = [os.path.join(self.folder, f'seg_{seg}{suffix}') for suffix in ['.npy', '.keys.npy']]
+        # The keys file is the commit marker, a crash never leaves a segment with keys but no embeddings
+        save_npy_atomic(emb_file, embs)
+        save_npy_atomic(key_file, keys)
+        self.index.update({k: (seg, row) for row, k in enumerate(keys)})
+        self.segments[seg] = np.load(emb_file, mmap_mode='r')
+
+
+def encode_with_cache(texts, caches, encode_fn, keys=None, log=print):
+    """Encode only the texts missing from any of the caches (one cache per output of encode_fn).
+    encode_fn(texts) returns a tuple of embedding matrices, the assembled tuple keeps the order of texts.
+    """
+    keys = text_keys(texts) if keys is None else keys
+    found = [cache.get(keys) for cache in caches]
+    hit = np.ones(len(keys), dtype=bool)
+    for pos, _ in found:
+        cache_hit = np.zeros(len(keys), dtype=bool)
+        cache_hit[pos] = True
+        hit &= cache_hit
+    miss_keys, miss_first, miss_inverse = np.unique(keys[~hit], return_index=True, return_inverse=True)
+    miss_ids = np.nonzero(~hit)[0]
+    log(f'Embedding cache: {hit.sum()}/{len(keys)} hits, encoding {len(miss_keys)} unique texts')
+    new_embs = ()
+    if len(miss_keys) > 0:
+        new_embs = encode_fn([texts[i] for i in miss_ids[miss_first]])
+        for cache, emb in zip(caches, new_embs):
+            cache.put(miss_keys, emb)
+
+    embs = []
+    for i, (pos, cached) in enumerate(found):
+        dim = cached.shape[1] if cached is not None else new_embs[i].shape[1]
+        dtype = cached.dtype if cached is not None else new_embs[i].dtype
+        emb = np.empty((len(keys), dim), dtype=dtype)
+        if cached is not None:
+            emb[pos] = cached
+        if len(miss_keys) > 0:
+            emb[miss_ids] = new_embs[i][miss_inverse]
+        embs.append(emb)
+    return tuple(embs)
@@ -0,0 +1,129 @@
+import copy
+import os
+import time
+
+import numpy as np
+import torch as th
+import torch.multiprocessing as mp
+import torch.nn.functional as F
+
+PRECISIONS = ['fp32', 'fp16', 'bf16', 'int8']
+
+
+def default_precision():
+    return 'fp16' if th.cuda.is_available() else 'fp32'
+
+
+def apply_precision(model, precision):
+    """Set the inference precision of an embedding model exposing a `precision` attribute.
+    'int8' quantizes every nn.Linear dynamically (CPU only), 'bf16' makes the model forward run under autocast,
+    'fp16' is left to the HF Trainer.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f'Unknown precision {precision}, choose from {PRECISIONS}')
+    model.precision = precision
+    if precision == 'int8':
+        model = th.quantization.quantize_dynamic(model, {th.nn.Linear}, dtype=th.qint8)
+    return model
+
+
+@th.no_grad()
+def check_precision_drift(model, precision, batch, max_drift=0.01, log=print):
+    """Compare the embeddings of a sample batch under `precision` against fp32.
+    The drift of every output is 1 - cosine similarity, a mean drift above max_drift raises a ValueError.
+    """
+    model.eval()
+    model.precision = 'fp32'
+    ref = model(**batch).logits
+    low = apply_precision(copy.deepcopy(model), precision)
+    out = low(**batch).logits
+    ref, out = (ref, out) if isinstance(ref, tuple) else ((ref,), (out,))
+    drifts = []
+    for i, (r, o) in enumerate(zip(ref, out)):
+        drift = 1 - F.cosine_similarity(r.float(), o.float(), dim=1)
+        drifts.append(drift.mean().item())
+        log(f'{precision} drift of output #{i} on {len(drift)} samples: mean {drift.mean().item():.2e}, max {drift.max().item():.2e}')
+    if max(drifts) > max_drift:
+        raise ValueError(f'{precision} drift {max(drifts):.2e} exceeds {max_drift}, use a higher precision.')
+    return drifts
+
+
+class TextBatchBuilder:
+    """Tokenize the texts of a batch of node ids on the fly, padded to the longest text of the batch
+    (or to max_length with pad_to_max_length).
+    """
+
+    def __init__(self, tokenizer, texts, max_length, pad_to_max_length=False):
+        self.tokenizer = tokenizer
+        self.texts = texts
+        self.max_length = max_length
+        self.padding = 'max_length' if pad_to_max_length else True
+
+    def __call__(self, node_ids):
+        encoded = self.tokenizer([self.texts[i] for i in node_ids], padding=self.padding, truncation=True,
+                                 max_length=self.max_length, return_tensors='pt')
+        return {'input_ids': encoded['input_ids'], 'attention_mask': encoded['attention_mask']}
+
+
+class TokenBatchBuilder:
+    """Slice rows of a pre-tokenized token store, trimmed to the longest sequence of the batch.
+    The store opens its memory maps lazily, so every worker process gets its own read-only view.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def __call__(self, node_ids):
+        seq_len = max(int(self.store.lengths(node_ids).max()), 1)
+        return {k: th.from_numpy(self.store.get(k, node_ids, pad_to=seq_len).astype(np.int64)) for k in
+                ['input_ids', 'attention_mask']}
+
+
+def _inference_worker(rank, model_fn, batch_fn, node_ids, out_files, batch_size, n_threads, queue):
+    th.set_num_threads(n_threads)
+    model = model_fn()
+    model.eval()
+    outs = [np.load(f, mmap_mode='r+') for f in out_files]
+    start = time.time()
+    with th.no_grad():
+        for i in range(0, len(node_ids), batch_size):
+            batch_ids = node_ids[i:i + batch_size]
+            logits = model(**batch_fn(batch_ids)).logits
+            logits = logits if isinstance(logits, tuple) else (logits,)
+            for out, emb in zip(outs, logits):
+                out[batch_ids] = emb.float().numpy()
+    for out in outs:
+        out.flush()
+    queue.put((rank, len(node_ids), time.time() - start))
+
+
+def cpu_parallel_inference(model_fn, batch_fn, node_ids, out_files, n_workers, batch_size, threads_per_worker=None,
+                           log=print):
+    """Data-parallel inference on CPU.
+    The node ids are dealt round-robin to n_workers spawned processes, each building its own model with model_fn()
+    under a budget of threads_per_worker intra-op threads. Every worker writes its rows into the preallocated .npy
+    files in out_files (one per model output), so model_fn and batch_fn must be picklable: module level functions
+    (or partials of them) that every worker calls to build its own copy.
+    Pass node_ids sorted by text length to give every worker the same mix of long and short texts.
+    """
+    n_threads = threads_per_worker or max(1, (os.cpu_count() or 1) // n_workers)
+    node_ids = np.asarray(node_ids)
+    ctx = mp.get_context('spawn')
+    queue = ctx.SimpleQueue()
+    log(f'Start CPU inference on {len(node_ids)} nodes with {n_workers} workers x {n_threads} threads')
+    start = time.time()
+    workers = [ctx.Process(target=_inference_worker, args=(
+        rank, model_fn, batch_fn, node_ids[rank::n_workers], out_files, batch_size, n_threads, queue))
+               for rank in range(n_workers)]
+    for p in workers:
+        p.start()
+    for p in workers:
+        p.join()
+    failed = [rank for rank, p in enumerate(workers) if p.exitcode != 0]
+    if len(failed) > 0:
+        raise RuntimeError(f'CPU inference workers {failed} failed')
+    while not queue.empty():
+        rank, n_nodes, seconds = queue.get()
+        log(f'Worker #{rank}: {n_nodes} nodes in {seconds:.1f}s, {n_nodes / max(seconds, 1e-9):.1f} nodes/sec')
+    seconds = time.time() - start
+    log(f'CPU inference finished: {len(node_ids)} nodes in {seconds:.1f}s, {len(node_ids) / seconds:.1f} nodes/sec')
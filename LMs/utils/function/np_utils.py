@@ -1,5 +1,7 @@
 import gc
+import json
 import os.path
+from contextlib import contextmanager
 
 import numpy as np
 from tqdm import tqdm as tqdm
@@ -40,3 +42,45 @@ def save_memmap(data: np.ndarray, path, dtype=None, node_chunk_size=1000000, log
     gc.collect()
     log('releas x')
     return # SN(type=dtype, path=path, shape=data.shape)
+
+
+def open_npy_memmap(path, shape, dtype=np.float32, log=print):
+    # ! Preallocate a memory-mapped .npy (with header, readable by np.load) or reopen an existing one to resume writing
+    shape = tuple(shape)
+    if os.path.exists(path):
+        x = np.load(path, mmap_mode='r+')
+        if x.shape != shape or x.dtype != np.dtype(dtype):
+            raise ValueError(f'{path} is {x.shape} {x.dtype}, expected {shape} {np.dtype(dtype)}')
+        log(f'Reopened {path}...')
+    else:
+        x = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+        log(f'Allocated {path} as {np.dtype(dtype)} {shape}...')
+    return x
+
+
+@contextmanager
+def atomic_path(path):
+    """Yield a temporary path next to path, renamed onto path once the block exits cleanly.
+    Readers only ever see a complete file: a crash (or a concurrent writer, the name is private to the process)
+    leaves a stray .tmp file behind instead of a truncated path.
+    """
+    root, ext = os.path.splitext(path)
+    tmp_path = f'{root}.{os.getpid()}.tmp{ext}'
+    try:
+        yield tmp_path
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+
+
+def save_npy_atomic(path, array):
+    with atomic_path(path) as tmp_path:
+        np.save(tmp_path, array)
+
+
+def save_json_atomic(path, obj):
+    with atomic_path(path) as tmp_path:
+        with open(tmp_path, 'w') as f:
+            json.dump(obj, f)